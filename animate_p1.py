@@ -2,31 +2,17 @@ import matplotlib.pyplot as plt
 from matplotlib import animation
 import numpy as np
 
+from control_schedules import p1_schedule
+
 timestep = 1e-4
 decision_interval = 0.05
 run_time = 6
 
 def p1_control_signal(run_time: float, time_step: float) -> np.ndarray:
     """Returns a P1 signal [0,1].
-    The control signal is a 2D array of shape (num_time_steps, 2)"""
-    
-    # P1 signal is a 2D array of shape (num_time_steps, 1)
-    p1_signal = np.ones((int(run_time / time_step), 1))
-    
-    T_high = 1.5  # seconds
-    T_low = 0.5  # seconds
-    
-    # Create a square wave signal with T_high and T_low= T_high/T_ratio
-    signal_low = np.zeros(int(T_low / time_step))
-    signal_high = np.ones(int(T_high / time_step))
-    signal = np.concatenate([signal_high, signal_low])
-    num_repeats = int(run_time / time_step / len(signal))
-    p1_signal = np.tile(signal, num_repeats)
-    # fille up the rest of the signal with ones (resting state)
-    p1_signal = np.concatenate([p1_signal, np.ones(int(run_time / time_step) - len(p1_signal))])
-    
-    
-    return p1_signal
+    The control signal is a 1D array of shape (num_time_steps,). Use
+    ``control_schedules.p1_schedule`` to evaluate it lazily instead."""
+    return p1_schedule(run_time).sample(run_time, time_step)
 
 def plot_signal(p1_signal, name: str):
     fig, ax = plt.subplots(1, 1, figsize=(5, 4), tight_layout=True)
@@ -0,0 +1,220 @@
+from itertools import combinations
+from typing import List, Sequence, Union
+
+import numpy as np
+
+
+# Fraction of the summed bounding radii of its geoms taken as the
+# negative margin of a disabled pair
+_DISABLED_MARGIN_FRACTION = 0.99
+
+
+def disabled_pair_margin(model, pair_ids: np.ndarray) -> np.ndarray:
+    """Returns margins disabling the contact pairs ``pair_ids`` of a
+    compiled model.
+
+    The margin of each pair is nearly minus the sum of the bounding radii
+    of its geoms: MuJoCo rejects the pair at the bounding-sphere test
+    unless the centers of the geoms nearly coincide, and a contact would
+    need a penetration of nearly the size of the geoms. Margins further
+    below zero are not cheaper but much slower: with mujoco 3.1.6 and two
+    flies, a margin of -1e6 on the pairs of one fly triples the collision
+    time of the model, while these margins halve it.
+    """
+    rbound = model.geom_rbound
+    return -_DISABLED_MARGIN_FRACTION * (
+        rbound[model.pair_geom1[pair_ids]] + rbound[model.pair_geom2[pair_ids]]
+    )
+
+
+def _collision_geoms(fly, collisions: Union[str, Sequence[str]]) -> List[str]:
+    if collisions == "all":
+        return [geom.name for geom in fly.model.find_all("geom")]
+    if isinstance(collisions, str):
+        from flygym.preprogrammed import get_collision_geometries
+
+        return get_collision_geometries(collisions)
+    return list(collisions)
+
+
+def add_inter_fly_contacts(
+    flies: Sequence,
+    collisions: Union[str, Sequence[str]] = "legs",
+    margin: float = 0.0,
+) -> int:
+    """Adds explicit contact pairs between the geoms of every two flies.
+
+    flygym builds the geoms of the flies with ``contype`` and
+    ``conaffinity`` 0: their contacts with the floor and with themselves
+    only come from explicit ``<pair>`` elements, and two flies do not
+    touch each other unless pairs are added between them, e.g. for
+    mounting or kicking. Call this before the flies are added to a
+    ``Simulation``.
+
+    Parameters
+    ----------
+    flies : Sequence[Fly]
+        The flies.
+    collisions : str or Sequence[str], optional
+        Geoms of each fly taking part in the contacts, given like the
+        ``self_collisions`` argument of the flies: "legs" (default),
+        "legs-no-coxa", "tarsi", "all", or a list of segment names.
+    margin : float, optional
+        Margin of the pairs, by default 0.
+
+    Returns
+    -------
+    int
+        Number of pairs added.
+    """
+    n_pairs = 0
+    for fly_a, fly_b in combinations(flies, 2):
+        geoms_b = [fly_b.model.find("geom", name) for name in _collision_geoms(fly_b, collisions)]
+        for name_a in _collision_geoms(fly_a, collisions):
+            geom_a = fly_a.model.find("geom", name_a)
+            for geom_b in geoms_b:
+                fly_a.model.contact.add(
+                    "pair",
+                    name=f"{name_a}_{fly_b.name}_{geom_b.name}",
+                    geom1=geom_a,
+                    geom2=geom_b,
+                    solref=fly_a.contact_solref,
+                    solimp=fly_a.contact_solimp,
+                    margin=margin,
+                )
+                n_pairs += 1
+    return n_pairs
+
+
+class CollisionManager:
+    """Enables the contacts between two flies only when they are close.
+
+    The explicit contact pairs of the compiled model that join geoms of
+    two different flies (see ``add_inter_fly_contacts``) are grouped by
+    pair of flies. Every ``check_interval`` steps, ``update`` measures the
+    distance between the roots of the flies: the pairs of flies farther
+    apart than ``radius + hysteresis`` get the negative margins of
+    ``disabled_pair_margin``, so that MuJoCo rejects them at the
+    bounding-sphere test, and they get
+    their original margin back once the flies come within ``radius``
+    (e.g. mounting or kicking). Floor and self-collision pairs are not
+    affected.
+
+    Parameters
+    ----------
+    sim : Simulation
+        The simulation; its physics must be built.
+    radius : float, optional
+        Distance in mm between the roots of two flies below which their
+        contacts are enabled, by default 5.
+    hysteresis : float, optional
+        Extra distance before the contacts are disabled again, by default 1.
+    check_interval : int, optional
+        Number of physics steps between two distance checks, by default 10.
+    """
+
+    def __init__(
+        self,
+        sim,
+        radius: float = 5.0,
+        hysteresis: float = 1.0,
+        check_interval: int = 10,
+    ):
+        from dm_control import mjcf
+
+        self.sim = sim
+        self.radius = radius
+        self.hysteresis = hysteresis
+        self.check_interval = check_interval
+        physics = sim.physics
+        model = physics.model
+
+        owner = np.full(model.ngeom, -1)
+        for i, fly in enumerate(sim.flies):
+            owner[np.atleast_1d(physics.bind(fly.model.find_all("geom")).element_id)] = i
+        fly1, fly2 = owner[model.pair_geom1], owner[model.pair_geom2]
+        self.pair_ids = {}
+        for i, j in combinations(range(len(sim.flies)), 2):
+            ids = np.flatnonzero(((fly1 == i) & (fly2 == j)) | ((fly1 == j) & (fly2 == i)))
+            if ids.size:
+                self.pair_ids[(i, j)] = ids
+        if not self.pair_ids:
+            raise ValueError(
+                "The model has no contact pairs between flies; add them with "
+                "add_inter_fly_contacts before building the simulation."
+            )
+        self._roots = [mjcf.get_attachment_frame(fly.model) for fly in sim.flies]
+        self._margin = model.pair_margin.copy()
+        self._disabled_margin = {
+            pair: disabled_pair_margin(model, ids) for pair, ids in self.pair_ids.items()
+        }
+
+        self.enabled = {pair: True for pair in self.pair_ids}
+        self.n_steps = 0
+        self.n_pair_steps_disabled = 0
+        self._n_disabled = 0
+        self.reset()
+
+    def _distances(self) -> np.ndarray:
+        xpos = np.atleast_2d(self.sim.physics.bind(self._roots).xpos)
+        return np.linalg.norm(xpos[:, np.newaxis] - xpos, axis=-1)
+
+    def _set(self, pair, enabled: bool):
+        ids = self.pair_ids[pair]
+        margin = self.sim.physics.model.pair_margin
+        margin[ids] = self._margin[ids] if enabled else self._disabled_margin[pair]
+        self.enabled[pair] = enabled
+
+    def _check(self, force: bool = False):
+        distances = self._distances()
+        for i, j in self.pair_ids:
+            if self.enabled[(i, j)] and not force:
+                enabled = bool(distances[i, j] <= self.radius + self.hysteresis)
+            else:
+                enabled = bool(distances[i, j] < self.radius)
+            if force or enabled != self.enabled[(i, j)]:
+                self._set((i, j), enabled)
+        self._n_disabled = sum(
+            len(ids) for pair, ids in self.pair_ids.items() if not self.enabled[pair]
+        )
+
+    def reset(self):
+        """Sets the contacts from the current positions of the flies and
+        clears the statistics; call after the simulation is reset."""
+        self._check(force=True)
+        self.n_steps = 0
+        self.n_pair_steps_disabled = 0
+
+    def update(self):
+        """Call after every physics step. Every ``check_interval`` steps,
+        enables or disables the contacts of each pair of flies."""
+        self.n_steps += 1
+        if self.n_steps % self.check_interval == 0:
+            self._check()
+        self.n_pair_steps_disabled += self._n_disabled
+
+    @property
+    def n_disabled(self) -> int:
+        """Number of contact pairs currently disabled."""
+        return self._n_disabled
+
+    def stats(self) -> dict:
+        """Number of steps, of inter-fly contact pairs and of pair-steps
+        in which a pair was disabled."""
+        n_pairs = sum(len(ids) for ids in self.pair_ids.values())
+        return {
+            "n_steps": self.n_steps,
+            "n_pairs": n_pairs,
+            "pair_steps_disabled": self.n_pair_steps_disabled,
+            "fraction_disabled": (
+                self.n_pair_steps_disabled / (n_pairs * self.n_steps)
+                if self.n_steps
+                else np.nan
+            ),
+        }
+
+    def restore(self):
+        """Puts back the original margins of all pairs."""
+        self.sim.physics.model.pair_margin[:] = self._margin
+        self.enabled = {pair: True for pair in self.pair_ids}
+        self._n_disabled = 0
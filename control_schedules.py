@@ -0,0 +1,236 @@
+from abc import ABC, abstractmethod
+from typing import Optional, Sequence, Tuple
+
+import numpy as np
+
+
+class Schedule(ABC):
+    """A control signal defined as a function of the simulation time.
+
+    Schedules are evaluated lazily: ``schedule(t)`` returns the value at
+    time ``t`` without building the full-resolution signal. ``t`` can be a
+    scalar or an array of times, in which case the output has the shape
+    of ``t`` (followed by the channel axis for multi-channel schedules).
+    """
+
+    def __call__(self, t):
+        return self.evaluate(np.asarray(t, dtype=float))
+
+    @abstractmethod
+    def evaluate(self, t: np.ndarray) -> np.ndarray:
+        """Returns the value at the times ``t``, a float array."""
+
+    def sample(self, run_time: float, time_step: float) -> np.ndarray:
+        """Returns the dense signal, one value per time step."""
+        return self(np.arange(int(run_time / time_step)) * time_step)
+
+    def __mul__(self, gain: float) -> "Schedule":
+        return Scaled(self, gain)
+
+    __rmul__ = __mul__
+
+
+class Constant(Schedule):
+    def __init__(self, value: float = 0.0):
+        self.value = value
+
+    def evaluate(self, t):
+        return np.full(t.shape, self.value, dtype=float)
+
+
+class SquareWave(Schedule):
+    """Square wave that starts with the high phase.
+
+    Parameters
+    ----------
+    t_high : float
+        Duration of the high phase in seconds.
+    t_low : float
+        Duration of the low phase in seconds.
+    high : float, optional
+        Value during the high phase, by default 1.
+    low : float, optional
+        Value during the low phase, by default 0.
+    end : float, optional
+        If given, only the full periods that fit before ``end`` are
+        played; the signal then holds ``rest``.
+    rest : float, optional
+        Value after the last full period, by default 1 (resting state).
+    """
+
+    def __init__(
+        self,
+        t_high: float,
+        t_low: float,
+        high: float = 1.0,
+        low: float = 0.0,
+        end: Optional[float] = None,
+        rest: float = 1.0,
+    ):
+        self.t_high = t_high
+        self.t_low = t_low
+        self.high = high
+        self.low = low
+        self.rest = rest
+        self.period = t_high + t_low
+        if end is None:
+            self.stop = np.inf
+        else:
+            self.stop = np.floor(end / self.period) * self.period
+
+    def evaluate(self, t):
+        value = np.where(np.mod(t, self.period) < self.t_high, self.high, self.low)
+        return np.where(t < self.stop, value, self.rest)
+
+
+class Sinusoid(Schedule):
+    """``offset + amplitude * sin(2 pi frequency t + phase)``.
+
+    If ``rectify`` is True, the absolute value of the sine is used.
+    """
+
+    def __init__(
+        self,
+        frequency: float,
+        amplitude: float = 1.0,
+        phase: float = 0.0,
+        offset: float = 0.0,
+        rectify: bool = False,
+    ):
+        self.frequency = frequency
+        self.amplitude = amplitude
+        self.phase = phase
+        self.offset = offset
+        self.rectify = rectify
+
+    def evaluate(self, t):
+        wave = np.sin(2 * np.pi * self.frequency * t + self.phase)
+        if self.rectify:
+            wave = np.abs(wave)
+        return self.offset + self.amplitude * wave
+
+
+class PiecewiseHold(Schedule):
+    """Holds ``values[i]`` from ``times[i]`` until ``times[i + 1]``.
+
+    Evaluation is a binary search over the segments. Times before the
+    first segment take the first value.
+
+    Parameters
+    ----------
+    times : Sequence[float]
+        Sorted start times of the segments.
+    values : np.ndarray
+        Values of the segments, of shape (n_segments,) or
+        (n_segments, n_channels).
+    """
+
+    def __init__(self, times: Sequence[float], values: np.ndarray):
+        self.times = np.asarray(times, dtype=float)
+        self.values = np.asarray(values, dtype=float)
+        if self.times.shape[0] != self.values.shape[0]:
+            raise ValueError("Number of segment times and values must match.")
+
+    def evaluate(self, t):
+        idx = np.searchsorted(self.times, t, side="right") - 1
+        return self.values[np.clip(idx, 0, None)]
+
+
+class InsertedStops(Schedule):
+    """Pauses a schedule during stops inserted into it.
+
+    The underlying schedule is played on its own clock, which does not
+    advance during a stop. This is equivalent to splicing blocks of
+    ``value`` into the dense signal, without building it.
+
+    Parameters
+    ----------
+    schedule : Schedule
+        The schedule to interrupt.
+    stops : Sequence[Tuple[float, float]]
+        (insert_time, duration) of each stop, where ``insert_time`` is
+        given on the clock of the underlying schedule.
+    base_duration : float, optional
+        Duration of the underlying schedule. Once it is played out, the
+        signal holds ``value``. This is used to append a final stop.
+    value : float, optional
+        Value during the stops, by default 0.
+    """
+
+    def __init__(
+        self,
+        schedule: Schedule,
+        stops: Sequence[Tuple[float, float]],
+        base_duration: Optional[float] = None,
+        value: float = 0.0,
+    ):
+        self.schedule = schedule
+        stops = np.array(sorted(stops), dtype=float).reshape(-1, 2)
+        self.durations = stops[:, 1]
+        self._cum_durations = np.concatenate([[0], np.cumsum(self.durations)])
+        # start of each stop on the simulation clock
+        self.starts = stops[:, 0] + self._cum_durations[:-1]
+        self._ends = self.starts + self.durations if len(stops) else np.array([-np.inf])
+        self.base_duration = np.inf if base_duration is None else base_duration
+        self.value = value
+
+    def evaluate(self, t):
+        idx = np.searchsorted(self.starts, t, side="right") - 1
+        in_stop = (idx >= 0) & (t < self._ends[np.clip(idx, 0, None)])
+        base_t = t - self._cum_durations[idx + 1]
+        base_value = self.schedule(np.where(in_stop, 0, base_t))
+        hold = in_stop | (base_t >= self.base_duration)
+        hold = hold.reshape(hold.shape + (1,) * (base_value.ndim - hold.ndim))
+        return np.where(hold, self.value, base_value)
+
+
+class Stacked(Schedule):
+    """Combines single-channel schedules into a multi-channel one."""
+
+    def __init__(self, schedules: Sequence[Schedule]):
+        self.schedules = list(schedules)
+
+    def evaluate(self, t):
+        return np.stack([schedule(t) for schedule in self.schedules], axis=-1)
+
+
+class Scaled(Schedule):
+    def __init__(self, schedule: Schedule, gain: float):
+        self.schedule = schedule
+        self.gain = gain
+
+    def evaluate(self, t):
+        return self.gain * self.schedule(t)
+
+
+def p1_schedule(run_time: float, t_high: float = 1.5, t_low: float = 0.5) -> Schedule:
+    """P1 signal in [0, 1]: a square wave over the full periods that fit in
+    ``run_time``, followed by ones (resting state)."""
+    return SquareWave(t_high=t_high, t_low=t_low, end=run_time)
+
+
+def female_walking_schedule(
+    run_time: float,
+    t_stop_middle: float = 1.3,
+    t_stop_end: float = 1.8,
+    stop_insert_time: float = 0.8,
+    gain: float = 1.2,
+) -> Schedule:
+    """Descending drive of the chased female fly, of shape (..., 2).
+
+    The female alternates between turning left and right
+    (``|cos(pi t / 2)|`` and ``|sin(pi t / 2)|``), stops for
+    ``t_stop_middle`` seconds after ``stop_insert_time`` seconds of
+    walking and stops for ``t_stop_end`` seconds at the end of the run.
+    """
+    walking = Stacked(
+        [
+            Sinusoid(frequency=0.25, phase=np.pi / 2, rectify=True),
+            Sinusoid(frequency=0.25, rectify=True),
+        ]
+    )
+    return InsertedStops(
+        gain * walking,
+        stops=[(stop_insert_time, t_stop_middle)],
+        base_duration=run_time - t_stop_middle - t_stop_end,
+    )
@@ -0,0 +1,338 @@
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from mating_decision import SENSOR_WEIGHTS, MatingDecisionEngine
+
+
+def stack_history(obs_history: Sequence[dict], fly: str) -> Dict[str, np.ndarray]:
+    """Stacks the observations of one fly over a run.
+
+    Parameters
+    ----------
+    obs_history : Sequence[dict]
+        Observations returned by ``Simulation.step``, keyed by fly name.
+    fly : str
+        Name of the fly.
+
+    Returns
+    -------
+    Dict[str, np.ndarray]
+        ``"pos"``: positions of shape (T, 3); ``"odor"``: odor intensities
+        of shape (T, k, w).
+    """
+    return {
+        "pos": np.array([obs[fly]["fly"][0] for obs in obs_history]),
+        "odor": np.array([obs[fly]["odor_intensity"] for obs in obs_history]),
+    }
+
+
+def left_right_intensity(
+    odor: np.ndarray, weights: Optional[Sequence[float]] = SENSOR_WEIGHTS
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Averages odor intensities over the sensor types.
+
+    Parameters
+    ----------
+    odor : np.ndarray
+        Odor intensities of shape (T, k, 4), ordered like the fly
+        observation: (antenna, palp) x (left, right).
+    weights : Sequence[float], optional
+        Weights of the two sensor types, by default those of
+        ``OdorTaxisFly.process_odor_intensities``. None weights them
+        equally.
+
+    Returns
+    -------
+    I_l, I_r : np.ndarray
+        Left and right intensities, each of shape (T, k).
+    """
+    odor = np.asarray(odor)
+    odor = odor.reshape(*odor.shape[:-1], 2, 2)
+    weights = np.ones(2) if weights is None else np.asarray(weights, dtype=float)
+    I = np.einsum("...sl,s->...l", odor, weights / weights.sum())
+    return I[..., 0], I[..., 1]
+
+
+def asymmetry(I_l: np.ndarray, I_r: np.ndarray) -> np.ndarray:
+    """Left-right asymmetry of the odor intensities, computed as in
+    ``OdorTaxisFly.process_odor_intensities``."""
+    denom = (I_l + I_r) / 2 + 1e-6
+    denom = np.where(denom == 0, 1, denom)
+    return (I_l - I_r) / denom
+
+
+def turning_drive(delta_I: np.ndarray, odor_gains: Sequence[float]) -> np.ndarray:
+    """Weighted sum ``s`` of the asymmetries of shape (T, k) -> (T,)."""
+    return delta_I @ np.asarray(odor_gains, dtype=float)
+
+
+def inter_fly_distance(pos_a: np.ndarray, pos_b: np.ndarray) -> np.ndarray:
+    """Distance in the xy plane between two trajectories of shape (T, 3)."""
+    return np.linalg.norm(pos_a[:, :2] - pos_b[:, :2], axis=1)
+
+
+def decision_timeline(
+    odor: np.ndarray,
+    timestep: Union[float, np.ndarray],
+    odor_threshold: Sequence[float] = (0.119, 0.03),
+    odor_own_smelling: float = 0.1,
+    time_before_decision: float = 1.0,
+    time_since_odor_high: float = 0.0,
+) -> Tuple[np.ndarray, float]:
+    """Replays ``MatingDecisionEngine.update`` over a whole run at once.
+
+    The states are computed by a ``MatingDecisionEngine``; only the time
+    spent with a high odor is accumulated differently, as the length of
+    the current run of high samples, from a cumulative sum reset at every
+    low sample instead of a Python loop. It matches the engine up to
+    floating-point rounding.
+
+    Parameters
+    ----------
+    odor : np.ndarray
+        Odor intensities sensed by the female, of shape (T, k, w).
+    timestep : float or np.ndarray
+        Time between two samples, or one value per sample of shape (T,).
+    odor_threshold, odor_own_smelling, time_before_decision
+        As in ``MatingDecisionEngine``.
+    time_since_odor_high : float, optional
+        Value carried over from the previous chunk of the run.
+
+    Returns
+    -------
+    states : np.ndarray
+        ``MatingDecision`` values of shape (T,).
+    time_since_odor_high : float
+        Value to pass with the next chunk.
+    """
+    odor = np.asarray(odor)
+    n = odor.shape[0]
+    if n == 0:
+        return np.zeros(0, dtype=np.int8), time_since_odor_high
+    engine = MatingDecisionEngine(
+        odor_threshold=odor_threshold,
+        odor_own_smelling=odor_own_smelling,
+        time_before_decision=time_before_decision,
+        num_sensors=odor.shape[-1],
+    )
+    smelled = engine.smelled_intensity(odor)
+    odor_high = engine.odor_high(smelled)
+
+    increments = np.where(odor_high, np.broadcast_to(timestep, (n,)), 0.0)
+    elapsed = np.cumsum(increments)
+    idx = np.arange(n)
+    last_low = np.maximum.accumulate(np.where(odor_high, -1, idx))
+    # runs that started in a previous chunk continue from the carried value
+    start = np.where(last_low >= 0, elapsed[np.maximum(last_low, 0)], -time_since_odor_high)
+    time_high = np.where(odor_high, elapsed - start, 0.0)
+    return engine.classify(smelled, time_high), float(time_high[-1])
+
+
+def analyze(
+    male: Dict[str, np.ndarray],
+    female: Dict[str, np.ndarray],
+    odor_gains: Sequence[float],
+    timestep: Union[float, np.ndarray],
+    time_since_odor_high: float = 0.0,
+    **decision_kwargs,
+) -> Tuple[Dict[str, np.ndarray], float]:
+    """Computes the summary of a (chunk of a) courtship run.
+
+    Parameters
+    ----------
+    male, female : Dict[str, np.ndarray]
+        Stacked ``"pos"`` and ``"odor"`` arrays of each fly, as returned
+        by ``stack_history`` or read from a run log.
+    odor_gains : Sequence[float]
+        Gains of the male odor taxis.
+    timestep : float or np.ndarray
+        Time between two samples.
+    time_since_odor_high : float, optional
+        Carried over from the previous chunk.
+    **decision_kwargs
+        Passed to ``decision_timeline``.
+
+    Returns
+    -------
+    summary : Dict[str, np.ndarray]
+        Per-sample left/right intensities of both flies (T, k), the
+        asymmetry and turning drive of the male, the inter-fly distance
+        and the female decision states.
+    time_since_odor_high : float
+        Value to pass with the next chunk.
+    """
+    male_l, male_r = left_right_intensity(male["odor"])
+    female_l, female_r = left_right_intensity(female["odor"])
+    delta_I = asymmetry(male_l, male_r)
+    states, time_since_odor_high = decision_timeline(
+        female["odor"],
+        timestep,
+        time_since_odor_high=time_since_odor_high,
+        **decision_kwargs,
+    )
+    summary = {
+        "male_I_l": male_l,
+        "male_I_r": male_r,
+        "female_I_l": female_l,
+        "female_I_r": female_r,
+        "delta_I": delta_I,
+        "turning_drive": turning_drive(delta_I, odor_gains),
+        "distance": inter_fly_distance(male["pos"], female["pos"]),
+        "female_state": states,
+    }
+    return summary, time_since_odor_high
+
+
+class RunLogWriter:
+    """Writes the observations of a run to disk in fixed-size chunks.
+
+    Each chunk is an ``.npz`` file holding, for every recorded fly, its
+    positions (``"<fly>.pos"``) and odor intensities (``"<fly>.odor"``)
+    plus the simulation times (``"time"``), so that only one chunk is
+    held in memory while recording or analyzing.
+
+    Parameters
+    ----------
+    path : str or Path
+        Directory of the log; created if needed.
+    flies : Sequence[str]
+        Names of the flies to record.
+    chunk_size : int, optional
+        Number of samples per file, by default 10000.
+    timestep : float, optional
+        Time between two samples, e.g. the physics timestep when
+        recording every step. It is stored with each chunk (``"timestep"``)
+        so that ``analyze_run`` does not infer it from the times.
+    """
+
+    def __init__(
+        self,
+        path: Union[str, Path],
+        flies: Sequence[str] = ("male", "female"),
+        chunk_size: int = 10000,
+        timestep: Optional[float] = None,
+    ):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.flies = tuple(flies)
+        self.chunk_size = chunk_size
+        self.timestep = timestep
+        self._n_chunks = 0
+        self._buffer = {}
+
+    def record(self, obs: dict, time: float):
+        """Appends the observation returned by ``Simulation.step``."""
+        self._buffer.setdefault("time", []).append(time)
+        for fly in self.flies:
+            self._buffer.setdefault(f"{fly}.pos", []).append(obs[fly]["fly"][0].copy())
+            self._buffer.setdefault(f"{fly}.odor", []).append(
+                obs[fly]["odor_intensity"].copy()
+            )
+        if len(self._buffer["time"]) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        """Writes the buffered samples, if any, as a new chunk."""
+        if not self._buffer.get("time"):
+            return
+        arrays = {key: np.array(values) for key, values in self._buffer.items()}
+        if self.timestep is not None:
+            arrays["timestep"] = np.array(self.timestep)
+        np.savez(self.path / f"chunk_{self._n_chunks:05d}.npz", **arrays)
+        self._n_chunks += 1
+        self._buffer = {}
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def iter_run_log(path: Union[str, Path]) -> Iterator[Dict[str, Dict[str, np.ndarray]]]:
+    """Yields the chunks of a run log in order, as ``{"time": ...,
+    "<fly>": {"pos": ..., "odor": ...}}``, plus ``"timestep"`` if it was
+    recorded."""
+    for file in sorted(Path(path).glob("chunk_*.npz")):
+        with np.load(file) as data:
+            chunk = {}
+            for key in data.files:
+                if key == "time":
+                    chunk["time"] = data[key]
+                elif key == "timestep":
+                    chunk["timestep"] = float(data[key])
+                else:
+                    fly, field = key.rsplit(".", 1)
+                    chunk.setdefault(fly, {})[field] = data[key]
+        yield chunk
+
+
+def analyze_run(
+    chunks: Union[str, Path, Iterable[dict]],
+    odor_gains: Sequence[float],
+    male: str = "male",
+    female: str = "female",
+    timestep: Optional[float] = None,
+    **decision_kwargs,
+) -> Dict[str, np.ndarray]:
+    """Analyzes a run one chunk at a time.
+
+    Parameters
+    ----------
+    chunks : str, Path or Iterable[dict]
+        A run log directory written by ``RunLogWriter``, or chunks as
+        yielded by ``iter_run_log``.
+    odor_gains : Sequence[float]
+        Gains of the male odor taxis.
+    male, female : str, optional
+        Names of the flies.
+    timestep : float, optional
+        Time between two samples. By default the one recorded in the log;
+        for logs without it, the differences between the sample times,
+        the first sample of the run taking the interval to the second
+        one.
+    **decision_kwargs
+        Passed to ``decision_timeline``.
+
+    Returns
+    -------
+    Dict[str, np.ndarray]
+        The summary of ``analyze`` over the whole run, plus ``"time"``.
+    """
+    if isinstance(chunks, (str, Path)):
+        chunks = iter_run_log(chunks)
+    parts = []
+    time_since_odor_high = 0.0
+    last_time = None
+    for chunk in chunks:
+        time = chunk["time"]
+        chunk_timestep = timestep if timestep is not None else chunk.get("timestep")
+        if chunk_timestep is None:
+            # time between samples, continued across chunk boundaries
+            if last_time is None:
+                if len(time) < 2:
+                    raise ValueError(
+                        "The timestep cannot be inferred from a single sample; "
+                        "pass it as timestep."
+                    )
+                last_time = 2 * time[0] - time[1]
+            chunk_timestep = np.diff(time, prepend=last_time)
+        summary, time_since_odor_high = analyze(
+            chunk[male],
+            chunk[female],
+            odor_gains,
+            chunk_timestep,
+            time_since_odor_high=time_since_odor_high,
+            **decision_kwargs,
+        )
+        summary["time"] = time
+        parts.append(summary)
+        last_time = time[-1]
+    if not parts:
+        return {}
+    return {key: np.concatenate([part[key] for part in parts]) for key in parts[0]}
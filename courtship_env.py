@@ -0,0 +1,402 @@
+from functools import partial
+from typing import Optional, Tuple
+
+import numpy as np
+import gymnasium as gym
+from gymnasium import spaces
+
+from control_schedules import Schedule, female_walking_schedule
+from mating_decision import MatingDecision
+from viz_state import sync_visuals
+
+
+def make_courtship_pair(
+    timestep: float,
+    odor_dimensions: int,
+    odor_threshold: float,
+    odor_gains: np.ndarray,
+    decision_interval: float = 0.05,
+    male_spawn_pos=(0, 0, 0),
+    female_spawn_pos=(10, 0, 0),
+    female_odor_threshold=(0.119, 0.03),
+    male_name: str = "male",
+    female_name: str = "female",
+    **fly_kwargs,
+):
+    """Returns the chasing male and the chased female of the courtship
+    scenario, configured as in final_courtship_scenario.ipynb. Extra
+    keyword arguments are passed to both flies, e.g.
+    ``self_collisions="none"`` to drop their self-collision pairs."""
+    from odor_turning_fly import OdorTaxisFly
+    from female_decision_hybri_turn_fly import FemaleDecisionHybriTurnFly
+
+    male = OdorTaxisFly(
+        name=male_name,
+        odor_threshold=odor_threshold,
+        odor_dimensions=odor_dimensions,
+        odor_gains=odor_gains,
+        decision_interval=decision_interval,
+        timestep=timestep,
+        enable_adhesion=True,
+        enable_olfaction=True,
+        spawn_pos=male_spawn_pos,
+        **fly_kwargs,
+    )
+    female = FemaleDecisionHybriTurnFly(
+        name=female_name,
+        timestep=timestep,
+        odor_dimensions=odor_dimensions,
+        odor_threshold=list(female_odor_threshold),
+        enable_adhesion=True,
+        enable_olfaction=True,
+        spawn_pos=female_spawn_pos,
+        **fly_kwargs,
+    )
+    return male, female
+
+
+def bind_odor_sources(arena, sim, obs: Optional[dict] = None):
+    """Moves the odor source of each fly to its current position. Odor
+    sources are ordered like ``sim.flies``. Without observations, the
+    positions are read from the body position sensors of the flies, as
+    in their observations."""
+    for j, fly in enumerate(sim.flies):
+        if obs is None:
+            arena.odor_source[j] = sim.physics.bind(fly._body_sensors[0]).sensordata
+        else:
+            arena.odor_source[j] = obs[fly.name]["fly"][0]
+
+
+def reset_arena(sim):
+    """Resets the arena of the simulation if it supports it, as
+    ``MovOdorArena`` does (odor sources, odor field and markers). flygym
+    does not reset the arena with the simulation; call it before
+    ``sim.reset`` so that the first observations see the reset arena."""
+    reset = getattr(sim.arena, "reset", None)
+    if reset is not None:
+        reset(sim.physics)
+
+
+def make_tiled_courtship(
+    n_pairs: int,
+    tile_spacing: Tuple[float, float] = (50, 50),
+    peak_odor_intensity: np.ndarray = np.array([[1, 0], [1, 0]]),
+    odor_threshold: float = 0.137,
+    odor_gains: np.ndarray = np.array([-100, 100]),
+    timestep: float = 1e-4,
+    decision_interval: float = 0.05,
+    female_offset=(10, 0, 0),
+    cameras=(),
+):
+    """Builds one ``Simulation`` holding many independent courtship pairs.
+
+    Each male/female pair is placed in its own tile of a tiled
+    ``MovOdorArena``, so that a fly only smells the flies of its pair.
+    All pairs are stepped together, which spreads the fixed per-step cost
+    of Python and MuJoCo over many trials.
+
+    Parameters
+    ----------
+    n_pairs : int
+        Number of courtship pairs.
+    tile_spacing : Tuple[float, float], optional
+        Distance in mm between neighboring tiles.
+    peak_odor_intensity : np.ndarray, optional
+        Peak intensities of the (male, female) odor sources of a pair.
+    female_offset : Tuple[float, float, float], optional
+        Spawn position of the female relative to the male.
+
+    Returns
+    -------
+    sim : Simulation
+        The simulation. The flies are ordered male_0, female_0, male_1...
+    arena : MovOdorArena
+        The tiled arena. Its odor sources are ordered like the flies.
+    pairs : List[Tuple[OdorTaxisFly, FemaleDecisionHybriTurnFly]]
+        The (male, female) pair of each tile.
+    """
+    from flygym import Simulation
+    from movodor_arena import MovOdorArena, tile_origins
+
+    peak_odor_intensity = np.array(peak_odor_intensity)
+    cols = int(np.ceil(np.sqrt(n_pairs)))
+    rows = int(np.ceil(n_pairs / cols))
+    origins = tile_origins((rows, cols), tile_spacing)[:n_pairs]
+    female_offset = np.array(female_offset, dtype=float)
+
+    pairs = [
+        make_courtship_pair(
+            timestep=timestep,
+            odor_dimensions=peak_odor_intensity.shape[1],
+            odor_threshold=odor_threshold,
+            odor_gains=odor_gains,
+            decision_interval=decision_interval,
+            male_spawn_pos=tuple(origin),
+            female_spawn_pos=tuple(origin + female_offset),
+            male_name=f"male_{i}",
+            female_name=f"female_{i}",
+        )
+        for i, origin in enumerate(origins)
+    ]
+    odor_source = np.concatenate([[origin, origin + female_offset] for origin in origins])
+    arena = MovOdorArena(
+        friction=(1, 0.005, 0.0001),
+        num_sensors=4,
+        move_speed=0,
+        move_direction="right",
+        odor_source=odor_source,
+        peak_intensity=np.tile(peak_odor_intensity, (n_pairs, 1)),
+        diffuse_func=lambda x: x**-2,
+        tile_grid=(rows, cols),
+        tile_spacing=tile_spacing,
+    )
+    sim = Simulation(
+        flies=[fly for pair in pairs for fly in pair],
+        cameras=list(cameras),
+        arena=arena,
+        timestep=timestep,
+    )
+    return sim, arena, pairs
+
+
+def pair_results(obs: dict, pairs) -> list:
+    """Summarizes the state of each courtship pair.
+
+    Returns a list with, for each pair, the positions of the flies, the
+    distance between them and the mating decision of the female.
+    """
+    results = []
+    for male, female in pairs:
+        male_pos = obs[male.name]["fly"][0]
+        female_pos = obs[female.name]["fly"][0]
+        results.append(
+            {
+                "male_pos": male_pos.copy(),
+                "female_pos": female_pos.copy(),
+                "distance": float(np.linalg.norm(male_pos[:2] - female_pos[:2])),
+                "female_state": MatingDecision(int(female.decision_engine.state[0])),
+            }
+        )
+    return results
+
+
+class CourtshipEnv(gym.Env):
+    """Two-fly courtship scenario as a Gymnasium environment.
+
+    The agent controls the descending drive of the male (``OdorTaxisFly``)
+    at the decision interval; the physics substeps of each decision are
+    run inside ``step``. The female walks according to a schedule and
+    decides to accept or reject the male from the odor she smells, which
+    terminates the episode.
+
+    Observation: odor intensities sensed by the male, of shape
+    (odor_dimensions, 4). Action: the male descending drive, of shape (2,).
+    Reward: decrease of the distance between the flies since the last
+    decision, plus 1 if the female accepts and minus 1 if she rejects.
+
+    Parameters
+    ----------
+    peak_odor_intensity : np.ndarray, optional
+        Peak intensities of the (male, female) odor sources, of shape
+        (2, odor_dimensions). By default both are attractive.
+    odor_threshold : float, optional
+        Attractive odor intensity at which the male stops.
+    odor_gains : np.ndarray, optional
+        Gains of the built-in male odor taxis, used by
+        ``CourtshipEnv.baseline_action``.
+    timestep : float, optional
+        Physics timestep.
+    decision_interval : float, optional
+        Simulation time between two actions.
+    run_time : float, optional
+        Duration of an episode; the episode is truncated afterwards.
+    female_schedule : Schedule, optional
+        Descending drive of the female as a function of time, by default
+        ``female_walking_schedule(run_time)``.
+    time_before_decision : float, optional
+        Time the male has to stay close before the female decides.
+    render_mode : str, optional
+        ``"rgb_array"`` to render the birdeye camera.
+    warm_start : WarmStartCache, optional
+        If given, episodes start from the state reached after both flies
+        stood still for ``settle_time``, settled once and then restored
+        from the cache. The settled state is shared by all seeds. The
+        simulation time is restored with the rest of the state, so that
+        the physics, the arena and the controllers agree on it; the
+        female schedule, the truncation and the ``"time"`` of the infos
+        count from the start of the episode.
+    settle_time : float, optional
+        Settling time used with ``warm_start``, by default 0.2 s.
+    """
+
+    metadata = {"render_modes": ["rgb_array"]}
+
+    def __init__(
+        self,
+        peak_odor_intensity: np.ndarray = np.array([[1, 0], [1, 0]]),
+        odor_threshold: float = 0.137,
+        odor_gains: np.ndarray = np.array([-100, 100]),
+        timestep: float = 1e-4,
+        decision_interval: float = 0.05,
+        run_time: float = 6,
+        female_schedule: Optional[Schedule] = None,
+        time_before_decision: float = 2.0,
+        render_mode: Optional[str] = None,
+        window_size: Tuple[int, int] = (800, 608),
+        warm_start=None,
+        settle_time: float = 0.2,
+    ):
+        from flygym import Simulation
+        from movodor_arena import MovOdorArena
+
+        self.peak_odor_intensity = np.array(peak_odor_intensity)
+        self.odor_dimensions = self.peak_odor_intensity.shape[1]
+        self.timestep = timestep
+        self.decision_interval = decision_interval
+        self.physics_steps_per_decision = int(decision_interval / timestep)
+        self.run_time = run_time
+        self.time_before_decision = time_before_decision
+        if female_schedule is None:
+            female_schedule = female_walking_schedule(run_time)
+        self.female_schedule = female_schedule
+        self.render_mode = render_mode
+        self.window_size = window_size
+        self.warm_start = warm_start
+        self.settle_time = settle_time
+
+        self.male, self.female = make_courtship_pair(
+            timestep=timestep,
+            odor_dimensions=self.odor_dimensions,
+            odor_threshold=odor_threshold,
+            odor_gains=odor_gains,
+            decision_interval=decision_interval,
+        )
+        self._initial_odor_source = np.array([[0, 0, 0], [10, 0, 0]], dtype=float)
+        self.arena = MovOdorArena(
+            size=(300, 300),
+            friction=(1, 0.005, 0.0001),
+            num_sensors=4,
+            move_speed=0,
+            move_direction="right",
+            odor_source=self._initial_odor_source,
+            peak_intensity=self.peak_odor_intensity,
+            diffuse_func=lambda x: x**-2,
+        )
+        self.sim = Simulation(
+            flies=[self.male, self.female],
+            cameras=[],
+            arena=self.arena,
+            timestep=timestep,
+        )
+
+        self.action_space = spaces.Box(
+            *self.male.amplitude_range, shape=(2,), dtype=np.float32
+        )
+        self.observation_space = spaces.Box(
+            0, np.inf, shape=(self.odor_dimensions, 4), dtype=np.float32
+        )
+        self._sim_obs = None
+        self._distance = None
+        self._episode_start = 0.0
+
+    def _get_obs(self) -> np.ndarray:
+        return self._sim_obs["male"]["odor_intensity"].astype(np.float32)
+
+    def _get_distance(self) -> float:
+        male_pos = self._sim_obs["male"]["fly"][0, :2]
+        female_pos = self._sim_obs["female"]["fly"][0, :2]
+        return float(np.linalg.norm(male_pos - female_pos))
+
+    @property
+    def episode_time(self) -> float:
+        """Simulation time since the start of the episode."""
+        return self.sim.curr_time - self._episode_start
+
+    def _get_info(self) -> dict:
+        return {
+            "time": self.episode_time,
+            "distance": self._distance,
+            "female_state": int(self.female.decision_engine.state[0]),
+        }
+
+    def baseline_action(self) -> np.ndarray:
+        """Returns the action of the hand-tuned odor taxis controller."""
+        return self.male.process_odor_intensities(self._sim_obs["male"]["odor_intensity"])
+
+    def reset(self, seed=None, options=None):
+        super().reset(seed=seed)
+        self.female.decision_engine.reset()
+        self.female.hybrid_turning = True
+        self.male.odor_turning = True
+        reset_arena(self.sim)
+        if self.warm_start is None:
+            self._sim_obs, _ = self.sim.reset(seed=seed)
+        else:
+            from warm_start import hold_action
+
+            stand = {"male": np.zeros(2), "female": np.zeros(2)}
+            self._sim_obs, _ = self.warm_start.reset(
+                self.sim,
+                hold_action(stand, self.settle_time),
+                settle_id=f"courtship-stand-{self.settle_time}",
+                seed=seed,
+            )
+        self._episode_start = self.sim.curr_time
+        self._distance = self._get_distance()
+        return self._get_obs(), self._get_info()
+
+    def step(self, action):
+        action = np.asarray(action, dtype=float)
+        female_action = self.female_schedule(self.episode_time)
+        for _ in range(self.physics_steps_per_decision):
+            obs, _, _, _, _ = self.sim.step({"male": action, "female": female_action})
+            bind_odor_sources(self.arena, self.sim, obs)
+        self._sim_obs = obs
+
+        state = self.female.get_female_mating_state(
+            obs["female"]["odor_intensity"],
+            timestep=self.decision_interval,
+            time_before_decision=self.time_before_decision,
+        )
+        distance = self._get_distance()
+        reward = self._distance - distance
+        self._distance = distance
+        terminated = state in (MatingDecision.ACCEPT, MatingDecision.REJECT)
+        if state == MatingDecision.ACCEPT:
+            reward += 1.0
+        elif state == MatingDecision.REJECT:
+            reward -= 1.0
+        # up to the round-off errors of the accumulated time
+        truncated = self.episode_time > self.run_time - self.timestep / 2
+        return self._get_obs(), reward, terminated, truncated, self._get_info()
+
+    def render(self):
+        if self.render_mode == "rgb_array":
+            sync_visuals(self.sim)
+            width, height = self.window_size
+            return self.sim.physics.render(
+                width=width, height=height, camera_id="birdeye_cam"
+            )
+
+    def close(self):
+        self.sim.close()
+
+
+def make_vector_env(num_envs: int, asynchronous: bool = False, **kwargs) -> gym.vector.VectorEnv:
+    """Returns ``num_envs`` copies of ``CourtshipEnv`` stepped together.
+
+    Parameters
+    ----------
+    num_envs : int
+        Number of environments.
+    asynchronous : bool, optional
+        If True, each environment runs in its own subprocess
+        (``AsyncVectorEnv``); otherwise they are stepped one after the
+        other in this process (``SyncVectorEnv``).
+    **kwargs
+        Passed to ``CourtshipEnv``.
+    """
+    env_fns = [partial(CourtshipEnv, **kwargs) for _ in range(num_envs)]
+    if asynchronous:
+        return gym.vector.AsyncVectorEnv(env_fns, context="spawn")
+    return gym.vector.SyncVectorEnv(env_fns)
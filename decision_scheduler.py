@@ -0,0 +1,136 @@
+import numpy as np
+
+
+class AdaptiveDecisionScheduler:
+    """Chooses the interval until the next decision of an odor-taxis fly.
+
+    The interval is shortened when the odor signal changes quickly or
+    when the attractive intensity is close to the stopping threshold,
+    and lengthened while the signal stays stable. It always stays within
+    ``[min_interval, max_interval]``.
+
+    Parameters
+    ----------
+    initial_interval : float, optional
+        Interval of the first decision, by default 0.05 s.
+    min_interval : float, optional
+        Shortest interval, by default 0.01 s.
+    max_interval : float, optional
+        Longest interval, by default 0.2 s.
+    rate_tolerance : float, optional
+        Rate of change (per second) of the asymmetry ``delta_I`` and of
+        the relative intensity above which the signal is considered to
+        change quickly, by default 2. Below a quarter of it, the signal
+        is considered stable.
+    threshold_margin : float, optional
+        Relative distance to ``odor_threshold`` within which the shortest
+        interval is used, by default 0.2.
+    shrink : float, optional
+        Factor applied to the interval when the signal changes quickly,
+        by default 0.5.
+    grow : float, optional
+        Factor applied to the interval when the signal is stable, by
+        default 1.25.
+    reference_interval : float, optional
+        Fixed interval the savings are counted against, by default 0.05 s.
+
+    The simulated time the savings are computed over is counted by
+    ``advance``, which ``OdorTaxisFly`` calls at every physics step, so an
+    interval cut short by the end of a run only counts for the time
+    actually simulated.
+    """
+
+    def __init__(
+        self,
+        initial_interval: float = 0.05,
+        min_interval: float = 0.01,
+        max_interval: float = 0.2,
+        rate_tolerance: float = 2.0,
+        threshold_margin: float = 0.2,
+        shrink: float = 0.5,
+        grow: float = 1.25,
+        reference_interval: float = 0.05,
+    ):
+        if not min_interval <= initial_interval <= max_interval:
+            raise ValueError("initial_interval must be within [min_interval, max_interval]")
+        self.initial_interval = initial_interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.rate_tolerance = rate_tolerance
+        self.threshold_margin = threshold_margin
+        self.shrink = shrink
+        self.grow = grow
+        self.reference_interval = reference_interval
+        self.reset()
+
+    def reset(self):
+        self.interval = self.initial_interval
+        self.n_decisions = 0
+        self.elapsed = 0.0
+        self._prev_intensity = None
+        self._prev_delta_I = None
+
+    def update(self, intensity: np.ndarray, delta_I: np.ndarray, odor_threshold: float) -> float:
+        """Registers a decision and returns the interval until the next one.
+
+        Parameters
+        ----------
+        intensity : np.ndarray
+            Left and right intensities of shape (odor_dimensions, 2); the
+            first odor dimension is the attractive one.
+        delta_I : np.ndarray
+            Left-right asymmetry of shape (odor_dimensions,).
+        odor_threshold : float
+            Attractive intensity at which the fly stops.
+
+        Returns
+        -------
+        float
+            The new decision interval.
+        """
+        self.n_decisions += 1
+        near_threshold = (
+            abs(intensity[0].max() - odor_threshold)
+            <= self.threshold_margin * odor_threshold
+        )
+        if near_threshold:
+            interval = self.min_interval
+        elif self._prev_intensity is None:
+            interval = self.interval
+        else:
+            asymmetry_rate = np.abs(delta_I - self._prev_delta_I).max() / self.interval
+            intensity_rate = (
+                np.abs(intensity - self._prev_intensity)
+                / (np.abs(self._prev_intensity) + 1e-6)
+            ).max() / self.interval
+            rate = max(asymmetry_rate, intensity_rate)
+            if rate > self.rate_tolerance:
+                interval = self.interval * self.shrink
+            elif rate < self.rate_tolerance / 4:
+                interval = self.interval * self.grow
+            else:
+                interval = self.interval
+
+        self._prev_intensity = np.array(intensity, dtype=float)
+        self._prev_delta_I = np.array(delta_I, dtype=float)
+        self.interval = float(np.clip(interval, self.min_interval, self.max_interval))
+        return self.interval
+
+    def advance(self, dt: float):
+        """Counts ``dt`` of simulated time."""
+        self.elapsed += dt
+
+    @property
+    def decisions_saved(self) -> float:
+        """Decisions avoided compared to the fixed ``reference_interval``
+        over the same simulated time (negative if more were taken)."""
+        return self.elapsed / self.reference_interval - self.n_decisions
+
+    def stats(self) -> dict:
+        return {
+            "n_decisions": self.n_decisions,
+            "elapsed": self.elapsed,
+            "mean_interval": self.elapsed / self.n_decisions if self.n_decisions else np.nan,
+            "reference_decisions": self.elapsed / self.reference_interval,
+            "decisions_saved": self.decisions_saved,
+        }
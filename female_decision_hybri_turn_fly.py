@@ -1,17 +1,24 @@
+from functools import lru_cache
+
 import numpy as np
-from tqdm import trange
 from gymnasium import spaces
-from gymnasium.utils.env_checker import check_env
 
 # from flygym.simulation import Fly
 from abdomen_fly import AbdomenFly
-from flygym.examples.common import PreprogrammedSteps
-from flygym.examples.cpg_controller import CPGNetwork
-from flygym.preprogrammed import get_cpg_biases
+from mating_decision import MatingDecision, MatingDecisionEngine
+from viz_state import VisualState
+
+
+@lru_cache(maxsize=None)
+def _tripod_cpg_params():
+    """Returns the tripod phase biases and coupling weights. They are
+    computed on first use rather than at import."""
+    from flygym.preprogrammed import get_cpg_biases
+
+    phase_biases = get_cpg_biases("tripod")
+    return phase_biases, (phase_biases > 0) * 10
 
 
-_tripod_phase_biases = get_cpg_biases("tripod")
-_tripod_coupling_weights = (_tripod_phase_biases > 0) * 10
 _default_correction_vectors = {
     "F": np.array([0, 0, 0, -0.02, 0, 0.016, 0]),
     "M": np.array([-0.015, 0, 0, 0.004, 0, 0.01, -0.008]),
@@ -35,8 +42,8 @@ class FemaleDecisionHybriTurnFly(AbdomenFly):
         odor_own_smelling=0.1,                # relative to odor
         intrinsic_freqs=np.ones(6) * 12,
         intrinsic_amps=np.ones(6) * 1,
-        phase_biases=_tripod_phase_biases,
-        coupling_weights=_tripod_coupling_weights,
+        phase_biases=None,
+        coupling_weights=None,
         convergence_coefs=np.ones(6) * 20,
         init_phases=None,
         init_magnitudes=None,
@@ -53,8 +60,16 @@ class FemaleDecisionHybriTurnFly(AbdomenFly):
         # Initialize core NMF simulation
         super().__init__(contact_sensor_placements=contact_sensor_placements, **kwargs)
 
+        # Imported here to keep importing this module cheap
+        from flygym.examples.common import PreprogrammedSteps
+        from flygym.examples.cpg_controller import CPGNetwork
+
         if preprogrammed_steps is None:
             preprogrammed_steps = PreprogrammedSteps()
+        if phase_biases is None:
+            phase_biases = _tripod_cpg_params()[0]
+        if coupling_weights is None:
+            coupling_weights = _tripod_cpg_params()[1]
 
         self.preprogrammed_steps = preprogrammed_steps
         self.intrinsic_freqs = intrinsic_freqs
@@ -68,13 +83,20 @@ class FemaleDecisionHybriTurnFly(AbdomenFly):
         self.correction_rates = correction_rates
         self.amplitude_range = amplitude_range
         self.draw_corrections = draw_corrections
+        self.visual_state = VisualState()
+        # Optional KinematicStandIn moving the fly along a trajectory
+        # instead of running its controller
+        self.kinematic_standin = None
 
         # Relative to odor
         self.odor_dimensions = odor_dimensions
         self.odor_threshold = odor_threshold
         self.odor_own_smelling = odor_own_smelling
-
-        self.time_since_odor_high = 0
+        self.decision_engine = MatingDecisionEngine(
+            n_flies=1,
+            odor_threshold=odor_threshold,
+            odor_own_smelling=odor_own_smelling,
+        )
 
         # Define action and observation spaces
         self.action_space = spaces.Box(*amplitude_range, shape=(2,))
@@ -165,7 +187,8 @@ class FemaleDecisionHybriTurnFly(AbdomenFly):
             Correction rates for increment and decrement.
         viz_segment : str
             Name of the segment to color code. If None, no color coding is
-            done.
+            done. The color is only written to the physics when it changes
+            and a frame is about to be rendered.
 
         Returns
         -------
@@ -181,10 +204,17 @@ class FemaleDecisionHybriTurnFly(AbdomenFly):
             new_amount = max(0, curr_amount - decrement)
             color = (1, 0, 0, 1)
         if viz_segment is not None:
-            self.change_segment_color(viz_segment, color)
+            self.visual_state.set_geom_rgba(f"{self.name}/{viz_segment}", color)
         return new_amount
 
+    def set_pose(self, pose, physics):
+        # the joints of the fly only exist in the full model
+        if self.kinematic_standin is not None:
+            self.kinematic_standin.restore_model(physics)
+        super().set_pose(pose, physics)
+
     def reset(self, sim, seed=None, init_phases=None, init_magnitudes=None, **kwargs):
+        self.visual_state.reset(sim.physics)
         obs, info = super().reset(sim, seed=seed, **kwargs)
         self.cpg_network.random_state = np.random.RandomState(seed)
         self.cpg_network.intrinsic_amps = self.intrinsic_amps
@@ -192,6 +222,8 @@ class FemaleDecisionHybriTurnFly(AbdomenFly):
         self.cpg_network.reset(init_phases, init_magnitudes)
         self.retraction_correction = np.zeros(6)
         self.stumbling_correction = np.zeros(6)
+        if self.kinematic_standin is not None:
+            self.kinematic_standin.reset(sim)
         return obs, info
 
     def pre_step(self, action, sim):
@@ -203,7 +235,9 @@ class FemaleDecisionHybriTurnFly(AbdomenFly):
             Array of shape (2,) containing descending signal encoding
             turning.
         """
-        
+        if self.kinematic_standin is not None and self.kinematic_standin.step(sim, self):
+            return
+
         # make sure action shape is correct for hybrid turning or normal joint control
         if not self.hybrid_turning:
             assert isinstance(action, dict) and len(action)==2, f"Action must be a dictionary and of length 2, got {type(action)}."
@@ -266,6 +300,7 @@ class FemaleDecisionHybriTurnFly(AbdomenFly):
                 leg, self.cpg_network.curr_phases[i]
             )
             adhesion_onoff.append(my_adhesion_onoff)
+
         joints_angles = np.array(np.concatenate(joints_angles)).flatten()  
         
         # add joint angles for abdomen joints (A1A2, A3, A4, A5, A6)
@@ -286,6 +321,22 @@ class FemaleDecisionHybriTurnFly(AbdomenFly):
     def get_hybrid_turning(self):
         return self.hybrid_turning
     
+    @property
+    def time_since_odor_high(self):
+        return self.decision_engine.time_since_odor_high[0]
+
+    def get_female_mating_state(self, odor_intensities, timestep, time_before_decision=1.0):
+        """
+        Same as ``get_female_mating_decision`` but returns the decision as
+        a ``MatingDecision`` integer enum, which is cheap to compare.
+        """
+        state = self.decision_engine.update(
+            odor_intensities.reshape((1, self.odor_dimensions, -1)),
+            timestep,
+            time_before_decision=time_before_decision,
+        )
+        return MatingDecision(int(state[0]))
+
     def get_female_mating_decision(self, odor_intensities, timestep, time_before_decision=1.0):
         """
         Returns a decision based on the odor intensities.
@@ -299,32 +350,17 @@ class FemaleDecisionHybriTurnFly(AbdomenFly):
         Parameters
         ----------
         odor_intensities : np.ndarray
-            Array of shape (4,) containing the intensities of the odors.
-            The first two elements correspond to the attractive odor, and the
-            last two elements correspond to the aversive odor.
+            Array of shape (odor_dimensions, 4) containing the intensities
+            of the odors. The first row corresponds to the attractive
+            odor, and the second row corresponds to the aversive odor.
         timestep : float
             The time elapsed since the last call to this method.
         time_before_decision : float
             The time in seconds before a decision is made.
         """
-        I_reshaped = odor_intensities.reshape((self.odor_dimensions, 2, 2))
-        odor_intesity_smelled = np.average(np.average(I_reshaped, axis=1, weights=[120, 1200]), axis=1) # axis 0: attractive odor, axis 1: aversive odor
-        # Decision making
-        if odor_intesity_smelled[0] > self.odor_threshold[0] or odor_intesity_smelled[1] > self.odor_threshold[1]:
-            self.time_since_odor_high += timestep
-            if self.time_since_odor_high >= time_before_decision: #in seconds
-                if odor_intesity_smelled[1] > 0: # aversive odor
-                    mating_decision = "reject"
-                elif odor_intesity_smelled[0] > self.odor_own_smelling+0.01: # attractive odor (own smelling+margin)
-                    mating_decision = "accept"
-                else:
-                    mating_decision = "fly_close_but_no_decision"
-            else:
-                mating_decision = "fly_nearby"
-        else:
-            self.time_since_odor_high = 0
-            mating_decision = "no_fly_nearby"
-        return mating_decision
+        return self.get_female_mating_state(
+            odor_intensities, timestep, time_before_decision
+        ).label
 
 
 if __name__ == "__main__":
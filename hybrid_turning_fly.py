@@ -1,16 +1,22 @@
+from functools import lru_cache
+
 import numpy as np
-from tqdm import trange
 from gymnasium import spaces
-from gymnasium.utils.env_checker import check_env
 
-from flygym.simulation import SingleFlySimulation, Fly
-from flygym.examples.common import PreprogrammedSteps
-from flygym.examples.cpg_controller import CPGNetwork
-from flygym.preprogrammed import get_cpg_biases
+from flygym.simulation import Fly
+from viz_state import VisualState
+
+
+@lru_cache(maxsize=None)
+def _tripod_cpg_params():
+    """Returns the tripod phase biases and coupling weights. They are
+    computed on first use rather than at import."""
+    from flygym.preprogrammed import get_cpg_biases
+
+    phase_biases = get_cpg_biases("tripod")
+    return phase_biases, (phase_biases > 0) * 10
 
 
-_tripod_phase_biases = get_cpg_biases("tripod")
-_tripod_coupling_weights = (_tripod_phase_biases > 0) * 10
 _default_correction_vectors = {
     "F": np.array([0, 0, 0, -0.02, 0, 0.016, 0]),
     "M": np.array([-0.015, 0, 0, 0.004, 0, 0.01, -0.008]),
@@ -31,8 +37,8 @@ class HybridTurningFly(Fly):
         preprogrammed_steps=None,
         intrinsic_freqs=np.ones(6) * 12,
         intrinsic_amps=np.ones(6) * 1,
-        phase_biases=_tripod_phase_biases,
-        coupling_weights=_tripod_coupling_weights,
+        phase_biases=None,
+        coupling_weights=None,
         convergence_coefs=np.ones(6) * 20,
         init_phases=None,
         init_magnitudes=None,
@@ -49,8 +55,16 @@ class HybridTurningFly(Fly):
         # Initialize core NMF simulation
         super().__init__(contact_sensor_placements=contact_sensor_placements, **kwargs)
 
+        # Imported here to keep importing this module cheap
+        from flygym.examples.common import PreprogrammedSteps
+        from flygym.examples.cpg_controller import CPGNetwork
+
         if preprogrammed_steps is None:
             preprogrammed_steps = PreprogrammedSteps()
+        if phase_biases is None:
+            phase_biases = _tripod_cpg_params()[0]
+        if coupling_weights is None:
+            coupling_weights = _tripod_cpg_params()[1]
 
         self.preprogrammed_steps = preprogrammed_steps
         self.intrinsic_freqs = intrinsic_freqs
@@ -64,6 +78,10 @@ class HybridTurningFly(Fly):
         self.correction_rates = correction_rates
         self.amplitude_range = amplitude_range
         self.draw_corrections = draw_corrections
+        self.visual_state = VisualState()
+        # Optional KinematicStandIn moving the fly along a trajectory
+        # instead of running its controller
+        self.kinematic_standin = None
 
         # Define action and observation spaces
         self.action_space = spaces.Box(*amplitude_range, shape=(2,))
@@ -150,7 +168,8 @@ class HybridTurningFly(Fly):
             Correction rates for increment and decrement.
         viz_segment : str
             Name of the segment to color code. If None, no color coding is
-            done.
+            done. The color is only written to the physics when it changes
+            and a frame is about to be rendered.
 
         Returns
         -------
@@ -166,10 +185,17 @@ class HybridTurningFly(Fly):
             new_amount = max(0, curr_amount - decrement)
             color = (1, 0, 0, 1)
         if viz_segment is not None:
-            self.change_segment_color(viz_segment, color)
+            self.visual_state.set_geom_rgba(f"{self.name}/{viz_segment}", color)
         return new_amount
 
+    def set_pose(self, pose, physics):
+        # the joints of the fly only exist in the full model
+        if self.kinematic_standin is not None:
+            self.kinematic_standin.restore_model(physics)
+        super().set_pose(pose, physics)
+
     def reset(self, sim, seed=None, init_phases=None, init_magnitudes=None, **kwargs):
+        self.visual_state.reset(sim.physics)
         obs, info = super().reset(sim, seed=seed, **kwargs)
         self.cpg_network.random_state = np.random.RandomState(seed)
         self.cpg_network.intrinsic_amps = self.intrinsic_amps
@@ -177,6 +203,8 @@ class HybridTurningFly(Fly):
         self.cpg_network.reset(init_phases, init_magnitudes)
         self.retraction_correction = np.zeros(6)
         self.stumbling_correction = np.zeros(6)
+        if self.kinematic_standin is not None:
+            self.kinematic_standin.reset(sim)
         return obs, info
 
     def pre_step(self, action, sim):
@@ -188,6 +216,9 @@ class HybridTurningFly(Fly):
             Array of shape (2,) containing descending signal encoding
             turning.
         """
+        if self.kinematic_standin is not None and self.kinematic_standin.step(sim, self):
+            return
+
         physics = sim.physics
 
         # update CPG parameters
@@ -251,7 +282,11 @@ class HybridTurningFly(Fly):
 
 
 if __name__ == "__main__":
+    from tqdm import trange
+    from gymnasium.utils.env_checker import check_env
     from flygym import Fly, Camera
+    from flygym.simulation import SingleFlySimulation
+    from viz_state import render
 
     run_time = 2
     timestep = 1e-4
@@ -283,6 +318,6 @@ if __name__ == "__main__":
             action = np.array([0.2, 1.2])
 
         obs, reward, terminated, truncated, info = sim.step(action)
-        sim.render()
+        render(sim)
 
     cam.save_video("./outputs/hybrid_turning.mp4")
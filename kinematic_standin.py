@@ -0,0 +1,514 @@
+import xml.etree.ElementTree as ET
+from typing import Optional
+
+import numpy as np
+
+
+_JOINT_QPOS_SIZE = {0: 7, 1: 4, 2: 1, 3: 1}  # free, ball, slide, hinge
+_JOINT_DOF_SIZE = {0: 6, 1: 3, 2: 1, 3: 1}
+
+# Sensors of the fly that need its joints or actuators, or that measure
+# velocities, which MuJoCo reports as zero for a mocap body. The rigid
+# model replaces them by user sensors of the same name and size, which
+# MuJoCo leaves alone and the stand-in writes.
+_HELD_SENSORS = {"jointpos": 1, "jointvel": 1, "actuatorfrc": 1, "framelinvel": 3, "frameangvel": 3}
+
+
+def _quat_mul(q1: np.ndarray, q2: np.ndarray) -> np.ndarray:
+    """Hamilton product of (w, x, y, z) quaternions, broadcast over the
+    leading axes."""
+    w1, x1, y1, z1 = np.moveaxis(q1, -1, 0)
+    w2, x2, y2, z2 = np.moveaxis(q2, -1, 0)
+    return np.stack(
+        [
+            w1 * w2 - x1 * x2 - y1 * y2 - z1 * z2,
+            w1 * x2 + x1 * w2 + y1 * z2 - z1 * y2,
+            w1 * y2 - x1 * z2 + y1 * w2 + z1 * x2,
+            w1 * z2 + x1 * y2 - y1 * x2 + z1 * w2,
+        ],
+        axis=-1,
+    )
+
+
+def _quat_conj(q: np.ndarray) -> np.ndarray:
+    return q * np.array([1.0, -1, -1, -1])
+
+
+def _yaw_quat(yaw: np.ndarray) -> np.ndarray:
+    yaw = np.asarray(yaw, dtype=float)
+    zeros = np.zeros_like(yaw)
+    return np.stack([np.cos(yaw / 2), zeros, zeros, np.sin(yaw / 2)], axis=-1)
+
+
+def _angular_velocity(q0: np.ndarray, q1: np.ndarray, dt: float) -> np.ndarray:
+    """World angular velocity turning ``q0`` into ``q1`` in ``dt``."""
+    turn = _quat_mul(q1, _quat_conj(q0))
+    return 2 * np.sign(turn[0] + 1e-12) * turn[1:] / dt
+
+
+def rigid_fly_xml(xml: str, fly_name: str):
+    """Edits the XML of a model (``arena.root_element.to_xml_string()``)
+    so that a fly is a rigid body driven by mocap.
+
+    The attachment frame of the fly becomes a mocap body and its joints
+    are removed, together with the actuators acting on them and the
+    contact pairs of its geoms. Its joint, actuator and velocity sensors
+    are replaced by user sensors of the same name and size, so that the
+    sensors of the fly still bind by name. The other elements are kept
+    with their names and in their order: the bodies, geoms, sites and
+    cameras have the same ids in both models.
+
+    Returns
+    -------
+    str
+        XML of the rigid model.
+    list
+        (name, type, joint) of the replaced sensors.
+    """
+    root = ET.fromstring(xml)
+    prefix = f"{fly_name}/"
+    frame = next(
+        (body for body in root.find("worldbody").findall("body") if body.get("name") == prefix),
+        None,
+    )
+    if frame is None:
+        raise RuntimeError(f"Fly {fly_name} is not attached to the worldbody.")
+    frame.set("mocap", "true")
+    joints = set()
+    for parent in list(frame.iter()):
+        for child in list(parent):
+            if child.tag in ("joint", "freejoint"):
+                joints.add(child.get("name"))
+                parent.remove(child)
+    elements = {element.get("name") for element in frame.iter()} - {None}
+
+    actuators = set()
+    section = root.find("actuator")
+    for actuator in list(section if section is not None else ()):
+        targets = {actuator.get(key) for key in ("joint", "jointinparent", "body", "site")}
+        if targets & (joints | elements):
+            actuators.add(actuator.get("name"))
+            section.remove(actuator)
+
+    held = []
+    section = root.find("sensor")
+    for i, sensor in enumerate(list(section if section is not None else ())):
+        target = sensor.get("joint") or sensor.get("actuator") or sensor.get("objname")
+        if sensor.tag in _HELD_SENSORS and target in joints | actuators | elements:
+            section[i] = ET.Element(
+                "user",
+                name=sensor.get("name"),
+                dim=str(_HELD_SENSORS[sensor.tag]),
+                needstage="pos",
+                datatype="real",
+            )
+            held.append((sensor.get("name"), sensor.tag, sensor.get("joint")))
+
+    section = root.find("contact")
+    for pair in list(section if section is not None else ()):
+        if pair.tag == "pair" and {pair.get("geom1"), pair.get("geom2")} & elements:
+            section.remove(pair)
+    # keyframes give the state of the full model
+    for keyframe in root.findall("keyframe"):
+        root.remove(keyframe)
+    return ET.tostring(root, encoding="unicode"), held
+
+
+def _shared_ids(src, dst, obj: str, count: str):
+    """Ids in ``src`` and in ``dst`` of the named objects of ``dst``
+    found in ``src`` (raw mujoco models), e.g. ``obj="joint"`` and
+    ``count="njnt"``."""
+    import mujoco
+
+    obj_type = getattr(mujoco.mjtObj, f"mjOBJ_{obj.upper()}")
+    src_ids, dst_ids = [], []
+    for i in range(getattr(dst, count)):
+        j = mujoco.mj_name2id(src, obj_type, mujoco.mj_id2name(dst, obj_type, i))
+        if j >= 0:
+            src_ids.append(j)
+            dst_ids.append(i)
+    return np.array(src_ids, dtype=int), np.array(dst_ids, dtype=int)
+
+
+def _addresses(starts: np.ndarray, sizes: np.ndarray) -> np.ndarray:
+    return np.array(
+        [a for start, size in zip(starts, sizes) for a in range(start, start + size)], dtype=int
+    )
+
+
+class _StateMap:
+    """Addresses of the state shared by the full model and the rigid
+    model of a fly: the joints, actuators, mocap bodies and contact pairs
+    of everything but the fly."""
+
+    def __init__(self, full, rigid):
+        joints = _shared_ids(full, rigid, "joint", "njnt")
+        types = full.jnt_type[joints[0]]
+        qpos_size = [_JOINT_QPOS_SIZE[t] for t in types]
+        dof_size = [_JOINT_DOF_SIZE[t] for t in types]
+        self.qpos = tuple(
+            _addresses(model.jnt_qposadr[ids], qpos_size)
+            for model, ids in zip((full, rigid), joints)
+        )
+        self.dof = tuple(
+            _addresses(model.jnt_dofadr[ids], dof_size) for model, ids in zip((full, rigid), joints)
+        )
+        self.ctrl = _shared_ids(full, rigid, "actuator", "nu")
+        act_size = full.actuator_actnum[self.ctrl[0]]
+        self.act = tuple(
+            _addresses(model.actuator_actadr[ids], act_size)
+            for model, ids in zip((full, rigid), self.ctrl)
+        )
+        bodies = _shared_ids(full, rigid, "body", "nbody")
+        mocap = (full.body_mocapid[bodies[0]] >= 0) & (rigid.body_mocapid[bodies[1]] >= 0)
+        self.mocap = tuple(
+            model.body_mocapid[ids[mocap]] for model, ids in zip((full, rigid), bodies)
+        )
+        self.pair = _shared_ids(full, rigid, "pair", "npair")
+
+    def copy(self, src_model, src, dst_model, dst, to_rigid: bool):
+        """Copies the shared state from ``src`` to ``dst`` (raw mujoco
+        data), from the full to the rigid model if ``to_rigid``."""
+        s, d = (0, 1) if to_rigid else (1, 0)
+        dst.time = src.time
+        dst.qpos[self.qpos[d]] = src.qpos[self.qpos[s]]
+        for field in ("qvel", "qacc_warmstart", "qfrc_applied"):
+            getattr(dst, field)[self.dof[d]] = getattr(src, field)[self.dof[s]]
+        dst.ctrl[self.ctrl[d]] = src.ctrl[self.ctrl[s]]
+        dst.act[self.act[d]] = src.act[self.act[s]]
+        dst.mocap_pos[self.mocap[d]] = src.mocap_pos[self.mocap[s]]
+        dst.mocap_quat[self.mocap[d]] = src.mocap_quat[self.mocap[s]]
+        dst.xfrc_applied[:] = src.xfrc_applied
+        # model values changed while running: colors, enabled contacts
+        dst_model.geom_rgba[:] = src_model.geom_rgba
+        dst_model.pair_margin[self.pair[d]] = src_model.pair_margin[self.pair[s]]
+        dst_model.opt.gravity[:] = src_model.opt.gravity
+
+
+class KinematicStandIn:
+    """Moves a fly along a trajectory instead of simulating it.
+
+    While engaged, the fly is a rigid body driven by mocap in a variant
+    of the model compiled without its joints, actuators and contact
+    pairs: MuJoCo neither integrates its degrees of freedom nor tests its
+    contacts, and its controller (CPG, correction rules, adhesion) is
+    skipped. Its root follows the trajectory and its body keeps the
+    posture it had at engagement. Only its sensing remains, e.g. the
+    odor sensed by a scripted female deciding whether to accept the
+    male; its joint sensors report the held posture, and its velocity
+    sensors the velocity of the trajectory.
+
+    The simulation runs the variant in place of its model
+    (``Physics._reload_from_data``), so the bindings, cameras and
+    callbacks holding ``sim.physics`` keep working; the state of the
+    other flies and of the arena is carried over by name. The variant is
+    compiled at the first engagement (a few seconds with two flies). With
+    two plain flygym flies (no controller) and mujoco 3.1.6, a
+    ``Simulation.step`` takes 6.2 ms with one fly as a stand-in against
+    10.6 ms without; skipping a CPG controller saves more.
+
+    The fly is released back to full dynamics when ``release`` is called
+    or, if ``partner`` is given, when that fly comes within
+    ``release_distance``; it then starts from the pose and velocity of
+    the trajectory, with the posture it was held in.
+
+    The fly must check ``kinematic_standin`` at the start of its
+    ``pre_step``, and hand back its model with ``restore_model`` in its
+    ``set_pose``, which the simulation calls on reset, as
+    ``HybridTurningFly`` and ``FemaleDecisionHybriTurnFly`` do. While
+    the stand-in is engaged, the state arrays (``qpos``, ``mocap_pos``,
+    contact pairs...) have the layout of the variant: do not combine it
+    with a ``CollisionManager``, a ``StateRecorder``, a
+    ``WarmStartCache`` or a ``ParallelCameraRenderer``, which keep the
+    addresses of the full model.
+
+    Parameters
+    ----------
+    times : np.ndarray
+        Times of the trajectory samples, of shape (T,).
+    positions : np.ndarray
+        Root positions of shape (T, 3). NaN z values keep the height of
+        the fly at engagement.
+    rotations : np.ndarray, optional
+        Root rotations as (w, x, y, z) quaternions of shape (T, 4),
+        applied on top of the orientation of the fly at engagement. By
+        default the orientation is kept.
+    partner : str, optional
+        Name of the fly whose approach releases this one.
+    release_distance : float, optional
+        Distance in mm to ``partner`` below which the fly is released.
+    engaged : bool, optional
+        Whether the fly starts as a stand-in, by default True.
+    """
+
+    def __init__(
+        self,
+        times: np.ndarray,
+        positions: np.ndarray,
+        rotations: Optional[np.ndarray] = None,
+        partner: Optional[str] = None,
+        release_distance: Optional[float] = None,
+        engaged: bool = True,
+    ):
+        self.times = np.asarray(times, dtype=float)
+        self.positions = np.asarray(positions, dtype=float)
+        if rotations is None:
+            rotations = np.tile([1.0, 0, 0, 0], (len(self.times), 1))
+        rotations = np.asarray(rotations, dtype=float)
+        # make consecutive quaternions lie in the same hemisphere so that
+        # they can be interpolated component-wise
+        signs = np.cumprod(
+            np.r_[1, np.sign(np.sum(rotations[1:] * rotations[:-1], axis=1) + 1e-12)]
+        )
+        self.rotations = rotations * signs[:, np.newaxis]
+        self.partner = partner
+        self.release_distance = release_distance
+        self.engaged = engaged
+        self._initially_engaged = engaged
+        self.n_kinematic_steps = 0
+        self._models = None
+        self._reference = None
+        self._partner_body = None
+
+    @classmethod
+    def from_path(cls, times: np.ndarray, xy: np.ndarray, **kwargs) -> "KinematicStandIn":
+        """Builds a planar trajectory in which the fly turns with its
+        direction of motion. The fly is assumed to face the initial
+        direction of the path at engagement.
+
+        Parameters
+        ----------
+        times : np.ndarray
+            Times of shape (T,).
+        xy : np.ndarray
+            Absolute positions of shape (T, 2); the height is kept.
+        """
+        xy = np.asarray(xy, dtype=float)
+        step = np.gradient(xy, axis=0)
+        yaw = np.unwrap(np.arctan2(step[:, 1], step[:, 0]))
+        positions = np.column_stack([xy, np.full(len(xy), np.nan)])
+        return cls(times, positions, _yaw_quat(yaw - yaw[0]), **kwargs)
+
+    @classmethod
+    def from_recording(
+        cls, times: np.ndarray, positions: np.ndarray, **kwargs
+    ) -> "KinematicStandIn":
+        """Replays recorded positions of shape (T, 3), e.g. the ``"pos"``
+        of a fly in a run log, facing the direction of motion."""
+        positions = np.asarray(positions, dtype=float)
+        standin = cls.from_path(times, positions[:, :2], **kwargs)
+        standin.positions[:, 2] = positions[:, 2]
+        return standin
+
+    @property
+    def rigid(self) -> bool:
+        """True while the simulation runs the variant of the model."""
+        return self._reference is not None
+
+    def _pose(self, t: float):
+        i = int(np.searchsorted(self.times, t))
+        if i == 0 or i == len(self.times):
+            j = 0 if i == 0 else -1
+            pos, rot = self.positions[j].copy(), self.rotations[j]
+        else:
+            w = (t - self.times[i - 1]) / (self.times[i] - self.times[i - 1])
+            pos = (1 - w) * self.positions[i - 1] + w * self.positions[i]
+            rot = (1 - w) * self.rotations[i - 1] + w * self.rotations[i]
+        rot = rot / np.linalg.norm(rot)
+        if np.isnan(pos[2]):
+            pos[2] = self._reference["height"]
+        return pos, _quat_mul(rot, self._reference["root_quat"])
+
+    def _build(self, sim, fly):
+        import mujoco
+        from dm_control.mujoco import wrapper
+
+        physics = sim.physics
+        root = sim.arena.root_element
+        xml, held = rigid_fly_xml(root.to_xml_string(), fly.name)
+        rigid = wrapper.MjData(wrapper.MjModel.from_xml_string(xml, assets=root.get_assets()))
+        full_model, rigid_model = physics.model.ptr, rigid.model.ptr
+        frame = mujoco.mj_name2id(full_model, mujoco.mjtObj.mjOBJ_BODY, f"{fly.name}/")
+        free = full_model.body_jntadr[frame]
+        sensors = {
+            kind: [
+                mujoco.mj_name2id(rigid_model, mujoco.mjtObj.mjOBJ_SENSOR, name)
+                for name, k, _ in held
+                if k == kind
+            ]
+            for kind in _HELD_SENSORS
+        }
+        posture_joints = [
+            mujoco.mj_name2id(full_model, mujoco.mjtObj.mjOBJ_JOINT, joint)
+            for _, kind, joint in held
+            if kind == "jointpos"
+        ]
+        self._models = {
+            "full": physics.data,
+            "rigid": rigid,
+            "map": _StateMap(full_model, rigid_model),
+            "frame": frame,
+            "mocap": rigid_model.body_mocapid[frame],
+            "bodies": np.flatnonzero(
+                (full_model.body_rootid == frame) & (np.arange(full_model.nbody) != frame)
+            ),
+            "free_qpos": full_model.jnt_qposadr[free],
+            "free_dof": full_model.jnt_dofadr[free],
+            "fly_dofs": np.flatnonzero(full_model.body_rootid[full_model.dof_bodyid] == frame),
+            "posture_qpos": full_model.jnt_qposadr[posture_joints],
+            "sensor_adr": {
+                kind: (
+                    rigid_model.sensor_adr[ids, np.newaxis] + np.arange(_HELD_SENSORS[kind])
+                ).ravel()
+                for kind, ids in sensors.items()
+            },
+        }
+
+    def _engage(self, sim, fly):
+        import mujoco
+
+        physics = sim.physics
+        if self._models is None:
+            self._build(sim, fly)
+        models = self._models
+        full, rigid = models["full"].ptr, models["rigid"].ptr
+        full_model, rigid_model = models["full"].model.ptr, models["rigid"].model.ptr
+        mujoco.mj_kinematics(full_model, full)
+        frame, bodies = models["frame"], models["bodies"]
+        qpos_adr = models["free_qpos"]
+        self._reference = {
+            "height": full.qpos[qpos_adr + 2],
+            "root_quat": full.qpos[qpos_adr + 3 : qpos_adr + 7].copy(),
+        }
+        # hold the posture: place the bodies of the fly relative to their
+        # parents as they are now
+        parents = full_model.body_parentid[bodies]
+        xmat = full.xmat.reshape(-1, 3, 3)
+        rigid_model.body_pos[bodies] = np.einsum(
+            "bji,bj->bi", xmat[parents], full.xpos[bodies] - full.xpos[parents]
+        )
+        rigid_model.body_quat[bodies] = _quat_mul(
+            _quat_conj(full.xquat[parents]), full.xquat[bodies]
+        )
+        models["map"].copy(full_model, full, rigid_model, rigid, to_rigid=True)
+        sensor_adr = models["sensor_adr"]
+        rigid.sensordata[sensor_adr["jointpos"]] = full.qpos[models["posture_qpos"]]
+        rigid.sensordata[sensor_adr["jointvel"]] = 0
+        rigid.sensordata[sensor_adr["actuatorfrc"]] = 0
+        pos, quat = self._pose(sim.curr_time)
+        rigid.mocap_pos[models["mocap"]] = pos
+        rigid.mocap_quat[models["mocap"]] = quat
+        physics._reload_from_data(models["rigid"])
+
+    def _partner_distance(self, sim) -> float:
+        physics = sim.physics
+        if self._partner_body is None:
+            import mujoco
+
+            self._partner_body = mujoco.mj_name2id(
+                physics.model.ptr, mujoco.mjtObj.mjOBJ_BODY, f"{self.partner}/"
+            )
+        # the bodies have the same ids in both models
+        xpos = physics.data.xpos
+        return float(np.linalg.norm(xpos[self._models["frame"], :2] - xpos[self._partner_body, :2]))
+
+    def step(self, sim, fly) -> bool:
+        """Places the fly for the coming physics step.
+
+        Returns
+        -------
+        bool
+            True if the fly is driven kinematically; False if it is (or
+            was just) released and must run its controller.
+        """
+        if not self.engaged:
+            return False
+        if self._reference is None:
+            self._engage(sim, fly)
+        if (
+            self.partner is not None
+            and self.release_distance is not None
+            and self._partner_distance(sim) < self.release_distance
+        ):
+            self.release(sim)
+            return False
+
+        models = self._models
+        data = sim.physics.data
+        t, dt = sim.curr_time, sim.timestep
+        pos, quat = self._pose(t)
+        next_pos, next_quat = self._pose(t + dt)
+        # the mocap pose is applied by the positions computed at the end
+        # of the step: place the fly where it is after the step
+        data.mocap_pos[models["mocap"]] = next_pos
+        data.mocap_quat[models["mocap"]] = next_quat
+        sensordata = data.sensordata
+        sensor_adr = models["sensor_adr"]
+        sensordata[sensor_adr["framelinvel"]] = np.tile(
+            (next_pos - pos) / dt, len(sensor_adr["framelinvel"]) // 3
+        )
+        sensordata[sensor_adr["frameangvel"]] = np.tile(
+            _angular_velocity(quat, next_quat, dt), len(sensor_adr["frameangvel"]) // 3
+        )
+        self.n_kinematic_steps += 1
+        return True
+
+    def _hand_back(self, physics, reset: bool):
+        """Runs the full model again, with the current state of the other
+        flies and of the arena."""
+        import mujoco
+
+        models = self._models
+        full, rigid = models["full"].ptr, models["rigid"].ptr
+        full_model, rigid_model = models["full"].model.ptr, models["rigid"].model.ptr
+        if reset:
+            mujoco.mj_resetData(full_model, full)
+        models["map"].copy(rigid_model, rigid, full_model, full, to_rigid=False)
+        physics._reload_from_data(models["full"])
+        self._reference = None
+
+    def release(self, sim):
+        """Hands the fly back to the physics and its controller."""
+        self.engaged = False
+        if self._reference is None:
+            return
+        import mujoco
+
+        models = self._models
+        full = models["full"].ptr
+        t, dt = sim.curr_time, sim.timestep
+        pos, quat = self._pose(t)
+        next_pos, next_quat = self._pose(t + dt)
+        qpos_adr, dof_adr = models["free_qpos"], models["free_dof"]
+        # the joints still hold the posture at engagement
+        full.qpos[qpos_adr : qpos_adr + 3] = pos
+        full.qpos[qpos_adr + 3 : qpos_adr + 7] = quat
+        full.qvel[models["fly_dofs"]] = 0
+        full.qacc_warmstart[models["fly_dofs"]] = 0
+        full.qvel[dof_adr : dof_adr + 3] = (next_pos - pos) / dt
+        # angular velocity of a free joint in the frame of its body
+        rotation = np.empty(9)
+        mujoco.mju_quat2Mat(rotation, quat)
+        full.qvel[dof_adr + 3 : dof_adr + 6] = rotation.reshape(3, 3).T @ _angular_velocity(
+            quat, next_quat, dt
+        )
+        self._hand_back(sim.physics, reset=False)
+
+    def restore_model(self, physics):
+        """Runs the full model again, with the fly in the reset state of
+        the full model; call from ``set_pose`` of the fly, which the
+        simulation calls on reset after resetting the physics."""
+        if self._reference is not None:
+            self._hand_back(physics, reset=True)
+
+    def reset(self, sim):
+        """Engages again if the stand-in was initially engaged; call when
+        the simulation is reset."""
+        self.restore_model(sim.physics)
+        self.engaged = self._initially_engaged
+        self.n_kinematic_steps = 0
+
+    def engage(self):
+        """Drives the fly kinematically again from its next step, with the
+        posture it has then."""
+        self.engaged = True
@@ -0,0 +1,166 @@
+from enum import IntEnum
+from typing import Callable, Optional, Sequence
+
+import numpy as np
+
+
+class MatingDecision(IntEnum):
+    """States of the female mating decision."""
+
+    NO_FLY_NEARBY = 0
+    FLY_NEARBY = 1
+    FLY_CLOSE_BUT_NO_DECISION = 2
+    ACCEPT = 3
+    REJECT = 4
+
+    @property
+    def label(self) -> str:
+        """Returns the state as the string used by the original driver."""
+        return _labels[self]
+
+
+_labels = {
+    MatingDecision.NO_FLY_NEARBY: "no_fly_nearby",
+    MatingDecision.FLY_NEARBY: "fly_nearby",
+    MatingDecision.FLY_CLOSE_BUT_NO_DECISION: "fly_close_but_no_decision",
+    MatingDecision.ACCEPT: "accept",
+    MatingDecision.REJECT: "reject",
+}
+
+# Relative weights of the antennae and maxillary palps, as in
+# OdorTaxisFly.process_odor_intensities
+SENSOR_WEIGHTS = np.array([120, 1200])
+
+
+class MatingDecisionEngine:
+    """Vectorized mating decision for one or more females.
+
+    The odor intensities of each female are collapsed into one value per
+    odor dimension with a precomputed sensor weight vector, and the state
+    of every female is stored as a ``MatingDecision`` integer.
+
+    Parameters
+    ----------
+    n_flies : int
+        Number of females evaluated at once.
+    odor_threshold : Sequence[float]
+        Thresholds above which the attractive (first) and aversive
+        (second) odors indicate that a male is nearby.
+    odor_own_smelling : float
+        Attractive odor intensity a female smells from her own odor source.
+    time_before_decision : float
+        Time in seconds a male has to stay nearby before a decision is
+        made.
+    on_decision : Callable[[int, MatingDecision], None], optional
+        Called with the index of the female and her decision whenever a
+        female enters the accept or reject state.
+    num_sensors : int
+        Number of odor sensors per fly, by default 4: 2 maxillary palps +
+        2 antennae.
+    """
+
+    def __init__(
+        self,
+        n_flies: int = 1,
+        odor_threshold: Sequence[float] = (0.119, 0.03),
+        odor_own_smelling: float = 0.1,
+        time_before_decision: float = 1.0,
+        on_decision: Optional[Callable[[int, MatingDecision], None]] = None,
+        num_sensors: int = 4,
+    ):
+        self.n_flies = n_flies
+        self.odor_threshold = np.asarray(odor_threshold, dtype=float)
+        self.odor_own_smelling = odor_own_smelling
+        self.time_before_decision = time_before_decision
+        self.on_decision = on_decision
+
+        # (w,) weights averaging over sensor types and left/right sides
+        weights = np.repeat(SENSOR_WEIGHTS, num_sensors // 2).astype(float)
+        self.sensor_weights = weights / weights.sum()
+
+        self.time_since_odor_high = np.zeros(n_flies)
+        self.state = np.full(n_flies, MatingDecision.NO_FLY_NEARBY, dtype=np.int8)
+
+    def reset(self):
+        self.time_since_odor_high[:] = 0
+        self.state[:] = MatingDecision.NO_FLY_NEARBY
+
+    @property
+    def decided(self) -> np.ndarray:
+        """Boolean mask of the females that accepted or rejected."""
+        return self.state >= MatingDecision.ACCEPT
+
+    def smelled_intensity(self, odor_intensities: np.ndarray) -> np.ndarray:
+        """Collapses odor intensities of shape (n_flies, k, w) to (n_flies, k)."""
+        return odor_intensities @ self.sensor_weights
+
+    def odor_high(self, smelled: np.ndarray) -> np.ndarray:
+        """Whether a male is nearby, from smelled intensities of shape
+        (..., k)."""
+        return (smelled[..., 0] > self.odor_threshold[0]) | (
+            smelled[..., 1] > self.odor_threshold[1]
+        )
+
+    def classify(
+        self,
+        smelled: np.ndarray,
+        time_since_odor_high: np.ndarray,
+        time_before_decision: Optional[float] = None,
+    ) -> np.ndarray:
+        """Returns the states for smelled intensities of shape (..., k)
+        and the time spent with a high odor, of shape (...,), without
+        updating the engine."""
+        if time_before_decision is None:
+            time_before_decision = self.time_before_decision
+        attractive, aversive = smelled[..., 0], smelled[..., 1]
+        odor_high = self.odor_high(smelled)
+        ready = odor_high & (time_since_odor_high >= time_before_decision)
+
+        state = np.where(
+            aversive > 0,
+            MatingDecision.REJECT,
+            np.where(
+                attractive > self.odor_own_smelling + 0.01,
+                MatingDecision.ACCEPT,
+                MatingDecision.FLY_CLOSE_BUT_NO_DECISION,
+            ),
+        )
+        state = np.where(ready, state, MatingDecision.FLY_NEARBY)
+        state = np.where(odor_high, state, MatingDecision.NO_FLY_NEARBY)
+        return state.astype(np.int8)
+
+    def update(
+        self,
+        odor_intensities: np.ndarray,
+        timestep: float,
+        time_before_decision: Optional[float] = None,
+    ) -> np.ndarray:
+        """Updates the decision of all females.
+
+        Parameters
+        ----------
+        odor_intensities : np.ndarray
+            Array of shape (n_flies, k, w) with the odor intensities
+            sensed by each female. The first odor dimension is attractive
+            and the second one aversive.
+        timestep : float
+            The time elapsed since the last update.
+        time_before_decision : float, optional
+            Overrides the time before a decision for this update.
+
+        Returns
+        -------
+        np.ndarray
+            The new states, as ``MatingDecision`` values of shape (n_flies,).
+        """
+        smelled = self.smelled_intensity(odor_intensities)
+        self.time_since_odor_high = np.where(
+            self.odor_high(smelled), self.time_since_odor_high + timestep, 0
+        )
+        previous = self.state
+        self.state = self.classify(smelled, self.time_since_odor_high, time_before_decision)
+        if self.on_decision is not None:
+            entered = self.decided & (self.state != previous)
+            for i in np.flatnonzero(entered):
+                self.on_decision(int(i), MatingDecision(int(self.state[i])))
+        return self.state
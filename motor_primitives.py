@@ -0,0 +1,334 @@
+import hashlib
+from pathlib import Path
+from typing import TYPE_CHECKING, Dict, Iterable, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+if TYPE_CHECKING:
+    from flygym.examples.common import PreprogrammedSteps
+
+
+Phase = Union[float, str]
+
+
+class MotorPrimitive:
+    """Declarative description of a preprogrammed movement.
+
+    A primitive is defined over a normalized time ``s`` in [0, 1] so that
+    the same definition can be compiled for any duration and timestep.
+    Each leg follows the preprogrammed stepping pattern at a phase that is
+    ramped linearly from a start to an end value. Individual joints can
+    then be overridden by piecewise-linear keyframes.
+
+    Parameters
+    ----------
+    name : str
+        Name of the primitive, used as key in the library.
+    leg_phases : Dict[str, Tuple[Phase, Phase]]
+        For each leg, the (start, end) phase of the preprogrammed step
+        used as base pose. A phase is either a float or one of
+        ``"swing_start"`` / ``"swing_end"``, resolved against the swing
+        period of that leg.
+    joint_keyframes : Dict[str, Sequence[Tuple[float, float]]], optional
+        For each joint (e.g. ``"joint_RHCoxa"`` or ``"joint_A4"``), a list
+        of (s, angle) keyframes. The joint angle is linearly interpolated
+        between the keyframes and overrides the base pose.
+    leg_stretch : Dict[str, float], optional
+        For each leg, the fraction of its start pose that is subtracted at
+        the end of the movement. The subtraction ramps linearly from 0.
+        This is used to stretch the legs while lunging.
+    adhesion_off : Iterable[str], optional
+        Legs whose adhesion is turned off during the movement.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        leg_phases: Dict[str, Tuple[Phase, Phase]],
+        joint_keyframes: Optional[Dict[str, Sequence[Tuple[float, float]]]] = None,
+        leg_stretch: Optional[Dict[str, float]] = None,
+        adhesion_off: Iterable[str] = (),
+    ):
+        self.name = name
+        self.leg_phases = dict(leg_phases)
+        self.joint_keyframes = {
+            joint: np.array(keyframes, dtype=float).reshape(-1, 2)
+            for joint, keyframes in (joint_keyframes or {}).items()
+        }
+        self.leg_stretch = dict(leg_stretch or {})
+        self.adhesion_off = tuple(adhesion_off)
+
+    def signature(self) -> str:
+        """Returns a string that uniquely describes the definition."""
+        keyframes = {k: v.tolist() for k, v in sorted(self.joint_keyframes.items())}
+        return repr(
+            (
+                self.name,
+                sorted(self.leg_phases.items()),
+                keyframes,
+                sorted(self.leg_stretch.items()),
+                self.adhesion_off,
+            )
+        )
+
+    @staticmethod
+    def _resolve_phase(phase: Phase, leg: str, steps: "PreprogrammedSteps") -> float:
+        if phase == "swing_start":
+            return steps.swing_period[leg][0]
+        if phase == "swing_end":
+            return steps.swing_period[leg][1]
+        return float(phase)
+
+    def compile(
+        self,
+        actuated_joints: Sequence[str],
+        num_steps: int,
+        timestep: float,
+        preprogrammed_steps: Optional["PreprogrammedSteps"] = None,
+    ) -> "CompiledPrimitive":
+        """Evaluates the primitive into a (num_steps, n_joints) array.
+
+        Parameters
+        ----------
+        actuated_joints : Sequence[str]
+            Actuated joints of the fly, in the order expected by its
+            action space. Joints that are neither part of a leg nor
+            keyframed (e.g. the abdomen joints of ``AbdomenFly``) are
+            held at 0.
+        num_steps : int
+            Number of physics steps of the movement.
+        timestep : float
+            Simulation timestep.
+        preprogrammed_steps : PreprogrammedSteps, optional
+            Stepping pattern providing the base poses.
+
+        Returns
+        -------
+        CompiledPrimitive
+            The compiled movement.
+        """
+        if preprogrammed_steps is None:
+            from flygym.examples.common import PreprogrammedSteps
+
+            preprogrammed_steps = PreprogrammedSteps()
+        steps = preprogrammed_steps
+
+        joint_index = {joint: i for i, joint in enumerate(actuated_joints)}
+        s = np.linspace(0, 1, num_steps)
+        joints = np.zeros((num_steps, len(actuated_joints)))
+
+        for leg, (start, end) in self.leg_phases.items():
+            try:
+                cols = [joint_index[f"joint_{leg}{dof}"] for dof in steps.dofs_per_leg]
+            except KeyError as e:
+                raise ValueError(
+                    f"Primitive '{self.name}' drives leg {leg}, but {e} is not "
+                    "an actuated joint of the fly."
+                ) from None
+            start = self._resolve_phase(start, leg, steps)
+            end = self._resolve_phase(end, leg, steps)
+            start_pose = np.asarray(steps.get_joint_angles(leg, start))
+            if start == end:
+                angles = np.broadcast_to(start_pose, (num_steps, len(cols))).copy()
+            else:
+                phases = start + (end - start) * s
+                angles = np.stack([steps.get_joint_angles(leg, p) for p in phases])
+            stretch = self.leg_stretch.get(leg, 0)
+            if stretch:
+                angles -= (stretch * s)[:, np.newaxis] * start_pose
+            joints[:, cols] = angles
+
+        for joint, keyframes in self.joint_keyframes.items():
+            if joint not in joint_index:
+                raise ValueError(
+                    f"Primitive '{self.name}' has keyframes for {joint}, which is "
+                    "not an actuated joint of the fly."
+                )
+            joints[:, joint_index[joint]] = np.interp(s, keyframes[:, 0], keyframes[:, 1])
+
+        adhesion = np.array(
+            [0 if leg in self.adhesion_off else 1 for leg in steps.legs], dtype=int
+        )
+        return CompiledPrimitive(self.name, joints, adhesion, timestep)
+
+
+class CompiledPrimitive:
+    """A primitive evaluated for a given fly, duration and timestep.
+
+    Attributes
+    ----------
+    name : str
+        Name of the primitive.
+    joints : np.ndarray
+        C-contiguous array of shape (num_steps, n_actuated_joints)
+        containing the target joint angles for each physics step.
+    adhesion : np.ndarray
+        Adhesion on/off signal of shape (6,), constant over the movement.
+    timestep : float
+        Simulation timestep the primitive was compiled for.
+    """
+
+    def __init__(self, name: str, joints: np.ndarray, adhesion: np.ndarray, timestep: float):
+        self.name = name
+        self.joints = np.ascontiguousarray(joints)
+        self.joints.flags.writeable = False
+        self.adhesion = adhesion
+        self.timestep = timestep
+
+    def __len__(self) -> int:
+        return self.joints.shape[0]
+
+    @property
+    def duration(self) -> float:
+        return len(self) * self.timestep
+
+    def action(self, step: int) -> dict:
+        """Returns the fly action for a physics step of the movement.
+
+        The joint angles are a view on a row of ``joints``, so no data is
+        copied. Steps past the end of the movement hold the last pose.
+        """
+        step = min(step, len(self) - 1)
+        return {"joints": self.joints[step], "adhesion": self.adhesion}
+
+    def actions(self):
+        """Iterates over the fly actions of the whole movement."""
+        for step in range(len(self)):
+            yield self.action(step)
+
+
+class MotorPrimitiveLibrary:
+    """Compiles motor primitives once and memoizes the result.
+
+    Compiled primitives are cached per (primitive, actuated joints,
+    number of steps, timestep). If ``cache_dir`` is given, they are also
+    persisted on disk so that later runs skip the compilation altogether.
+
+    Parameters
+    ----------
+    primitives : Iterable[MotorPrimitive], optional
+        Primitives to register, by default kicking and lunging.
+    cache_dir : str or Path, optional
+        Directory where compiled primitives are stored as .npz files.
+    preprogrammed_steps : PreprogrammedSteps, optional
+        Stepping pattern providing the base poses.
+    """
+
+    def __init__(
+        self,
+        primitives: Optional[Iterable[MotorPrimitive]] = None,
+        cache_dir: Optional[Union[str, Path]] = None,
+        preprogrammed_steps: Optional["PreprogrammedSteps"] = None,
+    ):
+        if primitives is None:
+            primitives = [KICKING, LUNGING]
+        self.primitives = {}
+        for primitive in primitives:
+            self.register(primitive)
+        self.cache_dir = None if cache_dir is None else Path(cache_dir)
+        self._preprogrammed_steps = preprogrammed_steps
+        self._cache = {}
+
+    @property
+    def preprogrammed_steps(self) -> "PreprogrammedSteps":
+        if self._preprogrammed_steps is None:
+            from flygym.examples.common import PreprogrammedSteps
+
+            self._preprogrammed_steps = PreprogrammedSteps()
+        return self._preprogrammed_steps
+
+    def register(self, primitive: MotorPrimitive):
+        self.primitives[primitive.name] = primitive
+
+    def get(
+        self,
+        name: str,
+        actuated_joints: Sequence[str],
+        duration: float,
+        timestep: float,
+    ) -> CompiledPrimitive:
+        """Returns the primitive compiled for a fly, compiling it if needed.
+
+        Parameters
+        ----------
+        name : str
+            Name of a registered primitive.
+        actuated_joints : Sequence[str]
+            Actuated joints of the fly, typically ``fly.actuated_joints``.
+        duration : float
+            Duration of the movement in seconds.
+        timestep : float
+            Simulation timestep.
+        """
+        primitive = self.primitives[name]
+        num_steps = int(round(duration / timestep))
+        key = (name, tuple(actuated_joints), num_steps, float(timestep))
+        compiled = self._cache.get(key)
+        if compiled is not None:
+            return compiled
+
+        path = None
+        if self.cache_dir is not None:
+            digest = hashlib.sha1(repr((primitive.signature(), key)).encode()).hexdigest()
+            path = self.cache_dir / f"{name}_{digest[:16]}.npz"
+            if path.exists():
+                with np.load(path) as data:
+                    compiled = CompiledPrimitive(
+                        name, data["joints"], data["adhesion"], timestep
+                    )
+
+        if compiled is None:
+            compiled = primitive.compile(
+                actuated_joints, num_steps, timestep, self.preprogrammed_steps
+            )
+            if path is not None:
+                path.parent.mkdir(parents=True, exist_ok=True)
+                np.savez(path, joints=compiled.joints, adhesion=compiled.adhesion)
+
+        self._cache[key] = compiled
+        return compiled
+
+    def clear(self):
+        """Drops the in-memory cache. Files in ``cache_dir`` are kept."""
+        self._cache.clear()
+
+
+_legs = [f"{side}{pos}" for side in "LR" for pos in "FMH"]
+
+# Female rejection: kick with the right hind leg while bending the abdomen
+# (see kicking.ipynb). The other legs hold the end-of-swing pose.
+KICKING = MotorPrimitive(
+    name="kicking",
+    leg_phases={leg: ("swing_end", "swing_end") for leg in _legs if leg != "RH"},
+    joint_keyframes={
+        "joint_RHCoxa": [(0, 0), (0.5, 1), (1, 0)],
+        "joint_RHCoxa_roll": [(0, 0.7)],
+        "joint_RHCoxa_yaw": [(0, 0)],
+        "joint_RHFemur": [(0, 2), (1 / 3, 2), (2 / 3, 2.5), (1, 1.7)],
+        "joint_RHFemur_roll": [(0, 0)],
+        "joint_RHTibia": [(0, -1), (1 / 3, -1), (2 / 3, -2), (1, 0)],
+        "joint_RHTarsus1": [(0, 0.3), (0.5, 0.3), (1, 0)],
+        "joint_A1A2": [(0, 0)],
+        "joint_A3": [(0, 0)],
+        "joint_A4": [(0, 0), (1, -0.4)],
+        "joint_A5": [(0, 0), (1, -0.6)],
+        "joint_A6": [(0, 0)],
+    },
+    adhesion_off=("RH",),
+)
+
+# Male lunge used for mounting (see mounting.ipynb): forelegs raised, middle
+# legs pushed through stance while stretching, hind legs brought forward.
+LUNGING = MotorPrimitive(
+    name="lunging",
+    leg_phases={
+        "LF": (0.0, 0.0),
+        "RF": (0.0, 0.0),
+        "LM": ("swing_end", 2 * np.pi),
+        "RM": ("swing_end", 2 * np.pi),
+        "LH": (0.0, "swing_end"),
+        "RH": (0.0, "swing_end"),
+    },
+    leg_stretch={"LM": 1.0, "RM": 1.0},
+    adhesion_off=("LF", "RF"),
+)
@@ -4,8 +4,22 @@ from dm_control import mjcf
 
 from flygym.util import load_config
 from flygym.arena import BaseArena
+from viz_state import VisualState
 
 
+def tile_origins(
+    tile_grid: Tuple[int, int], tile_spacing: Tuple[float, float]
+) -> np.ndarray:
+    """Returns the (x, y, z) origins of the tiles of a (rows, cols) grid
+    centered on (0, 0), in row-major order. The shape of the array is
+    (rows * cols, 3)."""
+    rows, cols = tile_grid
+    row, col = np.divmod(np.arange(rows * cols), cols)
+    origins = np.zeros((rows * cols, 3))
+    origins[:, 0] = (col - (cols - 1) / 2) * tile_spacing[0]
+    origins[:, 1] = (row - (rows - 1) / 2) * tile_spacing[1]
+    return origins
+
 
 class MovOdorArena(BaseArena):
     """Flat terrain with an odor source.
@@ -40,6 +54,11 @@ class MovOdorArena(BaseArena):
     birdeye_cam_zoom : dm_control.mujoco.Camera
          MuJoCo camera that gives a birdeye view of the arena, zoomed in
          toward the fly.
+    tile_grid : Tuple[int, int] or None
+        (rows, cols) of independent tiles, or None if the arena is not
+        tiled.
+    num_tiles : int
+        Number of tiles (1 if the arena is not tiled).
 
     Parameters
     ----------
@@ -69,6 +88,32 @@ class MovOdorArena(BaseArena):
         the matplotlib color cycle is used.
     marker_size : float, optional
         The size of the odor source markers, by default 0.25.
+    tile_grid : Tuple[int, int], optional
+        If given, the arena is split into a (rows, cols) grid of
+        independent tiles, e.g. one courtship pair per tile. A fly only
+        smells the odor sources located in its own tile. The ground is
+        enlarged to hold all tiles if needed.
+    tile_spacing : Tuple[float, float], optional
+        Distance in mm between the centers of neighboring tiles along x
+        and y, by default (50, 50). Flies and odor sources are assigned
+        to the nearest tile center, so they must stay within half of the
+        spacing from the origin of their tile.
+    odor_field : OdorPlume or MappedOdorField, optional
+        If given, olfaction is computed from this dynamic odor field
+        instead of ``diffuse_func``. The field is advanced in ``step``
+        with the current odor source positions and sampled at the sensor
+        positions. A ``MappedOdorField`` replays a field stored on disk
+        and ignores the odor sources. Tiles do not scope such a field;
+        space the tiles further apart than the plume reaches. Its
+        ``odor_dimensions`` must match the peak intensities; it is reset
+        with the arena.
+    defer_marker_updates : bool, optional
+        If True (default), the marker positions are only written to the
+        physics when ``viz_state.sync_visuals`` is called right before a
+        frame is drawn, as ``viz_state.render``, ``ParallelCameraRenderer``
+        and ``StateRecorder`` do; call it before ``Simulation.render``
+        when rendering directly. If False, they are written in ``step``
+        whenever they change.
     """
 
     def __init__(
@@ -83,9 +128,24 @@ class MovOdorArena(BaseArena):
         marker_size: float = 0.25,
         move_speed=0.5,
         move_direction="right",
-        no_odor_marker=True
+        no_odor_marker=True,
+        tile_grid: Optional[Tuple[int, int]] = None,
+        tile_spacing: Tuple[float, float] = (50, 50),
+        odor_field=None,
+        defer_marker_updates: bool = True,
     ):
         super().__init__()
+        self.tile_grid = tile_grid
+        self.tile_spacing = np.array(tile_spacing, dtype=float)
+        if tile_grid is None:
+            self._tile_origins = np.zeros((1, 3))
+        else:
+            self._tile_origins = tile_origins(tile_grid, self.tile_spacing)
+            size = (
+                max(size[0], tile_grid[1] * self.tile_spacing[0] / 2),
+                max(size[1], tile_grid[0] * self.tile_spacing[1] / 2),
+            )
+        self.size = size
         ground_size = [*size, 1]
         chequered = self.root_element.asset.add(
             "texture",
@@ -114,6 +174,7 @@ class MovOdorArena(BaseArena):
         self.friction = friction
         self.num_sensors = num_sensors
         self.odor_source = np.array(odor_source, dtype=float)
+        self._initial_odor_source = self.odor_source.copy()
         self.peak_odor_intensity = np.array(peak_intensity)
         self.num_odor_sources = self.odor_source.shape[0]
         if self.odor_source.shape[0] != self.peak_odor_intensity.shape[0]:
@@ -121,6 +182,15 @@ class MovOdorArena(BaseArena):
                 "Number of odor source locations and peak intensities must match."
             )
         self.diffuse_func = diffuse_func
+        self.odor_field = odor_field
+        if (
+            odor_field is not None
+            and odor_field.odor_dimensions != self.odor_dimensions
+        ):
+            raise ValueError(
+                "The odor field and the peak intensities must have the same "
+                "number of odor dimensions."
+            )
 
         # Add birdeye camera
         self.birdeye_cam = self.root_element.worldbody.add(
@@ -140,17 +210,20 @@ class MovOdorArena(BaseArena):
             fovy=45,
         )
 
-        # Add markers at the odor sources
+        # Add markers at the odor sources; they are purely visual and do
+        # not take part in collision detection
         self.no_odor_marker = no_odor_marker
         if marker_colors is None:
             color_cycle_rgb = load_config()["color_cycle_rgb"]
             marker_colors = []
             num_odor_sources = self.odor_source.shape[0]
             for i in range(num_odor_sources):
-                rgb = np.array(color_cycle_rgb[i % num_odor_sources]) / 255
+                rgb = np.array(color_cycle_rgb[i % len(color_cycle_rgb)]) / 255
                 rgba = (*rgb, 1)
                 marker_colors.append(rgba)
 
+        self.visual_state = VisualState()
+        self.defer_marker_updates = defer_marker_updates
         self.marker_bodies = []
         for i, (pos, rgba) in enumerate(zip(self.odor_source, marker_colors)):
             marker_body = self.root_element.worldbody.add(
@@ -158,14 +231,24 @@ class MovOdorArena(BaseArena):
             )
             if no_odor_marker == False:
                 marker_body.add(
-                    "geom", type="capsule", size=(marker_size, marker_size), rgba=rgba
+                    "geom",
+                    type="capsule",
+                    size=(marker_size, marker_size),
+                    rgba=rgba,
+                    contype=0,
+                    conaffinity=0,
                 )
             else:
                 marker_body.add(
-                    "geom", type="capsule", size=(0.01, 0.01), rgba=rgba
+                    "geom",
+                    type="capsule",
+                    size=(0.01, 0.01),
+                    rgba=rgba,
+                    contype=0,
+                    conaffinity=0,
                 )
             self.marker_bodies.append(marker_body)
-        
+
         self.move_speed = move_speed
         self.curr_time = 0
         self.move_direction = move_direction
@@ -178,7 +261,6 @@ class MovOdorArena(BaseArena):
         else:
             raise ValueError("Invalid move_direction")
 
-
         # Reshape odor source and peak intensity arrays to simplify future claculations (This is deprecated, use get_olfaction instead)
         _odor_source_repeated = self.odor_source[:, np.newaxis, np.newaxis, :]
         _odor_source_repeated = np.repeat(
@@ -199,6 +281,38 @@ class MovOdorArena(BaseArena):
     ) -> Tuple[np.ndarray, np.ndarray]:
         return rel_pos, rel_angle
 
+    @property
+    def num_tiles(self) -> int:
+        return len(self._tile_origins)
+
+    def tile_origin(self, tile: int) -> np.ndarray:
+        """Returns the (x, y, z) origin of a tile."""
+        return self._tile_origins[tile].copy()
+
+    def tile_index(self, pos: np.ndarray) -> np.ndarray:
+        """Returns the index of the tile containing each position.
+
+        Parameters
+        ----------
+        pos : np.ndarray
+            Positions of shape (..., 3) or (..., 2).
+
+        Returns
+        -------
+        np.ndarray
+            Tile indices of shape (...). All zeros if the arena is not
+            tiled.
+        """
+        pos = np.asarray(pos)
+        if self.tile_grid is None:
+            return np.zeros(pos.shape[:-1], dtype=int)
+        rows, cols = self.tile_grid
+        col = np.rint(pos[..., 0] / self.tile_spacing[0] + (cols - 1) / 2)
+        row = np.rint(pos[..., 1] / self.tile_spacing[1] + (rows - 1) / 2)
+        col = np.clip(col, 0, cols - 1).astype(int)
+        row = np.clip(row, 0, rows - 1).astype(int)
+        return row * cols + col
+
     def get_olfaction(self, antennae_pos: np.ndarray) -> np.ndarray:
         """
         Notes
@@ -223,25 +337,60 @@ class MovOdorArena(BaseArena):
         Apply scaling: I = P * S -> [n, k, w] element wise
 
         Output - Sum over the first axis: [k, w]
+
+        If the arena is tiled, only the sources located in the tile of
+        the sensors are taken into account. If the arena has an
+        ``odor_field``, the field is sampled at the sensor positions
+        instead.
         """
-        odor_source_repeated = self.odor_source[:, np.newaxis, np.newaxis, :]
+        if self.odor_field is not None:
+            return self.odor_field.sample(antennae_pos)
+        odor_source = self.odor_source
+        peak_intensity_repeated = self._peak_intensity_repeated
+        if self.tile_grid is not None:
+            fly_tile = self.tile_index(antennae_pos.mean(axis=0))
+            in_tile = self.tile_index(odor_source) == fly_tile
+            odor_source = odor_source[in_tile]
+            peak_intensity_repeated = peak_intensity_repeated[in_tile]
+        odor_source_repeated = odor_source[:, np.newaxis, np.newaxis, :]
         odor_source_repeated = np.repeat(
             odor_source_repeated, self.odor_dimensions, axis=1
         )
-        odor_source_repeated = np.repeat(
-            odor_source_repeated, self.num_sensors, axis=2
-        )
+        odor_source_repeated = np.repeat(odor_source_repeated, self.num_sensors, axis=2)
         antennae_pos_repeated = antennae_pos[np.newaxis, np.newaxis, :, :]
         dist_3d = antennae_pos_repeated - odor_source_repeated  # (n, k, w, 3)
         dist_euc = np.linalg.norm(dist_3d, axis=3)  # (n, k, w)
         scaling = self.diffuse_func(dist_euc)  # (n, k, w)
-        intensity = self._peak_intensity_repeated * scaling  # (n, k, w)
+        intensity = peak_intensity_repeated * scaling  # (n, k, w)
         return intensity.sum(axis=0)  # (k, w)
 
     @property
     def odor_dimensions(self) -> int:
         return self.peak_odor_intensity.shape[1]
-    def step(self, dt,physics):
+
+    def reset(self, physics=None):
+        """Puts the odor sources and their markers back at their initial
+        positions and resets the odor field. flygym does not reset the
+        arena with the simulation: ``CourtshipEnv`` and ``ScenarioDriver``
+        call it (through ``courtship_env.reset_arena``) before resetting
+        the simulation.
+
+        Parameters
+        ----------
+        physics : mjcf.Physics, optional
+            Physics in which the markers are put back. If None, the
+            markers are only rewritten at the next step.
+        """
+        self.odor_source[:] = self._initial_odor_source
+        self.curr_time = 0
+        if self.odor_field is not None:
+            self.odor_field.reset()
+        if physics is not None:
+            self.visual_state.reset(physics)
+        else:
+            self.visual_state.clear()
+
+    def step(self, dt, physics):
         """
         Updates the position of the odor source based on the movement speed and direction.
 
@@ -250,8 +399,11 @@ class MovOdorArena(BaseArena):
         dt : float
             Time step to calculate the movement.
         """
+        if self.odor_field is not None:
+            self.odor_field.advance(dt, self.odor_source, self.peak_odor_intensity)
         for i in range(len(self.odor_source)):
             position_marker_odor = self.odor_source[i]
             position_marker_odor[2] = 4
-            physics.bind(self.marker_bodies[i]).mocap_pos = position_marker_odor
-            
+            self.visual_state.set_mocap_pos(self.marker_bodies[i], position_marker_odor)
+        if not self.defer_marker_updates:
+            self.visual_state.flush(physics)
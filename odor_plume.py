@@ -0,0 +1,381 @@
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Tuple, Union
+
+import numpy as np
+
+
+def _bilinear_coords(pos: np.ndarray, origin: np.ndarray, spacing, shape):
+    """Returns the four (iy, ix) corners around each position of a
+    (ny, nx) grid and their bilinear weights. Positions outside of the
+    grid take the values at its edge."""
+    g = (pos[:, :2] - origin) / spacing
+    i0 = np.floor(g).astype(int)
+    frac = g - i0
+    ny, nx = shape
+    ix0 = np.clip(i0[:, 0], 0, nx - 1)
+    iy0 = np.clip(i0[:, 1], 0, ny - 1)
+    ix1 = np.clip(i0[:, 0] + 1, 0, nx - 1)
+    iy1 = np.clip(i0[:, 1] + 1, 0, ny - 1)
+    fx, fy = frac[:, 0], frac[:, 1]
+    corners = ((iy0, ix0), (iy0, ix1), (iy1, ix0), (iy1, ix1))
+    weights = ((1 - fx) * (1 - fy), fx * (1 - fy), (1 - fx) * fy, fx * fy)
+    return corners, weights
+
+
+class OdorPlume:
+    """Dynamic odor plume on a 2D grid, shared by all flies of an arena.
+
+    The odor concentration of each odor dimension follows an
+    advection-diffusion equation with wind and first-order decay. Every
+    odor source emits at a rate proportional to its peak intensity. The
+    field is updated at a fixed rate, independently of the physics
+    timestep, and sampled at the sensor positions by bilinear
+    interpolation, so the cost of olfaction does not depend on the number
+    of sources.
+
+    The grid has periodic boundaries; choose an extent large enough for
+    the odor to decay before wrapping around.
+
+    Parameters
+    ----------
+    extent : Tuple[Tuple[float, float], Tuple[float, float]], optional
+        ((x_min, x_max), (y_min, y_max)) of the grid in mm.
+    resolution : float, optional
+        Size of a grid cell in mm, by default 0.5.
+    odor_dimensions : int, optional
+        Number of odor dimensions, by default 2.
+    diffusion : float, optional
+        Diffusion coefficient in mm^2/s.
+    wind : Tuple[float, float], optional
+        Wind velocity (x, y) in mm/s.
+    decay : float, optional
+        Decay rate of the odor in 1/s.
+    emission_rate : float, optional
+        Amount of odor emitted per second by a source of peak intensity 1.
+    update_interval : float, optional
+        Simulation time between two updates of the field, by default 0.01.
+    method : str, optional
+        ``"fft"`` (default) to propagate the field exactly in Fourier
+        space, unconditionally stable for any update interval, or
+        ``"stencil"`` for explicit finite differences with upwind
+        advection.
+    """
+
+    def __init__(
+        self,
+        extent: Tuple[Tuple[float, float], Tuple[float, float]] = (
+            (-30, 50),
+            (-40, 40),
+        ),
+        resolution: float = 0.5,
+        odor_dimensions: int = 2,
+        diffusion: float = 5.0,
+        wind: Tuple[float, float] = (0.0, 0.0),
+        decay: float = 1.0,
+        emission_rate: float = 10.0,
+        update_interval: float = 0.01,
+        method: str = "fft",
+    ):
+        if method not in ("fft", "stencil"):
+            raise ValueError("method must be 'fft' or 'stencil'")
+        (x_min, x_max), (y_min, y_max) = extent
+        self.origin = np.array([x_min, y_min], dtype=float)
+        self.resolution = resolution
+        self.shape = (
+            int(np.ceil((y_max - y_min) / resolution)),
+            int(np.ceil((x_max - x_min) / resolution)),
+        )
+        self.diffusion = diffusion
+        self.wind = np.array(wind, dtype=float)
+        self.decay = decay
+        self.emission_rate = emission_rate
+        self.update_interval = update_interval
+        self.method = method
+        self.field = np.zeros((odor_dimensions, *self.shape))
+        self._elapsed = 0.0
+        self._propagator = None
+        self._propagator_dt = None
+
+    @property
+    def odor_dimensions(self) -> int:
+        return self.field.shape[0]
+
+    def reset(self):
+        self.field[:] = 0
+        self._elapsed = 0.0
+
+    def get_state(self) -> Dict[str, np.ndarray]:
+        """Returns a copy of the state changed by ``advance``, e.g. to
+        cache a settled simulation."""
+        return {"field": self.field.copy(), "elapsed": np.array(self._elapsed)}
+
+    def set_state(self, state: Dict[str, np.ndarray]):
+        """Restores a state returned by ``get_state``."""
+        self.field[:] = state["field"]
+        self._elapsed = float(state["elapsed"])
+
+    def advance(self, dt: float, odor_source: np.ndarray, peak_intensity: np.ndarray):
+        """Advances the plume by ``dt``; the field is only updated once
+        ``update_interval`` has elapsed.
+
+        Parameters
+        ----------
+        dt : float
+            Time since the last call.
+        odor_source : np.ndarray
+            Positions of the odor sources, of shape (n_sources, 3).
+        peak_intensity : np.ndarray
+            Peak intensities of the sources, of shape
+            (n_sources, odor_dimensions).
+        """
+        self._elapsed += dt
+        if self._elapsed < self.update_interval:
+            return
+        elapsed, self._elapsed = self._elapsed, 0.0
+        self._deposit(odor_source, peak_intensity, elapsed)
+        if self.method == "fft":
+            self._propagate_fft(elapsed)
+        else:
+            self._propagate_stencil(elapsed)
+
+    def _grid_coords(self, pos: np.ndarray):
+        """Returns the lower cell indices and the bilinear weights."""
+        return _bilinear_coords(pos, self.origin, self.resolution, self.shape)
+
+    def _deposit(self, odor_source, peak_intensity, elapsed):
+        amount = peak_intensity.T * (
+            self.emission_rate * elapsed / self.resolution**2
+        )  # (k, n)
+        corners, weights = self._grid_coords(np.asarray(odor_source))
+        for (iy, ix), w in zip(corners, weights):
+            np.add.at(self.field, (slice(None), iy, ix), amount * w)
+
+    def _propagate_fft(self, dt):
+        # the elapsed time is the same at every update up to rounding, so
+        # the propagator is only recomputed if the interval changes
+        dt = round(dt, 9)
+        if dt != self._propagator_dt:
+            ny, nx = self.shape
+            kx = 2 * np.pi * np.fft.rfftfreq(nx, d=self.resolution)
+            ky = 2 * np.pi * np.fft.fftfreq(ny, d=self.resolution)
+            kx, ky = np.meshgrid(kx, ky)
+            exponent = (
+                -self.diffusion * (kx**2 + ky**2)
+                - self.decay
+                - 1j * (kx * self.wind[0] + ky * self.wind[1])
+            )
+            self._propagator = np.exp(exponent * dt)
+            self._propagator_dt = dt
+        spectrum = np.fft.rfft2(self.field, axes=(-2, -1))
+        self.field = np.fft.irfft2(
+            spectrum * self._propagator, s=self.shape, axes=(-2, -1)
+        )
+        np.maximum(self.field, 0, out=self.field)
+
+    def _propagate_stencil(self, dt):
+        h = self.resolution
+        # substeps keeping the explicit scheme stable: the diffusion,
+        # advection and decay terms all take from the same cell
+        rate = 4 * self.diffusion / h**2 + np.abs(self.wind).sum() / h + self.decay
+        n_substeps = max(1, int(np.ceil(dt * rate / 0.9)))
+        sub_dt = dt / n_substeps
+        ux, uy = self.wind
+        f = self.field
+        for _ in range(n_substeps):
+            left, right = np.roll(f, 1, axis=-1), np.roll(f, -1, axis=-1)
+            down, up = np.roll(f, 1, axis=-2), np.roll(f, -1, axis=-2)
+            laplacian = (left + right + down + up - 4 * f) / h**2
+            dfdx = (f - left) / h if ux > 0 else (right - f) / h
+            dfdy = (f - down) / h if uy > 0 else (up - f) / h
+            f = f + sub_dt * (
+                self.diffusion * laplacian - ux * dfdx - uy * dfdy - self.decay * f
+            )
+        self.field = f
+
+    def sample(self, positions: np.ndarray) -> np.ndarray:
+        """Interpolates the field at the given positions.
+
+        Parameters
+        ----------
+        positions : np.ndarray
+            Sensor positions of shape (w, 3), e.g. the antennae and
+            maxillary palps of a fly.
+
+        Returns
+        -------
+        np.ndarray
+            Odor intensities of shape (odor_dimensions, w).
+        """
+        corners, weights = self._grid_coords(np.asarray(positions))
+        intensity = 0
+        for (iy, ix), w in zip(corners, weights):
+            intensity = intensity + self.field[:, iy, ix] * w
+        return intensity
+
+
+class MappedOdorField:
+    """Time-varying odor field replayed from a file, e.g. a recorded or
+    precomputed plume.
+
+    The frames are stored as a (T, H, W, k) array in a ``.npy`` file that
+    is memory-mapped, so only the frames in use are read from disk. Frame
+    ``i`` holds the field at time ``time_offset + i * frame_interval`` on
+    a regular grid covering ``extent``; the field is interpolated
+    bilinearly in space and linearly in time. The frames following the
+    current one are read ahead by a background thread, so that reaching a
+    new frame does not stall the simulation.
+
+    The field implements the same ``advance``/``sample`` interface as
+    ``OdorPlume`` and is used through the ``odor_field`` argument of
+    ``MovOdorArena``. The odor sources of the arena are ignored, but
+    ``advance`` keeps track of the simulation time.
+
+    Parameters
+    ----------
+    frames : str, Path or np.ndarray
+        Path of the ``.npy`` file, or an array of shape (T, H, W, k).
+    extent : Tuple[Tuple[float, float], Tuple[float, float]]
+        ((x_min, x_max), (y_min, y_max)) in mm of the first and last grid
+        points along x (W) and y (H).
+    frame_interval : float
+        Time in seconds between two frames.
+    time_offset : float, optional
+        Simulation time of the first frame, by default 0.
+    loop : bool, optional
+        Loop over the frames; otherwise the last frame is held. By
+        default False.
+    intensity_scale : float, optional
+        Factor applied to the stored values, by default 1.
+    prefetch : int, optional
+        Number of frames read ahead, by default 2. 0 reads every frame
+        when it is first needed.
+    """
+
+    def __init__(
+        self,
+        frames: Union[str, Path, np.ndarray],
+        extent: Tuple[Tuple[float, float], Tuple[float, float]],
+        frame_interval: float,
+        time_offset: float = 0.0,
+        loop: bool = False,
+        intensity_scale: float = 1.0,
+        prefetch: int = 2,
+    ):
+        if isinstance(frames, (str, Path)):
+            frames = np.load(frames, mmap_mode="r")
+        if frames.ndim != 4:
+            raise ValueError("frames must have shape (T, H, W, k)")
+        self.frames = frames
+        self.num_frames, ny, nx, _ = frames.shape
+        (x_min, x_max), (y_min, y_max) = extent
+        self.origin = np.array([x_min, y_min], dtype=float)
+        self.spacing = np.array(
+            [(x_max - x_min) / max(nx - 1, 1), (y_max - y_min) / max(ny - 1, 1)]
+        )
+        self.shape = (ny, nx)
+        self.frame_interval = frame_interval
+        self.time_offset = time_offset
+        self.loop = loop
+        self.intensity_scale = intensity_scale
+        self.prefetch = prefetch
+        self.time = 0.0
+        self._executor = ThreadPoolExecutor(max_workers=1) if prefetch > 0 else None
+        self._loaded = {}
+        self._current = None
+
+    @property
+    def odor_dimensions(self) -> int:
+        return self.frames.shape[3]
+
+    def reset(self):
+        self.time = 0.0
+
+    def get_state(self) -> Dict[str, np.ndarray]:
+        """Returns the replay time, the only state changed by
+        ``advance``."""
+        return {"time": np.array(self.time)}
+
+    def set_state(self, state: Dict[str, np.ndarray]):
+        """Restores a state returned by ``get_state``."""
+        self.time = float(state["time"])
+
+    def advance(self, dt: float, odor_source=None, peak_intensity=None):
+        """Advances the replay time by ``dt``."""
+        self.time += dt
+
+    def _read(self, i: int) -> np.ndarray:
+        return np.array(self.frames[i], dtype=float)
+
+    def _frame(self, i: int) -> np.ndarray:
+        """Returns frame ``i`` in memory, and schedules the next ones."""
+        if i not in self._loaded:
+            self._loaded[i] = None if self._executor is None else self._executor.submit(self._read, i)
+        frame = self._loaded[i]
+        if frame is None:
+            frame = self._loaded[i] = self._read(i)
+        elif not isinstance(frame, np.ndarray):
+            frame = self._loaded[i] = frame.result()
+        return frame
+
+    def _frame_index(self, time: float) -> Tuple[int, int, float]:
+        pos = max(time - self.time_offset, 0.0) / self.frame_interval
+        i0 = int(np.floor(pos))
+        alpha = pos - i0
+        if self.loop:
+            return i0 % self.num_frames, (i0 + 1) % self.num_frames, alpha
+        if i0 >= self.num_frames - 1:
+            return self.num_frames - 1, self.num_frames - 1, 0.0
+        return i0, i0 + 1, alpha
+
+    def _update_cache(self, i0: int):
+        """Drops the frames left behind and reads the next ones ahead."""
+        ahead = [(i0 + j) % self.num_frames if self.loop else i0 + j for j in range(self.prefetch + 2)]
+        ahead = [i for i in ahead if i < self.num_frames]
+        for i in list(self._loaded):
+            if i not in ahead:
+                future = self._loaded.pop(i)
+                if future is not None and not isinstance(future, np.ndarray):
+                    future.cancel()
+        if self._executor is not None:
+            for i in ahead:
+                if i not in self._loaded:
+                    self._loaded[i] = self._executor.submit(self._read, i)
+
+    def sample(self, positions: np.ndarray) -> np.ndarray:
+        """Interpolates the field at the given positions at the current
+        replay time.
+
+        Parameters
+        ----------
+        positions : np.ndarray
+            Sensor positions of shape (w, 3). The sensors of several flies
+            can be sampled at once by stacking them.
+
+        Returns
+        -------
+        np.ndarray
+            Odor intensities of shape (odor_dimensions, w).
+        """
+        i0, i1, alpha = self._frame_index(self.time)
+        if i0 != self._current:
+            self._update_cache(i0)
+            self._current = i0
+        corners, weights = _bilinear_coords(
+            np.asarray(positions), self.origin, self.spacing, self.shape
+        )
+        intensity = 0
+        for i, frame_weight in ((i0, 1 - alpha), (i1, alpha)):
+            if frame_weight == 0:
+                continue
+            frame = self._frame(i)
+            for (iy, ix), w in zip(corners, weights):
+                intensity = intensity + frame[iy, ix] * (w * frame_weight)[:, np.newaxis]
+        return np.asarray(intensity).T * self.intensity_scale
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+        self._loaded.clear()
+        self._current = None
@@ -2,12 +2,17 @@ from hybrid_turning_fly import HybridTurningFly
 import numpy as np
 
 class OdorTaxisFly(HybridTurningFly):
-    def __init__(self, odor_dimensions, odor_gains, odor_threshold=0.14, decision_interval=0.05, **kwargs):
+    def __init__(self, odor_dimensions, odor_gains, odor_threshold=0.14, decision_interval=0.05, decision_scheduler=None, **kwargs):
         super().__init__(**kwargs, enable_vision=True)
         self.odor_threshold = odor_threshold
         self.decision_interval = decision_interval
         self.odor_dimensions = odor_dimensions
         self.num_substeps = int(self.decision_interval / self.timestep)
+        # Optional AdaptiveDecisionScheduler updating decision_interval at
+        # every call to process_odor_intensities
+        self.decision_scheduler = decision_scheduler
+        if decision_scheduler is not None:
+            self.set_decision_interval(decision_scheduler.interval)
         self.odor_gains = odor_gains
         self._reached_odor_source = False
         self.odor_turning = True
@@ -24,6 +29,11 @@ class OdorTaxisFly(HybridTurningFly):
         denom[denom == 0] = 1  # Avoid division by zero
         delta_I = (I_l - I_r) / denom
 
+        if self.decision_scheduler is not None:
+            self.set_decision_interval(
+                self.decision_scheduler.update(I, delta_I, self.odor_threshold)
+            )
+
         # Calculate the weighted sum of the asymmetries for each odor
         s = np.dot(self.odor_gains, delta_I)
 
@@ -48,7 +58,22 @@ class OdorTaxisFly(HybridTurningFly):
             self._reached_odor_source = False
         return control_signal
     
+    def set_decision_interval(self, decision_interval):
+        """Sets the decision interval, rounded to a whole number of physics
+        steps."""
+        self.num_substeps = max(1, int(round(decision_interval / self.timestep)))
+        self.decision_interval = self.num_substeps * self.timestep
+
+    def reset(self, sim, **kwargs):
+        obs, info = super().reset(sim, **kwargs)
+        if self.decision_scheduler is not None:
+            self.decision_scheduler.reset()
+            self.set_decision_interval(self.decision_scheduler.interval)
+        return obs, info
+
     def pre_step(self, action, sim):
+        if self.decision_scheduler is not None:
+            self.decision_scheduler.advance(sim.timestep)
         if not self.odor_turning:
             #assert action.shape == (42,), f"Action shape must be (42,), got {action.shape}."
             return super(HybridTurningFly, self).pre_step(action, sim)
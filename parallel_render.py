@@ -0,0 +1,284 @@
+import copy
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Optional, Sequence, Tuple
+
+import numpy as np
+
+from replay import update_cameras
+from viz_state import sync_visuals
+
+
+# Model fields that the simulation changes while running: corrections and
+# markers recolor geoms
+_model_fields = ("geom_rgba",)
+# Poses drawn by the renderer, copied as computed by the simulation rather
+# than recomputed from qpos: after mj_step they describe the state at the
+# start of the step, and the camera poses include the updates of the
+# flygym cameras (fixed height, fly-following rotation)
+_data_fields = (
+    "xpos",
+    "xquat",
+    "xmat",
+    "geom_xpos",
+    "geom_xmat",
+    "site_xpos",
+    "site_xmat",
+    "cam_xpos",
+    "cam_xmat",
+    "light_xpos",
+    "light_xdir",
+    "qpos",
+    "mocap_pos",
+    "mocap_quat",
+)
+
+
+def _overlay_text(camera, curr_time: float) -> str:
+    """Returns the text drawn on the frames of a flygym ``Camera``."""
+    if camera.play_speed_text and camera.timestamp_text:
+        return f"{curr_time:.2f}s ({camera.play_speed}x)"
+    if camera.play_speed_text:
+        return f"{camera.play_speed}x"
+    if camera.timestamp_text:
+        return f"{curr_time:.2f}s"
+    return ""
+
+
+def _draw_text(img: np.ndarray, text: str) -> np.ndarray:
+    """Draws text as ``Camera.render`` does."""
+    import cv2
+
+    return cv2.putText(
+        img,
+        text,
+        org=(20, 30),
+        fontFace=cv2.FONT_HERSHEY_DUPLEX,
+        fontScale=0.8,
+        color=(0, 0, 0),
+        lineType=cv2.LINE_AA,
+        thickness=1,
+    )
+
+
+class _CameraWorker:
+    """Renders one camera on its own thread, with its own copy of the
+    model, its own data and its own offscreen context."""
+
+    def __init__(self, model, camera: str, width: int, height: int, overlay=None):
+        import mujoco
+
+        self.camera = camera
+        self.width = width
+        self.height = height
+        # flygym Camera whose text overlay is drawn on the frames
+        self.overlay = overlay
+        self._model = copy.deepcopy(model)
+        self._data = mujoco.MjData(self._model)
+        self._renderer = None
+        # The rendering context must be created on the thread that uses it
+        self.executor = ThreadPoolExecutor(max_workers=1, initializer=self._init)
+
+    def _init(self):
+        import mujoco
+
+        self._renderer = mujoco.Renderer(self._model, height=self.height, width=self.width)
+
+    def _apply(self, snapshot: Dict[str, np.ndarray]):
+        for field in _model_fields:
+            getattr(self._model, field)[:] = snapshot[field]
+        for field in _data_fields:
+            getattr(self._data, field)[:] = snapshot[field]
+
+    def _render(self, snapshot: Dict[str, np.ndarray]) -> np.ndarray:
+        self._apply(snapshot)
+        self._renderer.update_scene(self._data, camera=self.camera)
+        img = self._renderer.render()
+        if self.overlay is not None:
+            text = _overlay_text(self.overlay, float(snapshot["time"]))
+            if text:
+                img = _draw_text(img, text)
+        return img
+
+    def submit(self, snapshot):
+        return self.executor.submit(self._render, snapshot)
+
+    def close(self):
+        if self._renderer is not None:
+            self.executor.submit(self._renderer.close).result()
+        self.executor.shutdown()
+
+
+class FrameBundle:
+    """Frames of all cameras rendered from the same physics snapshot."""
+
+    def __init__(self, time: float, futures: Dict[str, Future]):
+        self.time = time
+        self._futures = futures
+
+    def done(self) -> bool:
+        return all(future.done() for future in self._futures.values())
+
+    def result(self) -> Dict[str, np.ndarray]:
+        """Waits for the frames and returns them keyed by camera name."""
+        return {name: future.result() for name, future in self._futures.items()}
+
+
+class ParallelCameraRenderer:
+    """Renders several cameras in parallel, off the simulation thread.
+
+    At each render tick, ``submit`` first applies the updates a flygym
+    ``Camera`` makes before rendering (fixed height, rotation following
+    the fly, alignment with gravity), then copies the poses of the bodies,
+    geoms, sites, cameras and lights and the geom colors once; every
+    camera renders that same snapshot on its own thread with its own
+    offscreen context, and the text overlay of flygym cameras is drawn on
+    the frames. The frames are thus the ones ``Simulation.render`` would
+    produce. The call returns immediately, so the physics keeps stepping
+    while the frames are drawn; completed frames are gathered by
+    ``collect``.
+
+    The contact and gravity arrows of flygym cameras are not supported.
+    The cameras only run in parallel with a rendering backend that
+    supports one context per thread, such as EGL (``MUJOCO_GL=egl``).
+
+    Parameters
+    ----------
+    physics : dm_control.mjcf.Physics
+        Physics of the simulation, e.g. ``sim.physics``.
+    cameras : Sequence[str or Camera]
+        Names of the MuJoCo cameras to render, or flygym ``Camera``
+        objects whose ``camera_id`` and ``window_size`` are used.
+    window_size : Tuple[int, int], optional
+        (width, height) of the frames of cameras given by name.
+    fps : int, optional
+        Frame rate of the output videos, by default 30.
+    play_speed : float, optional
+        Simulated time per second of video, by default 0.5.
+    max_pending : int, optional
+        Number of snapshots that can be rendering at once before
+        ``submit`` waits for the oldest, by default 2.
+    """
+
+    def __init__(
+        self,
+        physics,
+        cameras: Sequence,
+        window_size: Tuple[int, int] = (800, 608),
+        fps: int = 30,
+        play_speed: float = 0.5,
+        max_pending: int = 2,
+    ):
+        self.render_interval = play_speed / fps
+        self.max_pending = max_pending
+        self._workers = {}
+        self._cameras = []
+        for camera in cameras:
+            if isinstance(camera, str):
+                name, (width, height), overlay = camera, window_size, None
+            else:
+                if camera.draw_contacts or camera.draw_gravity:
+                    raise ValueError(
+                        f"Camera {camera.camera_id}: contact and gravity arrows "
+                        "are not supported by the parallel renderer."
+                    )
+                name, (width, height), overlay = camera.camera_id, camera.window_size, camera
+                self._cameras.append(camera)
+            self._workers[name] = _CameraWorker(
+                physics.model.ptr, name, width, height, overlay=overlay
+            )
+        self.frames = {name: [] for name in self._workers}
+        self.times = []
+        self._pending = deque()
+        self._next_time = 0.0
+
+    def due(self, curr_time: float) -> bool:
+        return curr_time >= self._next_time
+
+    def snapshot(self, physics, curr_time: float, floor_height: float = 0.0) -> Dict[str, np.ndarray]:
+        """Applies the camera updates and returns a copy of the state
+        drawn by the workers."""
+        update_cameras(self._cameras, physics, floor_height)
+        snapshot = {field: np.array(getattr(physics.model, field)) for field in _model_fields}
+        for field in _data_fields:
+            snapshot[field] = np.array(getattr(physics.data, field))
+        snapshot["time"] = np.array(curr_time)
+        return snapshot
+
+    def submit(self, physics, curr_time: float, floor_height: float = 0.0) -> FrameBundle:
+        """Renders the current state of ``physics`` on all cameras.
+
+        Parameters
+        ----------
+        physics : dm_control.mjcf.Physics
+            Physics of the simulation.
+        curr_time : float
+            Simulation time, used for the text overlay.
+        floor_height : float, optional
+            Height of the floor, used by flygym cameras keeping a fixed
+            height above it, e.g. ``sim._floor_height``.
+
+        Returns
+        -------
+        FrameBundle
+            Frames being rendered; they are also added to ``frames`` by
+            ``collect``.
+        """
+        if len(self._pending) >= self.max_pending:
+            self._store(self._pending.popleft())
+        snapshot = self.snapshot(physics, curr_time, floor_height)
+        bundle = FrameBundle(
+            curr_time,
+            {name: worker.submit(snapshot) for name, worker in self._workers.items()},
+        )
+        self._pending.append(bundle)
+        self._next_time += self.render_interval
+        return bundle
+
+    def render(self, sim) -> Optional[FrameBundle]:
+        """Submits a snapshot of the simulation if a frame is due. The
+        deferred visuals of the arena and the flies are written first
+        (``viz_state.sync_visuals``) and, like ``Simulation.render``, the
+        flies update their colors (e.g. adhesion)."""
+        if self.due(sim.curr_time):
+            sync_visuals(sim)
+            for fly in sim.flies:
+                fly.update_colors(sim.physics)
+            return self.submit(sim.physics, sim.curr_time, sim._floor_height)
+        return None
+
+    def _store(self, bundle: FrameBundle):
+        for name, frame in bundle.result().items():
+            self.frames[name].append(frame)
+        self.times.append(bundle.time)
+
+    def collect(self, wait: bool = False) -> int:
+        """Moves the rendered frames, in order, to ``frames``.
+
+        Parameters
+        ----------
+        wait : bool, optional
+            Wait for all pending snapshots; otherwise only the ones that
+            are done are collected.
+
+        Returns
+        -------
+        int
+            Number of snapshots collected.
+        """
+        n_collected = 0
+        while self._pending and (wait or self._pending[0].done()):
+            self._store(self._pending.popleft())
+            n_collected += 1
+        return n_collected
+
+    def close(self):
+        self.collect(wait=True)
+        for worker in self._workers.values():
+            worker.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
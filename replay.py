@@ -0,0 +1,275 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from pathlib import Path
+from typing import Callable, List, Optional, Sequence, Union
+
+import numpy as np
+
+from viz_state import sync_visuals
+
+
+PathLike = Union[str, Path]
+
+
+def update_cameras(cameras: Sequence, physics, floor_height: float = 0.0):
+    """Moves flygym cameras as ``Camera.render`` does before drawing a
+    frame: fixed height above the floor, rotation following the fly and
+    alignment with gravity. The poses are written to ``data.cam_xpos``
+    and ``data.cam_xmat``."""
+    for camera in cameras:
+        if camera.update_camera_pos:
+            camera._update_cam_pos(physics, floor_height)
+        if camera.camera_follows_fly_orientation:
+            camera._update_cam_rot(physics)
+        if camera.align_camera_with_gravity:
+            camera._rotate_camera(physics)
+
+
+def _moves_camera(camera) -> bool:
+    """True if a flygym ``Camera`` sets its pose itself, which MuJoCo
+    cannot recompute from the state."""
+    return (
+        camera.update_camera_pos
+        or camera.camera_follows_fly_orientation
+        or camera.align_camera_with_gravity
+    )
+
+
+class StateRecorder:
+    """Records the physics state at the render rate for offline replay.
+
+    Only what is needed to redraw a frame is stored: the generalized
+    positions, the mocap body poses (e.g. odor source markers) and the
+    poses of the tracking flygym cameras, which they set directly in
+    ``data.cam_xpos`` and ``data.cam_xmat``. The tracking cameras are the
+    ones given here and those of the simulation that move themselves;
+    they are saved by name, so that the replay model may have other
+    cameras. The other cameras are placed by MuJoCo when replayed.
+
+    Parameters
+    ----------
+    interval : float
+        Simulation time between two recorded frames. Use
+        ``StateRecorder.for_camera`` to match the frame rate of a
+        ``Camera``.
+    cameras : Sequence[Camera], optional
+        flygym cameras that are moved as for rendering before each
+        recorded frame, so that they can be replayed without rendering
+        them live. Cameras rendered live (``sim.render()`` called before
+        ``record``) are already in place. The deferred visuals of the
+        arena and the flies (e.g. odor source markers) are written before
+        each recorded frame.
+    """
+
+    def __init__(self, interval: float, cameras: Sequence = ()):
+        self.interval = interval
+        self.cameras = list(cameras)
+        self.times = []
+        self.qpos = []
+        self.mocap_pos = []
+        self.mocap_quat = []
+        self.camera_names = None
+        self.cam_xpos = []
+        self.cam_xmat = []
+        self._camera_ids = None
+        self._next_time = 0.0
+
+    @classmethod
+    def for_camera(cls, camera) -> "StateRecorder":
+        """Records the poses of a flygym ``Camera`` at its frame rate."""
+        return cls(camera.play_speed / camera.fps, cameras=[camera])
+
+    def __len__(self) -> int:
+        return len(self.times)
+
+    def record(self, sim) -> bool:
+        """Records the current state if a frame is due.
+
+        Call this after every ``sim.step``. Returns True if a frame was
+        recorded.
+        """
+        if sim.curr_time < self._next_time:
+            return False
+        physics = sim.physics
+        sync_visuals(sim)
+        update_cameras(self.cameras, physics, sim._floor_height)
+        if self._camera_ids is None:
+            tracking = [
+                camera for camera in [*self.cameras, *sim.cameras] if _moves_camera(camera)
+            ]
+            self.camera_names = list(dict.fromkeys(camera.camera_id for camera in tracking))
+            self._camera_ids = [
+                physics.model.name2id(name, "camera") for name in self.camera_names
+            ]
+        self.times.append(sim.curr_time)
+        self.qpos.append(physics.data.qpos.copy())
+        self.mocap_pos.append(physics.data.mocap_pos.copy())
+        self.mocap_quat.append(physics.data.mocap_quat.copy())
+        self.cam_xpos.append(physics.data.cam_xpos[self._camera_ids])
+        self.cam_xmat.append(physics.data.cam_xmat[self._camera_ids])
+        self._next_time += self.interval
+        return True
+
+    def save(self, path: PathLike):
+        """Saves the recorded frames to a compressed .npz file."""
+        np.savez_compressed(
+            path,
+            interval=self.interval,
+            times=np.array(self.times),
+            qpos=np.array(self.qpos),
+            mocap_pos=np.array(self.mocap_pos),
+            mocap_quat=np.array(self.mocap_quat),
+            camera_names=np.array(self.camera_names or [], dtype=str),
+            cam_xpos=np.array(self.cam_xpos),
+            cam_xmat=np.array(self.cam_xmat),
+        )
+
+
+def save_model(sim, path: PathLike):
+    """Saves the compiled MuJoCo model of a simulation as a binary .mjb
+    file, so that replay workers can load it without building the flies
+    and the arena."""
+    import mujoco
+
+    mujoco.mj_saveModel(sim.physics.model.ptr, str(path), None)
+
+
+def load_trajectory(path: PathLike) -> dict:
+    """Loads the frames saved by ``StateRecorder.save``."""
+    with np.load(path) as data:
+        return {key: data[key] for key in data.files}
+
+
+def _tracking_camera_ids(model, trajectory: dict) -> np.ndarray:
+    """Ids in ``model`` of the recorded tracking cameras, -1 for those it
+    does not have."""
+    import mujoco
+
+    return np.array(
+        [
+            mujoco.mj_name2id(model, mujoco.mjtObj.mjOBJ_CAMERA, str(name))
+            for name in trajectory["camera_names"]
+        ],
+        dtype=int,
+    )
+
+
+def _set_state(model, data, trajectory: dict, frame: int, camera_ids: np.ndarray):
+    import mujoco
+
+    data.qpos[:] = trajectory["qpos"][frame]
+    if model.nmocap:
+        data.mocap_pos[:] = trajectory["mocap_pos"][frame]
+        data.mocap_quat[:] = trajectory["mocap_quat"][frame]
+    # Kinematics and subtree centers of mass are enough to place bodies,
+    # cameras and lights; there is no need for a full mj_forward
+    # (collisions, dynamics)
+    mujoco.mj_kinematics(model, data)
+    mujoco.mj_comPos(model, data)
+    mujoco.mj_camlight(model, data)
+    # the tracking flygym cameras are placed as they were when recorded
+    found = camera_ids >= 0
+    data.cam_xpos[camera_ids[found]] = trajectory["cam_xpos"][frame][found]
+    data.cam_xmat[camera_ids[found]] = trajectory["cam_xmat"][frame][found]
+
+
+def _render_frames(
+    model_path: str,
+    trajectory_path: str,
+    camera: str,
+    width: int,
+    height: int,
+    start: int,
+    stop: int,
+) -> List[np.ndarray]:
+    import mujoco
+
+    model = mujoco.MjModel.from_binary_path(model_path)
+    data = mujoco.MjData(model)
+    trajectory = load_trajectory(trajectory_path)
+    camera_ids = _tracking_camera_ids(model, trajectory)
+    renderer = mujoco.Renderer(model, height=height, width=width)
+    frames = []
+    try:
+        for frame in range(start, stop):
+            _set_state(model, data, trajectory, frame, camera_ids)
+            renderer.update_scene(data, camera=camera)
+            frames.append(renderer.render())
+    finally:
+        renderer.close()
+    return frames
+
+
+def render_replay(
+    model_path: PathLike,
+    trajectory_path: PathLike,
+    camera: str,
+    window_size=(800, 608),
+    n_workers: Optional[int] = None,
+    overlay: Optional[Callable[[np.ndarray, int], np.ndarray]] = None,
+) -> List[np.ndarray]:
+    """Renders recorded frames from any camera, without controllers or
+    physics stepping.
+
+    The frames are split into contiguous chunks that are rendered in
+    separate worker processes, each with its own model and rendering
+    context.
+
+    Parameters
+    ----------
+    model_path : str or Path
+        Model saved with ``save_model``. Its cameras may differ from the
+        recorded simulation (e.g. added or edited cameras), as long as
+        the bodies and joints are the same.
+    trajectory_path : str or Path
+        Frames saved with ``StateRecorder.save``.
+    camera : str
+        Full name of the camera, e.g. ``"birdeye_cam"``,
+        ``"mov_birdeye_cam"`` or ``"male/camera_left"`` (this is the
+        ``camera_id`` attribute of a flygym ``Camera``).
+    window_size : Tuple[int, int], optional
+        Width and height of the frames, by default (800, 608).
+    n_workers : int, optional
+        Number of worker processes. If 0, frames are rendered in the
+        calling process. By default, one per CPU.
+    overlay : Callable[[np.ndarray, int], np.ndarray], optional
+        Applied to each frame with its index, e.g. to draw text.
+
+    Returns
+    -------
+    List[np.ndarray]
+        The rendered frames.
+    """
+    width, height = window_size
+    trajectory = load_trajectory(trajectory_path)
+    n_frames = len(trajectory["times"])
+    args = (str(model_path), str(trajectory_path), camera, width, height)
+
+    if n_workers == 0:
+        frames = _render_frames(*args, 0, n_frames)
+    else:
+        n_workers = min(n_workers or os.cpu_count(), max(n_frames, 1))
+        bounds = np.linspace(0, n_frames, n_workers + 1).astype(int)
+        with ProcessPoolExecutor(
+            max_workers=n_workers, mp_context=get_context("spawn")
+        ) as executor:
+            futures = [
+                executor.submit(_render_frames, *args, start, stop)
+                for start, stop in zip(bounds[:-1], bounds[1:])
+            ]
+            frames = [frame for future in futures for frame in future.result()]
+
+    if overlay is not None:
+        frames = [overlay(frame, i) for i, frame in enumerate(frames)]
+    return frames
+
+
+def write_video(frames: List[np.ndarray], path: PathLike, fps: float = 30):
+    """Writes frames to a video file."""
+    import imageio
+
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    with imageio.get_writer(path, fps=fps) as writer:
+        for frame in frames:
+            writer.append_data(frame)
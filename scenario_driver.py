@@ -0,0 +1,351 @@
+from abc import ABC, abstractmethod
+from typing import Callable, Dict, Iterable, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from control_schedules import Schedule
+from courtship_env import bind_odor_sources, reset_arena
+from viz_state import render, render_due
+
+
+Policy = Callable[[dict, float], np.ndarray]
+
+
+class TerminationEvent(ABC):
+    """Condition ending a scenario.
+
+    ``check`` returns a short reason when the scenario must stop, None
+    otherwise. Events with ``every_step`` set are checked after every
+    physics step; the others only once per decision interval.
+    """
+
+    every_step = False
+
+    def reset(self):
+        pass
+
+    @abstractmethod
+    def check(self, sim, obs: dict, elapsed: float) -> Optional[str]:
+        """
+        Parameters
+        ----------
+        sim : Simulation
+            The running simulation.
+        obs : dict
+            Latest observations, keyed by fly name.
+        elapsed : float
+            Simulation time since the previous check.
+        """
+
+
+class DecisionReached(TerminationEvent):
+    """Updates the decision of a ``FemaleDecisionHybriTurnFly`` and stops
+    once she accepts or rejects.
+
+    Parameters
+    ----------
+    female : FemaleDecisionHybriTurnFly
+        The deciding fly.
+    time_before_decision : float, optional
+        Time the male has to stay close before the female decides.
+    """
+
+    def __init__(self, female, time_before_decision: float = 2.0):
+        self.female = female
+        self.time_before_decision = time_before_decision
+        self.state = None
+
+    def reset(self):
+        self.female.decision_engine.reset()
+        self.state = None
+
+    def check(self, sim, obs, elapsed):
+        self.state = self.female.get_female_mating_state(
+            obs[self.female.name]["odor_intensity"],
+            timestep=elapsed,
+            time_before_decision=self.time_before_decision,
+        )
+        if self.female.decision_engine.decided[0]:
+            return self.state.label
+
+
+class FliesApart(TerminationEvent):
+    """Stops when two flies are farther apart than ``max_distance`` (mm)
+    in the xy plane."""
+
+    def __init__(self, fly_a: str, fly_b: str, max_distance: float, every_step=False):
+        self.fly_a = fly_a
+        self.fly_b = fly_b
+        self.max_distance = max_distance
+        self.every_step = every_step
+
+    def check(self, sim, obs, elapsed):
+        pos_a = obs[self.fly_a]["fly"][0, :2]
+        pos_b = obs[self.fly_b]["fly"][0, :2]
+        if np.linalg.norm(pos_a - pos_b) > self.max_distance:
+            return "flies_apart"
+
+
+class LeftArena(TerminationEvent):
+    """Stops when a fly leaves the arena.
+
+    Parameters
+    ----------
+    bounds : Tuple[Tuple[float, float], Tuple[float, float]], optional
+        ((x_min, x_max), (y_min, y_max)) in mm. By default the extent of
+        the ground of the arena, ``(-size, size)`` along each axis.
+    flies : Sequence[str], optional
+        Names of the flies to check, by default all of them.
+    every_step : bool, optional
+        Check after every physics step, by default True since a fly
+        falling off the ground cannot be recovered.
+    """
+
+    def __init__(
+        self,
+        bounds: Optional[Tuple[Tuple[float, float], Tuple[float, float]]] = None,
+        flies: Optional[Sequence[str]] = None,
+        every_step: bool = True,
+    ):
+        self.bounds = None if bounds is None else np.array(bounds, dtype=float)
+        self.flies = flies
+        self.every_step = every_step
+
+    def check(self, sim, obs, elapsed):
+        if self.bounds is None:
+            size = np.array(sim.arena.size, dtype=float)
+            self.bounds = np.stack([-size, size], axis=1)
+        flies = self.flies if self.flies is not None else [fly.name for fly in sim.flies]
+        for name in flies:
+            xy = obs[name]["fly"][0, :2]
+            if np.any(xy < self.bounds[:, 0]) or np.any(xy > self.bounds[:, 1]):
+                return f"{name}_left_arena"
+
+
+def odor_taxis_policy(fly, gain: Optional[Schedule] = None) -> Policy:
+    """Odor taxis of an ``OdorTaxisFly``, optionally multiplied by a gain
+    schedule such as ``control_schedules.p1_schedule``."""
+
+    def policy(obs, t):
+        action = fly.process_odor_intensities(obs[fly.name]["odor_intensity"])
+        return action if gain is None else action * gain(t)
+
+    return policy
+
+
+def _as_policy(policy: Union[Policy, Schedule]) -> Policy:
+    if isinstance(policy, Schedule):
+        return lambda obs, t: policy(t)
+    return policy
+
+
+class ScenarioDriver:
+    """Runs a multi-fly scenario at decision granularity.
+
+    At every decision, each policy maps the latest observations and the
+    time to the action of its fly; the action is held for the physics
+    steps of the decision interval. The run stops at the end time or as
+    soon as a termination event fires, even in the middle of an interval
+    for events checked at every step.
+
+    With ``fast_forward``, once all flies have been commanded to stop
+    (all actions zero) for more than ``min_idle_decisions`` decisions in
+    a row, the steps of each interval but the last are bare steps: only
+    the arena and the physics are stepped. The actuator and adhesion
+    commands written by the last full step are held, and the fly
+    controllers (``pre_step``), the observations, the per-step events and
+    the ``on_step`` callbacks are skipped. The controllers have had the
+    normal idle decisions to settle, so a settled controller gives the
+    same motion; internal state such as CPG phases does not advance
+    during bare steps. Of the frames due during bare steps, only one in
+    ``idle_frame_stride`` is rendered, after refreshing the observations
+    the cameras use; the others repeat the previous frame. The last step
+    of each interval is a full step, so the policies and events see fresh
+    observations.
+
+    Parameters
+    ----------
+    sim : Simulation
+        The simulation; it is reset by ``run``.
+    policies : Dict[str, Policy or Schedule]
+        Controller of each fly, keyed by fly name: a function of
+        (observations, time), or a ``Schedule`` of the time only.
+    decision_interval : float
+        Simulation time between two decisions. It can be changed between
+        decisions, e.g. by an adaptive scheduler.
+    events : Iterable[TerminationEvent], optional
+        Termination events.
+    bind_odor_sources : bool, optional
+        Move the odor source of each fly to its position after every
+        step, including bare steps, as in the courtship scenario. By
+        default True.
+    fast_forward : bool, optional
+        Enable the idle fast-forward, by default False.
+    min_idle_decisions : int, optional
+        Number of consecutive idle decisions run normally before fast
+        forwarding, so that short stops are not fast-forwarded, by
+        default 2.
+    render : bool, optional
+        Render the cameras of the simulation, by default True.
+    idle_frame_stride : int, optional
+        Render one in that many of the frames due during bare steps, by
+        default 5.
+    on_step : Callable[[dict, float], None], optional
+        Called with the observations and the time after every full step,
+        e.g. ``RunLogWriter.record``.
+    interval_source : object, optional
+        Object whose ``decision_interval`` attribute is read after the
+        policies of each decision, e.g. an ``OdorTaxisFly`` with an
+        ``AdaptiveDecisionScheduler``.
+    collision_manager : CollisionManager, optional
+        Reset with the simulation and updated after every physics step,
+        including fast-forwarded ones.
+    """
+
+    def __init__(
+        self,
+        sim,
+        policies: Dict[str, Union[Policy, Schedule]],
+        decision_interval: float,
+        events: Iterable[TerminationEvent] = (),
+        bind_odor_sources: bool = True,
+        fast_forward: bool = False,
+        min_idle_decisions: int = 2,
+        render: bool = True,
+        idle_frame_stride: int = 5,
+        on_step: Optional[Callable[[dict, float], None]] = None,
+        interval_source=None,
+        collision_manager=None,
+    ):
+        self.sim = sim
+        self.policies = {name: _as_policy(p) for name, p in policies.items()}
+        self.decision_interval = decision_interval
+        self.events = list(events)
+        self.bind_odor_sources = bind_odor_sources
+        self.fast_forward = fast_forward
+        self.min_idle_decisions = min_idle_decisions
+        self.render = render
+        self.idle_frame_stride = idle_frame_stride
+        self.on_step = on_step
+        self.interval_source = interval_source
+        self.collision_manager = collision_manager
+        self.obs = None
+        self.n_decisions = 0
+        self.n_fast_forward_steps = 0
+        self._n_idle_frames = 0
+
+    def _full_step(self, actions: dict) -> dict:
+        obs, _, _, _, _ = self.sim.step(actions)
+        if self.collision_manager is not None:
+            self.collision_manager.update()
+        if self.bind_odor_sources:
+            bind_odor_sources(self.sim.arena, self.sim, obs)
+        if self.render:
+            render(self.sim)
+        if self.on_step is not None:
+            self.on_step(obs, self.sim.curr_time)
+        return obs
+
+    def _bare_step(self):
+        sim = self.sim
+        sim.arena.step(sim.timestep, sim.physics)
+        sim.physics.step()
+        sim.curr_time += sim.timestep
+        if self.collision_manager is not None:
+            self.collision_manager.update()
+        if self.bind_odor_sources:
+            bind_odor_sources(sim.arena, sim)
+        if self.render and render_due(sim):
+            self._render_idle_frame()
+
+    def _render_idle_frame(self):
+        sim = self.sim
+        if self._n_idle_frames % self.idle_frame_stride == 0:
+            # the cameras read the fly poses and contacts of ``last_obs``
+            for fly in sim.flies:
+                fly.get_observation(sim)
+            render(sim)
+        else:
+            for camera in sim.cameras:
+                if camera._frames and sim.curr_time >= (
+                    len(camera._frames) * camera._eff_render_interval
+                ):
+                    camera._frames.append(camera._frames[-1])
+        self._n_idle_frames += 1
+
+    def _check(self, events, elapsed: float) -> Optional[str]:
+        for event in events:
+            reason = event.check(self.sim, self.obs, elapsed)
+            if reason is not None:
+                return reason
+
+    def reset(self, seed: Optional[int] = None) -> dict:
+        """Resets the arena, the simulation, the collision manager and the
+        events, and returns the first observations."""
+        reset_arena(self.sim)
+        self.obs, _ = self.sim.reset(seed=seed)
+        if self.collision_manager is not None:
+            self.collision_manager.reset()
+        for event in self.events:
+            event.reset()
+        self._n_idle_frames = 0
+        return self.obs
+
+    def run(self, run_time: float, seed: Optional[int] = None) -> dict:
+        """Resets the scenario and runs it.
+
+        Returns
+        -------
+        dict
+            ``"obs"``: last observations; ``"time"``: end time;
+            ``"reason"``: reason of the termination, or "time_limit";
+            ``"n_decisions"`` and ``"n_fast_forward_steps"``.
+        """
+        sim = self.sim
+        self.reset(seed)
+        step_events = [event for event in self.events if event.every_step]
+        decision_events = [event for event in self.events if not event.every_step]
+        self.n_decisions = 0
+        self.n_fast_forward_steps = 0
+        idle_decisions = 0
+        elapsed = 0.0
+        reason = None
+
+        while reason is None and sim.curr_time < run_time:
+            reason = self._check(decision_events, elapsed)
+            if reason is not None:
+                break
+            actions = {
+                name: np.asarray(policy(self.obs, sim.curr_time), dtype=float)
+                for name, policy in self.policies.items()
+            }
+            self.n_decisions += 1
+            if self.interval_source is not None:
+                self.decision_interval = self.interval_source.decision_interval
+            idle = all(not action.any() for action in actions.values())
+            idle_decisions = idle_decisions + 1 if idle else 0
+
+            start_time = sim.curr_time
+            num_steps = max(1, int(round(self.decision_interval / sim.timestep)))
+            num_steps = min(num_steps, int(np.ceil((run_time - start_time) / sim.timestep)))
+            if self.fast_forward and idle_decisions > self.min_idle_decisions:
+                for _ in range(num_steps - 1):
+                    self._bare_step()
+                self.n_fast_forward_steps += num_steps - 1
+                self.obs = self._full_step(actions)
+                reason = self._check(step_events, sim.curr_time - start_time)
+            else:
+                for _ in range(num_steps):
+                    self.obs = self._full_step(actions)
+                    reason = self._check(step_events, sim.timestep)
+                    if reason is not None:
+                        break
+            elapsed = sim.curr_time - start_time
+
+        return {
+            "obs": self.obs,
+            "time": sim.curr_time,
+            "reason": reason or "time_limit",
+            "n_decisions": self.n_decisions,
+            "n_fast_forward_steps": self.n_fast_forward_steps,
+        }
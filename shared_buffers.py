@@ -0,0 +1,342 @@
+import multiprocessing as mp
+import time
+import traceback
+from multiprocessing.shared_memory import SharedMemory
+from typing import Callable, Dict, Optional, Sequence, Tuple
+
+import numpy as np
+from gymnasium import spaces
+
+
+_ALIGNMENT = 64
+
+# Commands written by the parent into the control block
+_STEP, _RESET, _CLOSE = 0, 1, 2
+
+# Interval in seconds at which a waiting parent checks that the workers
+# are alive
+_POLL_INTERVAL = 0.1
+
+
+class ArrayLayout:
+    """Fixed placement of a (nested) dict of arrays in a flat buffer.
+
+    Every field gets a leading batch axis so that the data of all workers
+    lives in one buffer; worker ``i`` only touches index ``i``.
+
+    Parameters
+    ----------
+    fields : Dict[Tuple[str, ...], Tuple[tuple, np.dtype]]
+        Shape and dtype of each field, keyed by its path in the nested
+        dict.
+    batch_size : int
+        Number of workers sharing the buffer.
+    """
+
+    def __init__(self, fields: Dict[Tuple[str, ...], Tuple[tuple, np.dtype]], batch_size: int):
+        self.batch_size = batch_size
+        self.fields = {}
+        offset = 0
+        for path, (shape, dtype) in fields.items():
+            shape = (batch_size, *shape)
+            dtype = np.dtype(dtype)
+            self.fields[path] = (offset, shape, dtype)
+            size = int(np.prod(shape)) * dtype.itemsize
+            offset += -(-size // _ALIGNMENT) * _ALIGNMENT
+        self.nbytes = max(offset, 1)
+
+    @classmethod
+    def from_space(cls, space: spaces.Space, batch_size: int) -> "ArrayLayout":
+        """Derives the layout from a (possibly nested) Gymnasium space,
+        e.g. the observation space of a fly or a ``Simulation``."""
+        fields = {}
+
+        def visit(space, path):
+            if isinstance(space, spaces.Dict):
+                for key, subspace in space.spaces.items():
+                    visit(subspace, (*path, key))
+            elif space.shape is not None:
+                fields[path] = (space.shape, space.dtype)
+            else:
+                raise ValueError(f"Space at {path} has no fixed shape: {space}")
+
+        visit(space, ())
+        return cls(fields, batch_size)
+
+    def views(self, buffer) -> dict:
+        """Returns nested arrays of shape (batch_size, ...) backed by
+        ``buffer``. A layout with a single unnamed field returns the array
+        itself."""
+        arrays = {
+            path: np.ndarray(shape, dtype=dtype, buffer=buffer, offset=offset)
+            for path, (offset, shape, dtype) in self.fields.items()
+        }
+        if list(arrays) == [()]:
+            return arrays[()]
+        nested = {}
+        for path, array in arrays.items():
+            node = nested
+            for key in path[:-1]:
+                node = node.setdefault(key, {})
+            node[path[-1]] = array
+        return nested
+
+
+def _index(data, i):
+    """Selects worker ``i`` in nested batched arrays."""
+    if isinstance(data, dict):
+        return {key: _index(value, i) for key, value in data.items()}
+    return data[i]
+
+
+def _copy_into(dst, src, i=None):
+    """Copies nested ``src`` into the nested views ``dst`` (at worker ``i``
+    if given)."""
+    if isinstance(dst, dict):
+        for key, value in dst.items():
+            _copy_into(value, src[key], i)
+    elif i is None:
+        np.copyto(dst, src)
+    else:
+        dst[i] = src
+
+
+def _attach(name: str) -> SharedMemory:
+    try:
+        return SharedMemory(name=name, track=False)
+    except TypeError:  # Python < 3.13
+        # The block is registered again with the resource tracker, which
+        # the workers share with the parent: the name is already tracked
+        # for the parent, who unlinks it. Unregistering it here would drop
+        # the parent's entry.
+        return SharedMemory(name=name)
+
+
+def _close_blocks(blocks, unlink=False):
+    for block in blocks:
+        try:
+            block.close()
+        except BufferError:
+            # Arrays still referencing the block keep the mapping alive
+            # until they are garbage collected
+            pass
+        if unlink:
+            block.unlink()
+
+
+def _total(value) -> float:
+    """Rewards and flags of a ``Simulation`` come as one value per fly."""
+    if isinstance(value, dict):
+        return sum(value.values())
+    return value
+
+
+def _worker(index, env_fn, conn, step_ready, step_done):
+    env = env_fn()
+    conn.send((env.observation_space, env.action_space))
+    obs_name, act_name, control_name, result_name, batch_size = conn.recv()
+    blocks = [_attach(name) for name in (obs_name, act_name, control_name, result_name)]
+    obs = ArrayLayout.from_space(env.observation_space, batch_size).views(blocks[0].buf)
+    act = ArrayLayout.from_space(env.action_space, batch_size).views(blocks[1].buf)
+    control = np.ndarray((batch_size, 2), dtype=np.int64, buffer=blocks[2].buf)
+    result = np.ndarray((batch_size, 3), dtype=np.float64, buffer=blocks[3].buf)
+
+    try:
+        while True:
+            step_ready.acquire()
+            command, seed = control[index]
+            try:
+                if command == _CLOSE:
+                    break
+                elif command == _RESET:
+                    new_obs, _ = env.reset(seed=None if seed < 0 else int(seed))
+                    result[index] = 0
+                else:
+                    new_obs, reward, terminated, truncated, _ = env.step(_index(act, index))
+                    result[index] = (
+                        _total(reward),
+                        any(terminated.values()) if isinstance(terminated, dict) else terminated,
+                        any(truncated.values()) if isinstance(truncated, dict) else truncated,
+                    )
+                _copy_into(obs, new_obs, index)
+            except Exception:
+                conn.send(traceback.format_exc())
+            step_done.release()
+    finally:
+        env.close()
+        del obs, act, control, result
+        _close_blocks(blocks)
+        step_done.release()
+
+
+class SharedMemoryVectorRunner:
+    """Steps environments in worker processes through shared memory.
+
+    Observations, actions, rewards and done flags are exchanged through
+    preallocated shared-memory arrays whose layout is derived once from
+    the observation and action spaces. Per step, the only inter-process
+    communication is one semaphore release in each direction; nothing is
+    pickled on the hot path.
+
+    Works with any environment following the Gymnasium API, including the
+    flygym ``Simulation`` (nested observations per fly; rewards are summed
+    and done flags combined over the flies). Infos are not transported.
+
+    Parameters
+    ----------
+    env_fns : Sequence[Callable]
+        Picklable functions that build the environments in the workers.
+    context : str, optional
+        Multiprocessing start method, by default "spawn".
+    timeout : float, optional
+        Maximum time in seconds to wait for the workers to complete a
+        reset or a step. By default the runner waits as long as the
+        workers are alive. If a worker dies (e.g. on a crash of the
+        physics) or times out, all workers are stopped and a
+        ``RuntimeError`` is raised.
+
+    Attributes
+    ----------
+    observations : dict or np.ndarray
+        Batched observations of shape (n_envs, ...) in shared memory. They
+        are overwritten by the next step; copy them to keep them.
+    actions : dict or np.ndarray
+        Batched actions in shared memory. They can be written in place
+        before calling ``step()`` without arguments.
+    """
+
+    def __init__(
+        self, env_fns: Sequence[Callable], context: str = "spawn", timeout: Optional[float] = None
+    ):
+        ctx = mp.get_context(context)
+        self.num_envs = len(env_fns)
+        self.timeout = timeout
+        # nothing to release until the shared memory is allocated
+        self._closed = True
+        self._conns = []
+        self._step_ready = [ctx.Semaphore(0) for _ in env_fns]
+        self._step_done = [ctx.Semaphore(0) for _ in env_fns]
+        self._processes = []
+        for i, env_fn in enumerate(env_fns):
+            parent_conn, child_conn = ctx.Pipe()
+            process = ctx.Process(
+                target=_worker,
+                args=(i, env_fn, child_conn, self._step_ready[i], self._step_done[i]),
+                daemon=True,
+            )
+            process.start()
+            # only the worker holds its end, so that its death closes the pipe
+            child_conn.close()
+            self._conns.append(parent_conn)
+            self._processes.append(process)
+
+        env_spaces = []
+        for i, conn in enumerate(self._conns):
+            try:
+                env_spaces.append(conn.recv())
+            except EOFError:
+                self._abort(f"Worker process {i} exited while building its environment")
+        self.observation_space, self.action_space = env_spaces[0]
+        if any(s != env_spaces[0] for s in env_spaces[1:]):
+            raise ValueError("All environments must have the same spaces.")
+
+        obs_layout = ArrayLayout.from_space(self.observation_space, self.num_envs)
+        act_layout = ArrayLayout.from_space(self.action_space, self.num_envs)
+        self._blocks = [
+            SharedMemory(create=True, size=nbytes)
+            for nbytes in (
+                obs_layout.nbytes,
+                act_layout.nbytes,
+                self.num_envs * 2 * 8,
+                self.num_envs * 3 * 8,
+            )
+        ]
+        self.observations = obs_layout.views(self._blocks[0].buf)
+        self.actions = act_layout.views(self._blocks[1].buf)
+        self._control = np.ndarray((self.num_envs, 2), dtype=np.int64, buffer=self._blocks[2].buf)
+        self._result = np.ndarray((self.num_envs, 3), dtype=np.float64, buffer=self._blocks[3].buf)
+        for conn in self._conns:
+            conn.send((*(block.name for block in self._blocks), self.num_envs))
+        self._closed = False
+
+    def _check_open(self):
+        if self._closed:
+            raise RuntimeError("The runner is closed")
+
+    def _run(self, command: int, seeds: Optional[np.ndarray] = None):
+        self._check_open()
+        self._control[:, 0] = command
+        self._control[:, 1] = -1 if seeds is None else seeds
+        for step_ready in self._step_ready:
+            step_ready.release()
+        start = time.monotonic()
+        for i, step_done in enumerate(self._step_done):
+            while not step_done.acquire(timeout=_POLL_INTERVAL):
+                process = self._processes[i]
+                if not process.is_alive():
+                    self._abort(f"Worker process {i} died with exit code {process.exitcode}")
+                if self.timeout is not None and time.monotonic() - start > self.timeout:
+                    self._abort(f"Worker process {i} did not respond within {self.timeout} s")
+        errors = [conn.recv() for conn in self._conns if conn.poll()]
+        if errors:
+            raise RuntimeError("Error in worker process:\n" + errors[0])
+
+    def reset(self, seed: Optional[int] = None):
+        """Resets all environments; worker ``i`` gets ``seed + i``."""
+        seeds = None if seed is None else seed + np.arange(self.num_envs)
+        self._run(_RESET, seeds)
+        return self.observations
+
+    def step(self, actions=None):
+        """Steps all environments.
+
+        Parameters
+        ----------
+        actions : dict or np.ndarray, optional
+            Batched actions of shape (n_envs, ...). If None, the content of
+            ``self.actions`` is used.
+
+        Returns
+        -------
+        observations, rewards, terminated, truncated
+            Batched arrays; ``observations`` are views on shared memory.
+        """
+        self._check_open()
+        if actions is not None:
+            _copy_into(self.actions, actions)
+        self._run(_STEP)
+        rewards = self._result[:, 0].copy()
+        terminated = self._result[:, 1].astype(bool)
+        truncated = self._result[:, 2].astype(bool)
+        return self.observations, rewards, terminated, truncated
+
+    def _abort(self, message: str):
+        """Stops all workers, releases the shared memory and raises."""
+        for process in self._processes:
+            if process.is_alive():
+                process.terminate()
+        for process in self._processes:
+            process.join()
+        if not self._closed:
+            self._closed = True
+            self.observations = self.actions = self._control = self._result = None
+            _close_blocks(self._blocks, unlink=True)
+        raise RuntimeError(message)
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._control[:, 0] = _CLOSE
+        for step_ready in self._step_ready:
+            step_ready.release()
+        for process in self._processes:
+            process.join()
+        self.observations = self.actions = self._control = self._result = None
+        _close_blocks(self._blocks, unlink=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,69 @@
+import importlib.util
+import sys
+from pathlib import Path
+
+import pytest
+
+
+# The modules of the repository are imported by name, as in the notebooks
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+
+def _has_module(name: str) -> bool:
+    try:
+        return importlib.util.find_spec(name) is not None
+    except ModuleNotFoundError:
+        return False
+
+
+# HybridTurningFly and its subclasses need the CPG controller of the
+# flygym examples
+requires_fly_controllers = pytest.mark.skipif(
+    not _has_module("flygym.examples.common"),
+    reason="flygym.examples.common is not available in this flygym version",
+)
+
+
+@pytest.fixture(scope="session")
+def offscreen_rendering():
+    """Skips the test if no offscreen OpenGL context can be created."""
+    mujoco = pytest.importorskip("mujoco")
+    model = mujoco.MjModel.from_xml_string("<mujoco><worldbody/></mujoco>")
+    try:
+        context = mujoco.GLContext(8, 8)
+        context.make_current()
+        mujoco.MjrContext(model, mujoco.mjtFontScale.mjFONTSCALE_100)
+    except Exception as exc:
+        pytest.skip(f"offscreen rendering is not available: {exc}")
+    context.free()
+
+
+def make_flies(*spawn_x, **kwargs):
+    """Returns plain flygym flies named "fly0", "fly1"... spawned along x."""
+    from flygym import Fly
+
+    return [
+        Fly(name=f"fly{i}", spawn_pos=(x, 0, 0.2), **kwargs)
+        for i, x in enumerate(spawn_x)
+    ]
+
+
+def make_sim(flies, cameras=(), **arena_kwargs):
+    """Builds a simulation of the flies in a static ``MovOdorArena`` with
+    one odor source per fly."""
+    import numpy as np
+    from flygym import Simulation
+    from movodor_arena import MovOdorArena
+
+    arena_kwargs.setdefault(
+        "odor_source", np.array([fly.spawn_pos for fly in flies], dtype=float)
+    )
+    arena_kwargs.setdefault("peak_intensity", np.tile([[1, 0]], (len(flies), 1)))
+    arena = MovOdorArena(move_speed=0, **arena_kwargs)
+    return Simulation(flies=flies, arena=arena, cameras=list(cameras), timestep=1e-4)
+
+
+def zero_action(fly):
+    import numpy as np
+
+    return {"joints": np.zeros(len(fly.actuated_joints)), "adhesion": np.zeros(6)}
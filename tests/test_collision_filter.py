@@ -0,0 +1,129 @@
+import numpy as np
+import pytest
+
+from conftest import make_flies, make_sim, zero_action
+
+
+@pytest.fixture(scope="module")
+def sim():
+    from collision_filter import add_inter_fly_contacts
+
+    # fly0 and fly1 overlap, fly2 is far from both
+    flies = make_flies(0.0, 1.0, 30.0)
+    add_inter_fly_contacts(flies, "legs")
+    sim = make_sim(flies)
+    sim.reset()
+    return sim
+
+
+def _inter_fly_contacts(sim, i, j):
+    physics = sim.physics
+    ids = [
+        set(np.atleast_1d(physics.bind(fly.model.find_all("geom")).element_id))
+        for fly in sim.flies
+    ]
+    contact = physics.data.contact
+    return sum(
+        (g1 in ids[i] and g2 in ids[j]) or (g1 in ids[j] and g2 in ids[i])
+        for g1, g2 in zip(contact.geom1, contact.geom2)
+    )
+
+
+def test_fly_geoms_do_not_collide_by_default(sim):
+    # contacts between flies only come from explicit pairs
+    physics = sim.physics
+    for fly in sim.flies:
+        ids = physics.bind(fly.model.find_all("geom")).element_id
+        assert not physics.model.geom_contype[ids].any()
+        assert not physics.model.geom_conaffinity[ids].any()
+
+
+def test_requires_inter_fly_pairs():
+    from collision_filter import CollisionManager
+
+    with pytest.raises(ValueError):
+        CollisionManager(make_sim(make_flies(0.0, 1.0)))
+
+
+def test_contacts_kept_between_close_flies(sim):
+    from collision_filter import CollisionManager
+
+    manager = CollisionManager(sim)
+    try:
+        assert manager.enabled[(0, 1)]
+        sim.physics.forward()
+        assert _inter_fly_contacts(sim, 0, 1) > 0
+    finally:
+        manager.restore()
+
+
+def test_contacts_skipped_between_distant_flies(sim):
+    from collision_filter import CollisionManager
+
+    # a radius below the distance of the overlapping flies disables their
+    # pairs although their geoms intersect: no contact is generated
+    manager = CollisionManager(sim, radius=0.5, hysteresis=0)
+    try:
+        assert not any(manager.enabled.values())
+        sim.physics.forward()
+        assert _inter_fly_contacts(sim, 0, 1) == 0
+    finally:
+        manager.restore()
+    sim.physics.forward()
+    assert _inter_fly_contacts(sim, 0, 1) > 0
+
+
+def test_counts_disabled_pair_steps(sim):
+    from collision_filter import CollisionManager
+
+    manager = CollisionManager(sim, check_interval=2)
+    try:
+        far = [(0, 2), (1, 2)]
+        assert manager.enabled == {(0, 1): True, (0, 2): False, (1, 2): False}
+        n_far_pairs = sum(len(manager.pair_ids[pair]) for pair in far)
+        assert manager.n_disabled == n_far_pairs
+        for _ in range(5):
+            sim.step({fly.name: zero_action(fly) for fly in sim.flies})
+            manager.update()
+        stats = manager.stats()
+        assert stats["n_steps"] == 5
+        assert stats["pair_steps_disabled"] == 5 * n_far_pairs
+        assert stats["fraction_disabled"] == pytest.approx(n_far_pairs / stats["n_pairs"])
+    finally:
+        manager.restore()
+        sim.reset()
+
+
+def test_hysteresis(sim):
+    from collision_filter import CollisionManager
+
+    manager = CollisionManager(sim, radius=0.8, hysteresis=0.5)
+    try:
+        # 1 mm apart: outside the radius, so the pair starts disabled...
+        assert not manager.enabled[(0, 1)]
+        manager.radius = 1.2
+        manager._check()
+        assert manager.enabled[(0, 1)]
+        # ...and stays enabled within radius + hysteresis
+        manager.radius = 0.8
+        manager._check()
+        assert manager.enabled[(0, 1)]
+    finally:
+        manager.restore()
+
+
+def test_disabled_margins_within_bounding_spheres(sim):
+    from collision_filter import CollisionManager
+
+    model = sim.physics.model
+    manager = CollisionManager(sim, radius=0.5, hysteresis=0)
+    try:
+        ids = np.concatenate(list(manager.pair_ids.values()))
+        rbound = model.geom_rbound[model.pair_geom1[ids]] + model.geom_rbound[model.pair_geom2[ids]]
+        # negative, but not so far below zero that the bounding spheres
+        # can no longer reject the pairs
+        assert np.all(model.pair_margin[ids] < 0)
+        assert np.all(model.pair_margin[ids] + rbound > 0)
+    finally:
+        manager.restore()
+    assert np.all(model.pair_margin[ids] == 0)
@@ -0,0 +1,83 @@
+import numpy as np
+import pytest
+
+
+_dt = 1e-3
+
+
+def test_square_wave_plays_full_periods_then_rests():
+    from control_schedules import p1_schedule
+
+    signal = p1_schedule(run_time=5.0, t_high=1.5, t_low=0.5).sample(6.0, _dt)
+    # two full periods fit before 5 s
+    expected = np.ones(6000)
+    expected[1500:2000] = expected[3500:4000] = 0
+    np.testing.assert_array_equal(signal, expected)
+
+
+def test_scalar_and_multichannel_shapes():
+    from control_schedules import Constant, Sinusoid, Stacked
+
+    schedule = Stacked([Constant(1), 2 * Sinusoid(frequency=1, rectify=True)])
+    assert schedule(0.25).shape == (2,)
+    np.testing.assert_allclose(schedule(0.75), [1, 2])
+    assert schedule(np.zeros((3, 4))).shape == (3, 4, 2)
+    assert schedule.sample(1.0, _dt).shape == (1000, 2)
+
+
+def test_piecewise_hold():
+    from control_schedules import PiecewiseHold
+
+    schedule = PiecewiseHold([0.5, 1.0, 2.0], [[1, 0], [0, 1], [2, 2]])
+    np.testing.assert_array_equal(
+        schedule([0.0, 0.5, 0.99, 1.0, 5.0]), [[1, 0], [1, 0], [1, 0], [0, 1], [2, 2]]
+    )
+    with pytest.raises(ValueError):
+        PiecewiseHold([0, 1], [1])
+
+
+def test_inserted_stops_match_spliced_signal():
+    from control_schedules import InsertedStops, Sinusoid
+
+    # times exact in binary, so that no sample falls on a rounded boundary
+    dt = 1 / 1024
+    base = Sinusoid(frequency=2, offset=1)
+    schedule = InsertedStops(base, stops=[(0.5, 0.25), (0.25, 0.125)], base_duration=1.0)
+    dense = base.sample(1.0, dt)
+    # the same stops spliced into the dense signal, as the notebooks did
+    expected = np.concatenate(
+        [dense[:256], np.zeros(128), dense[256:512], np.zeros(256), dense[512:], np.zeros(384)]
+    )
+    np.testing.assert_allclose(schedule.sample(1.75, dt), expected, atol=1e-12)
+
+
+def test_female_walking_schedule_matches_dense_signal():
+    from control_schedules import female_walking_schedule
+
+    run_time, t_stop_middle, t_stop_end, insert = 4.0, 1.3, 1.8, 0.8
+    schedule = female_walking_schedule(run_time, t_stop_middle, t_stop_end, insert, gain=1.2)
+
+    t = np.arange(int((run_time - t_stop_middle - t_stop_end) / _dt)) * _dt
+    walking = 1.2 * np.abs(np.stack([np.cos(np.pi * t / 2), np.sin(np.pi * t / 2)], axis=-1))
+    n_insert = int(insert / _dt)
+    expected = np.concatenate(
+        [
+            walking[:n_insert],
+            np.zeros((int(t_stop_middle / _dt), 2)),
+            walking[n_insert:],
+            np.zeros((int(t_stop_end / _dt), 2)),
+        ]
+    )
+    signal = schedule.sample(run_time, _dt)
+    assert signal.shape == expected.shape
+    np.testing.assert_allclose(signal, expected, atol=1e-9)
+
+
+def test_incomplete_schedule_fails_when_instantiated():
+    from control_schedules import Schedule
+
+    class NoEvaluate(Schedule):
+        pass
+
+    with pytest.raises(TypeError):
+        NoEvaluate()
@@ -0,0 +1,102 @@
+import numpy as np
+import pytest
+
+
+def _female_odor(n, seed=0):
+    """Odor sensed by a female as a male comes and goes: runs of high and
+    low attractive odor, with some aversive odor."""
+    rng = np.random.default_rng(seed)
+    high = np.repeat(rng.random(n // 10) < 0.6, 10)[:n]
+    odor = np.zeros((n, 2, 4))
+    odor[:, 0] = np.where(high, 0.13, 0.05)[:, np.newaxis] + rng.random((n, 4)) * 0.02
+    odor[:, 1] = np.where(rng.random(n) < 0.1, 0.05, 0)[:, np.newaxis]
+    return odor
+
+
+def _engine_states(odor, timestep, **kwargs):
+    from mating_decision import MatingDecisionEngine
+
+    engine = MatingDecisionEngine(**kwargs)
+    return np.array([engine.update(sample[np.newaxis], timestep)[0] for sample in odor])
+
+
+def test_timeline_matches_engine():
+    from courtship_analysis import decision_timeline
+    from mating_decision import MatingDecision
+
+    # a timestep exact in binary, so that both sums round alike
+    odor, timestep = _female_odor(400), 1 / 64
+    expected = _engine_states(odor, timestep, time_before_decision=0.25)
+    states, _ = decision_timeline(odor, timestep, time_before_decision=0.25)
+    np.testing.assert_array_equal(states, expected)
+    assert {MatingDecision.NO_FLY_NEARBY, MatingDecision.FLY_NEARBY} < set(states)
+    assert set(states) & {MatingDecision.ACCEPT, MatingDecision.REJECT}
+
+
+@pytest.mark.parametrize("chunk_size", [7, 64, 400])
+def test_timeline_carried_across_chunks(chunk_size):
+    from courtship_analysis import decision_timeline
+
+    odor, timestep = _female_odor(400, seed=1), 1 / 64
+    expected = _engine_states(odor, timestep, time_before_decision=0.25)
+    parts, carry = [], 0.0
+    for start in range(0, len(odor), chunk_size):
+        states, carry = decision_timeline(
+            odor[start : start + chunk_size],
+            timestep,
+            time_before_decision=0.25,
+            time_since_odor_high=carry,
+        )
+        parts.append(states)
+    np.testing.assert_array_equal(np.concatenate(parts), expected)
+
+
+def test_left_right_intensity_uses_decision_weights():
+    from courtship_analysis import left_right_intensity
+    from mating_decision import MatingDecisionEngine
+
+    odor = _female_odor(20)
+    I_l, I_r = left_right_intensity(odor)
+    smelled = MatingDecisionEngine().smelled_intensity(odor)
+    np.testing.assert_allclose((I_l + I_r) / 2, smelled)
+
+
+@pytest.mark.parametrize("recorded_timestep", [True, False])
+def test_run_log_starting_at_zero_matches_engine(tmp_path, recorded_timestep):
+    from courtship_analysis import RunLogWriter, analyze_run
+
+    odor, timestep = _female_odor(100, seed=2), 1 / 64
+    pos = np.zeros(3)
+    with RunLogWriter(
+        tmp_path, chunk_size=7, timestep=timestep if recorded_timestep else None
+    ) as writer:
+        for i, female_odor in enumerate(odor):
+            obs = {
+                "male": {"fly": pos[np.newaxis], "odor_intensity": female_odor},
+                "female": {"fly": pos[np.newaxis], "odor_intensity": female_odor},
+            }
+            # the first sample is the observation at reset, at t=0
+            writer.record(obs, i * timestep)
+    summary = analyze_run(tmp_path, odor_gains=[1, 0], time_before_decision=0.25)
+    expected = _engine_states(odor, timestep, time_before_decision=0.25)
+    np.testing.assert_array_equal(summary["female_state"], expected)
+    np.testing.assert_allclose(summary["time"], np.arange(100) * timestep)
+
+
+def test_run_log_timestep_passed_explicitly(tmp_path):
+    from courtship_analysis import RunLogWriter, analyze_run
+
+    odor, timestep = _female_odor(30, seed=3), 1 / 64
+    with RunLogWriter(tmp_path, chunk_size=1) as writer:
+        for i, female_odor in enumerate(odor):
+            obs = {
+                fly: {"fly": np.zeros((1, 3)), "odor_intensity": female_odor}
+                for fly in ("male", "female")
+            }
+            writer.record(obs, i * timestep)
+    # single-sample chunks: the timestep cannot be inferred from the first one
+    with pytest.raises(ValueError):
+        analyze_run(tmp_path, odor_gains=[1, 0])
+    summary = analyze_run(tmp_path, odor_gains=[1, 0], timestep=timestep, time_before_decision=0.1)
+    expected = _engine_states(odor, timestep, time_before_decision=0.1)
+    np.testing.assert_array_equal(summary["female_state"], expected)
@@ -0,0 +1,112 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from conftest import requires_fly_controllers
+
+
+def test_pair_results():
+    from courtship_env import pair_results
+    from mating_decision import MatingDecision, MatingDecisionEngine
+
+    engine = MatingDecisionEngine()
+    engine.state[0] = MatingDecision.REJECT
+    male = SimpleNamespace(name="male_0")
+    female = SimpleNamespace(name="female_0", decision_engine=engine)
+    obs = {
+        "male_0": {"fly": np.array([[0, 0, 1], [0, 0, 0]], dtype=float)},
+        "female_0": {"fly": np.array([[3, 4, 0.5], [0, 0, 0]], dtype=float)},
+    }
+    (result,) = pair_results(obs, [(male, female)])
+    assert result["distance"] == pytest.approx(5)
+    assert result["female_state"] is MatingDecision.REJECT
+    # copies, not views on the observations
+    obs["male_0"]["fly"][0] = 10
+    np.testing.assert_array_equal(result["male_pos"], [0, 0, 1])
+
+
+@pytest.fixture(scope="module")
+def env():
+    from courtship_env import CourtshipEnv
+
+    env = CourtshipEnv(decision_interval=0.01, run_time=0.03)
+    yield env
+    env.close()
+
+
+@requires_fly_controllers
+def test_episode(env):
+    obs, info = env.reset(seed=0)
+    assert env.observation_space.contains(obs)
+    assert info["time"] == 0
+    distance = info["distance"]
+    assert distance == pytest.approx(10, abs=0.5)
+
+    truncated = False
+    n_steps = 0
+    while not truncated:
+        obs, reward, terminated, truncated, info = env.step(env.baseline_action())
+        n_steps += 1
+        assert env.observation_space.contains(obs)
+        assert not terminated
+        # the reward is how much closer the male got
+        assert reward == pytest.approx(distance - info["distance"])
+        distance = info["distance"]
+    assert n_steps == 3
+    assert info["time"] == pytest.approx(0.03)
+    # the odor sources follow the flies
+    np.testing.assert_allclose(
+        env.arena.odor_source[1, :2], env._sim_obs["female"]["fly"][0, :2], rtol=1e-6
+    )
+
+
+@requires_fly_controllers
+def test_reset_is_reproducible(env):
+    first, _ = env.reset(seed=1)
+    for _ in range(2):
+        env.step(env.action_space.sample())
+    obs, info = env.reset(seed=1)
+    np.testing.assert_array_equal(obs, first)
+    assert info["female_state"] == 0
+    np.testing.assert_allclose(env.arena.odor_source, [[0, 0, 0], [10, 0, 0]])
+
+
+@requires_fly_controllers
+def test_vector_env():
+    from courtship_env import make_vector_env
+
+    envs = make_vector_env(2, decision_interval=0.01, run_time=0.03)
+    obs, _ = envs.reset(seed=0)
+    assert obs.shape == (2, *envs.single_observation_space.shape)
+    obs, rewards, terminated, truncated, _ = envs.step(envs.action_space.sample())
+    assert rewards.shape == (2,)
+    envs.close()
+
+
+@requires_fly_controllers
+def test_warm_start_keeps_time_consistent():
+    from courtship_env import CourtshipEnv
+    from warm_start import WarmStartCache
+
+    env = CourtshipEnv(
+        decision_interval=0.01, run_time=0.03, warm_start=WarmStartCache(), settle_time=0.02
+    )
+    # settled, then restored from the cache
+    for _ in range(2):
+        obs, info = env.reset(seed=0)
+        assert info["time"] == 0
+        # the simulation and the physics keep the settled time
+        assert env.sim.curr_time == pytest.approx(0.02)
+        assert env.sim.physics.data.time == pytest.approx(env.sim.curr_time)
+        truncated = False
+        n_steps = 0
+        while not truncated:
+            obs, reward, terminated, truncated, info = env.step(env.baseline_action())
+            n_steps += 1
+        # the episode is timed from the settled state
+        assert n_steps == 3
+        assert info["time"] == pytest.approx(0.03)
+        assert env.sim.physics.data.time == pytest.approx(0.05)
+    assert (env.warm_start.n_misses, env.warm_start.n_hits) == (1, 1)
+    env.close()
@@ -0,0 +1,83 @@
+import numpy as np
+import pytest
+
+from conftest import make_sim, requires_fly_controllers
+
+
+def _decide(scheduler, left, right, threshold=1.0):
+    intensity = np.array([[left, right], [0.0, 0.0]])
+    delta_I = (intensity[:, 0] - intensity[:, 1]) / (intensity.mean(axis=1) + 1e-6)
+    return scheduler.update(intensity, delta_I, threshold)
+
+
+def test_interval_grows_while_stable():
+    from decision_scheduler import AdaptiveDecisionScheduler
+
+    scheduler = AdaptiveDecisionScheduler()
+    intervals = [_decide(scheduler, 0.1, 0.1) for _ in range(20)]
+    assert intervals[0] == scheduler.initial_interval
+    assert np.all(np.diff(intervals) >= 0)
+    assert intervals[-1] == scheduler.max_interval
+
+
+def test_interval_shrinks_on_fast_change():
+    from decision_scheduler import AdaptiveDecisionScheduler
+
+    scheduler = AdaptiveDecisionScheduler()
+    _decide(scheduler, 0.1, 0.1)
+    assert _decide(scheduler, 0.3, 0.1) == pytest.approx(scheduler.initial_interval / 2)
+    for left in (0.1, 0.3, 0.1, 0.3, 0.1):
+        interval = _decide(scheduler, left, 0.1)
+    assert interval == scheduler.min_interval
+
+
+def test_shortest_interval_near_threshold():
+    from decision_scheduler import AdaptiveDecisionScheduler
+
+    scheduler = AdaptiveDecisionScheduler()
+    assert _decide(scheduler, 0.95, 0.9) == scheduler.min_interval
+
+
+def test_elapsed_counts_simulated_time_only():
+    from decision_scheduler import AdaptiveDecisionScheduler
+
+    scheduler = AdaptiveDecisionScheduler(initial_interval=0.1, reference_interval=0.05)
+    _decide(scheduler, 0.1, 0.1)
+    # the run ends a fifth of the way into the interval of the decision
+    for _ in range(20):
+        scheduler.advance(1e-3)
+    assert scheduler.elapsed == pytest.approx(0.02)
+    assert scheduler.decisions_saved == pytest.approx(0.02 / 0.05 - 1)
+    assert scheduler.stats()["mean_interval"] == pytest.approx(0.02)
+
+    scheduler.reset()
+    assert scheduler.elapsed == 0
+    assert scheduler.n_decisions == 0
+    assert scheduler.interval == scheduler.initial_interval
+
+
+@requires_fly_controllers
+def test_fly_reset_resets_scheduler():
+    from decision_scheduler import AdaptiveDecisionScheduler
+    from odor_turning_fly import OdorTaxisFly
+
+    scheduler = AdaptiveDecisionScheduler(initial_interval=0.05)
+    fly = OdorTaxisFly(
+        odor_dimensions=2,
+        odor_gains=[-500, 0],
+        decision_scheduler=scheduler,
+        name="fly0",
+        spawn_pos=(0, 0, 0.2),
+    )
+    sim = make_sim([fly])
+    sim.reset()
+    for _ in range(10):
+        _decide(scheduler, 0.1, 0.1)
+        fly.set_decision_interval(scheduler.interval)
+    sim.step({fly.name: np.zeros(2)})
+    assert fly.num_substeps != round(0.05 / fly.timestep)
+
+    sim.reset()
+    assert scheduler.n_decisions == 0
+    assert scheduler.elapsed == 0
+    assert fly.num_substeps == round(0.05 / fly.timestep)
@@ -0,0 +1,79 @@
+"""Importing the fly modules must stay cheap.
+
+The modules are imported with ``python -X importtime`` in a fresh
+interpreter, after the dependencies they cannot avoid (numpy,
+gymnasium.spaces, flygym.simulation). The time of the modules and of
+everything they import on top of these must stay within the budget, and
+none of the heavy optional dependencies may be loaded.
+"""
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+
+_ROOT = Path(__file__).resolve().parents[1]
+_MODULES = (
+    "hybrid_turning_fly",
+    "female_decision_hybri_turn_fly",
+    "odor_turning_fly",
+    "motor_primitives",
+    "movodor_arena",
+)
+_BASELINE = ("numpy", "gymnasium.spaces", "flygym.simulation")
+_FORBIDDEN = (
+    "tqdm",
+    "cv2",
+    "matplotlib",
+    "gymnasium.utils.env_checker",
+    "flygym.examples",
+)
+_BUDGET = 0.15  # seconds for all modules
+_REPEAT = 3
+
+
+def _import_times():
+    """Returns the cumulative import time in seconds of each module
+    imported after the baseline, keyed by module name."""
+    code = f"import {', '.join(_BASELINE)}; import {', '.join(_MODULES)}"
+    out = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=_ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    lines = [line for line in out.stderr.splitlines() if line.startswith("import time:")]
+    # the baseline is imported first: only what follows its last line counts
+    last_baseline = max(
+        i for i, line in enumerate(lines) if line.split("|")[-1].strip() == _BASELINE[-1]
+    )
+    times = {}
+    for line in lines[last_baseline + 1 :]:
+        _, cumulative, name = line.split("|")
+        times[name.strip()] = (int(cumulative) / 1e6, name.startswith("  "))
+    return times
+
+
+@pytest.fixture(scope="module")
+def import_times():
+    pytest.importorskip("flygym.simulation")
+    runs = [_import_times() for _ in range(_REPEAT)]
+    return min(runs, key=lambda times: sum(t for t, nested in times.values() if not nested))
+
+
+def test_import_time_within_budget(import_times):
+    top_level = {name: t for name, (t, nested) in import_times.items() if not nested}
+    assert set(_MODULES) <= set(top_level)
+    total = sum(top_level.values())
+    assert total <= _BUDGET, f"importing {top_level} took {total:.3f} s"
+
+
+def test_no_heavy_imports(import_times):
+    heavy = [
+        name
+        for name in import_times
+        if any(name == f or name.startswith(f + ".") for f in _FORBIDDEN)
+    ]
+    assert not heavy
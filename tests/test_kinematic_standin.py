@@ -0,0 +1,186 @@
+import numpy as np
+import pytest
+from flygym import Fly
+
+from conftest import make_sim, zero_action
+
+
+class _StandInFly(Fly):
+    """Fly checking its stand-in at the start of ``pre_step`` and handing
+    back its model in ``set_pose``, as ``HybridTurningFly`` does."""
+
+    kinematic_standin = None
+
+    def set_pose(self, pose, physics):
+        if self.kinematic_standin is not None:
+            self.kinematic_standin.restore_model(physics)
+        super().set_pose(pose, physics)
+
+    def reset(self, sim, **kwargs):
+        obs, info = super().reset(sim, **kwargs)
+        self.n_controller_steps = 0
+        if self.kinematic_standin is not None:
+            self.kinematic_standin.reset(sim)
+        return obs, info
+
+    def pre_step(self, action, sim):
+        if self.kinematic_standin is not None and self.kinematic_standin.step(sim, self):
+            return
+        self.n_controller_steps += 1
+        return super().pre_step(action, sim)
+
+
+@pytest.fixture(scope="module")
+def sim():
+    from kinematic_standin import KinematicStandIn
+
+    flies = [_StandInFly(name=f"fly{i}", spawn_pos=(x, 0, 0.2)) for i, x in enumerate((0, 10))]
+    # walks 100 mm/s along x, towards fly0
+    flies[1].kinematic_standin = KinematicStandIn(
+        [0, 0.1], [[10, 0, np.nan], [0, 0, np.nan]], partner="fly0", release_distance=9
+    )
+    sim = make_sim(flies)
+    sim.full_model = (sim.physics.model.nv, sim.physics.model.npair)
+    return sim
+
+
+def _step(sim, n, adhesion=0):
+    actions = {fly.name: zero_action(fly) for fly in sim.flies}
+    for action in actions.values():
+        action["adhesion"][:] = adhesion
+    for _ in range(n):
+        obs, *_ = sim.step(actions)
+    return obs
+
+
+def _root(sim, fly):
+    return sim.physics.named.data.xpos[f"{fly.name}/"]
+
+
+def test_rigid_model_keeps_ids(sim):
+    from kinematic_standin import rigid_fly_xml
+
+    root = sim.arena.root_element
+    xml, held = rigid_fly_xml(root.to_xml_string(), "fly1")
+    physics = type(sim.physics).from_xml_string(xml, assets=root.get_assets())
+    full, rigid = sim.physics.model, physics.model
+    for count in ("nbody", "ngeom", "nsite", "ncam", "nsensor"):
+        assert getattr(rigid, count) == getattr(full, count)
+    assert rigid.nv == full.nv // 2
+    assert rigid.nmocap == full.nmocap + 1
+    # the joint, actuator and velocity sensors of the fly become user
+    # sensors of the same size
+    assert {kind for _, kind, _ in held} == {
+        "jointpos",
+        "jointvel",
+        "actuatorfrc",
+        "framelinvel",
+        "frameangvel",
+    }
+    np.testing.assert_array_equal(rigid.sensor_dim, full.sensor_dim)
+
+
+def test_engaged_fly_follows_trajectory(sim, monkeypatch):
+    sim.reset()
+    fly = sim.flies[1]
+    standin = fly.kinematic_standin
+    monkeypatch.setattr(standin, "release_distance", None)
+    standin.engaged = False
+    _step(sim, 10, adhesion=1)
+    standin.engage()
+    posture = fly.get_observation(sim)["joints"][0]
+    height = _root(sim, fly)[2]
+    obs = _step(sim, 200)
+
+    assert standin.engaged and standin.rigid
+    assert standin.n_kinematic_steps == 200
+    assert fly.n_controller_steps == 10
+    # the degrees of freedom and the contacts of the fly are not simulated
+    nv, npair = sim.full_model
+    assert sim.physics.model.nv == nv // 2
+    assert sim.physics.model.npair < npair
+    np.testing.assert_allclose(_root(sim, fly), [10 - 100 * sim.curr_time, 0, height], atol=1e-9)
+    # the sensors report the held posture and the motion of the trajectory
+    np.testing.assert_allclose(obs[fly.name]["joints"][0], posture, atol=1e-6)
+    assert not obs[fly.name]["joints"][1:].any()
+    np.testing.assert_allclose(obs[fly.name]["fly"][1], [-100, 0, 0], atol=1e-3)
+    np.testing.assert_allclose(obs[fly.name]["fly"][3], 0, atol=1e-9)
+    # the other fly still stands on the floor
+    assert sim.flies[0].n_controller_steps == 210
+
+
+def test_other_fly_unaffected(sim, monkeypatch):
+    fly = sim.flies[1]
+    standin = fly.kinematic_standin
+    monkeypatch.setattr(standin, "release_distance", None)
+    runs = []
+    for engaged in (False, True):
+        standin._initially_engaged = engaged
+        sim.reset()
+        _step(sim, 100, adhesion=1)
+        assert standin.rigid == engaged
+        runs.append(sim.physics.named.data.qpos["fly0/"].copy())
+    standin._initially_engaged = True
+    # the state of fly0 is carried over by name; the two models only
+    # differ in the round-off errors of the solver
+    np.testing.assert_allclose(runs[1], runs[0], atol=1e-6)
+
+
+def test_released_near_partner_and_reset(sim):
+    sim.reset()
+    fly = sim.flies[1]
+    standin = fly.kinematic_standin
+    nv, npair = sim.full_model
+    _step(sim, 50)
+    assert standin.rigid and fly.n_controller_steps == 0
+    # within 9 mm of fly0 after about 0.01 s
+    _step(sim, 100)
+    assert not standin.engaged and not standin.rigid
+    assert (sim.physics.model.nv, sim.physics.model.npair) == (nv, npair)
+    n_kinematic = standin.n_kinematic_steps
+    assert 0 < n_kinematic < 150
+    assert fly.n_controller_steps == 150 - n_kinematic
+
+    sim.reset()
+    assert standin.engaged and not standin.rigid
+    assert standin.n_kinematic_steps == 0
+    _step(sim, 20)
+    assert standin.n_kinematic_steps == 20
+    assert fly.n_controller_steps == 0
+
+
+def test_reset_while_engaged(sim):
+    fly = sim.flies[1]
+    standin = fly.kinematic_standin
+    standin._initially_engaged = False
+    sim.reset()
+    qpos = sim.physics.data.qpos.copy()
+    standin._initially_engaged = True
+    _step(sim, 20)
+    sim.reset()
+    _step(sim, 20)
+    assert standin.rigid
+    # the simulation resets the full model
+    sim.reset()
+    assert sim.physics.model.nv == sim.full_model[0]
+    np.testing.assert_array_equal(sim.physics.data.qpos, qpos)
+    assert sim.curr_time == 0
+
+
+def test_release(sim):
+    sim.reset()
+    fly = sim.flies[1]
+    standin = fly.kinematic_standin
+    _step(sim, 20)
+    posture = fly.get_observation(sim)["joints"][0]
+    position = _root(sim, fly).copy()
+    standin.release(sim)
+    assert not standin.rigid
+    # the fly continues from the pose and velocity of the trajectory,
+    # with the posture it was held in
+    np.testing.assert_allclose(_root(sim, fly), position, atol=1e-9)
+    np.testing.assert_allclose(fly.get_observation(sim)["joints"][0], posture, atol=1e-6)
+    np.testing.assert_allclose(sim.physics.named.data.qvel["fly1/"][:3], [-100, 0, 0])
+    _step(sim, 20)
+    assert standin.n_kinematic_steps == 20
+    assert fly.n_controller_steps == 20
@@ -0,0 +1,88 @@
+import numpy as np
+import pytest
+
+
+def _odor(attractive, aversive=0.0):
+    """Intensities of shape (k, w) sensed alike by the four sensors."""
+    return np.array([[attractive] * 4, [aversive] * 4], dtype=float)
+
+
+def test_female_decides_after_male_stayed_nearby():
+    from mating_decision import MatingDecision, MatingDecisionEngine
+
+    engine = MatingDecisionEngine(time_before_decision=0.3)
+    states = []
+    for attractive in [0.05, 0.13, 0.13, 0.13, 0.13, 0.05]:
+        states.append(engine.update(_odor(attractive)[np.newaxis], 0.1)[0])
+    assert states == [
+        MatingDecision.NO_FLY_NEARBY,
+        MatingDecision.FLY_NEARBY,
+        MatingDecision.FLY_NEARBY,
+        MatingDecision.ACCEPT,
+        MatingDecision.ACCEPT,
+        MatingDecision.NO_FLY_NEARBY,
+    ]
+    # the time with the male nearby starts over when he leaves
+    assert engine.time_since_odor_high[0] == 0
+
+
+@pytest.mark.parametrize(
+    "odor, expected",
+    [
+        ((0.13, 0.0), "accept"),
+        ((0.115, 0.05), "reject"),
+        ((0.13, 0.05), "reject"),
+        # high, but not clearly above what she smells from her own source
+        ((0.12, 0.0), "fly_close_but_no_decision"),
+    ],
+)
+def test_decision_depends_on_odor(odor, expected):
+    from mating_decision import MatingDecision, MatingDecisionEngine
+
+    engine = MatingDecisionEngine(odor_own_smelling=0.115, time_before_decision=0)
+    state = engine.update(_odor(*odor)[np.newaxis], 0.1)[0]
+    assert engine.decided[0] == (expected in ("accept", "reject"))
+    assert MatingDecision(state).label == expected
+
+
+def test_females_evaluated_independently():
+    from mating_decision import MatingDecision, MatingDecisionEngine
+
+    decisions = []
+    engine = MatingDecisionEngine(
+        n_flies=3,
+        time_before_decision=0.2,
+        on_decision=lambda i, decision: decisions.append((i, decision)),
+    )
+    odor = np.stack([_odor(0.13), _odor(0.05), _odor(0.115, 0.05)])
+    for _ in range(5):
+        states = engine.update(odor, 0.1)
+    assert states.dtype == np.int8
+    np.testing.assert_array_equal(
+        states, [MatingDecision.ACCEPT, MatingDecision.NO_FLY_NEARBY, MatingDecision.REJECT]
+    )
+    # called once, when the decision is made
+    assert decisions == [(0, MatingDecision.ACCEPT), (2, MatingDecision.REJECT)]
+
+    engine.reset()
+    assert not engine.decided.any()
+    assert not engine.time_since_odor_high.any()
+
+
+def test_classify_matches_update():
+    from mating_decision import MatingDecision, MatingDecisionEngine
+
+    rng = np.random.default_rng(0)
+    odor = np.stack([_odor(a, b) for a, b in zip(rng.uniform(0.05, 0.14, 50), rng.random(50) < 0.2)])
+    engine = MatingDecisionEngine(n_flies=50, time_before_decision=0.15)
+    for _ in range(3):
+        engine.update(odor, 0.1)
+    smelled = engine.smelled_intensity(odor)
+    np.testing.assert_allclose(smelled, odor[:, :, 0])
+    np.testing.assert_array_equal(
+        engine.classify(smelled, engine.time_since_odor_high), engine.state
+    )
+    assert engine.decided.any()
+    # no decision yet with a longer time before a decision
+    later = engine.classify(smelled, engine.time_since_odor_high, 1.0)
+    assert (later <= MatingDecision.FLY_NEARBY).all()
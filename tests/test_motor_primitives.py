@@ -0,0 +1,110 @@
+import numpy as np
+import pytest
+
+
+class _Steps:
+    """Stepping pattern with the interface of flygym's
+    ``PreprogrammedSteps``: each joint angle is the phase times a per-leg
+    factor, so that the base poses are easy to predict."""
+
+    legs = [f"{side}{pos}" for side in "LR" for pos in "FMH"]
+    dofs_per_leg = ["Coxa", "Femur", "Tibia"]
+
+    def __init__(self):
+        self.swing_period = {leg: (1.0, 2.0) for leg in self.legs}
+        self.n_calls = 0
+
+    def get_joint_angles(self, leg, phase):
+        self.n_calls += 1
+        return phase * (self.legs.index(leg) + 1) * np.array([1.0, 2.0, 3.0])
+
+
+_joints = [f"joint_{leg}{dof}" for leg in _Steps.legs for dof in _Steps.dofs_per_leg] + [
+    "joint_A4"
+]
+
+
+def _primitive(**kwargs):
+    from motor_primitives import MotorPrimitive
+
+    kwargs.setdefault("leg_phases", {"LF": (0.0, "swing_end"), "RH": ("swing_start", "swing_start")})
+    return MotorPrimitive("test", **kwargs)
+
+
+def test_compile_ramps_phases_and_applies_keyframes():
+    primitive = _primitive(
+        joint_keyframes={"joint_RHTibia": [(0, 1), (0.5, -1), (1, 0)], "joint_A4": [(0, 0.2)]},
+        leg_stretch={"LF": 0.5},
+        adhesion_off=("RH",),
+    )
+    compiled = primitive.compile(_joints, 5, 1e-4, _Steps())
+    assert compiled.joints.shape == (5, len(_joints))
+    s = np.linspace(0, 1, 5)
+
+    # LF ramps from phase 0 to the end of its swing, 2
+    np.testing.assert_allclose(compiled.joints[:, 0], 2 * s)
+    # RH holds the start of its swing, 1, with its tibia keyframed
+    rh = _joints.index("joint_RHCoxa")
+    np.testing.assert_allclose(compiled.joints[:, rh : rh + 2], np.tile([6, 12], (5, 1)))
+    np.testing.assert_allclose(compiled.joints[:, rh + 2], [1, 0, -1, -0.5, 0])
+    np.testing.assert_allclose(compiled.joints[:, -1], 0.2)
+    # the other legs are not driven
+    assert not compiled.joints[:, 3:15].any()
+    np.testing.assert_array_equal(compiled.adhesion, [1, 1, 1, 1, 1, 0])
+
+
+def test_stretch_subtracts_start_pose():
+    primitive = _primitive(leg_phases={"LM": (1.0, 1.0)}, leg_stretch={"LM": 0.5})
+    compiled = primitive.compile(_joints, 3, 1e-4, _Steps())
+    lm = _joints.index("joint_LMCoxa")
+    start_pose = np.array([2.0, 4.0, 6.0])
+    np.testing.assert_allclose(compiled.joints[:, lm : lm + 3], start_pose * [[1], [0.75], [0.5]])
+
+
+@pytest.mark.parametrize(
+    "kwargs", [{"leg_phases": {"LF": (0, 1)}}, {"joint_keyframes": {"joint_A6": [(0, 0)]}}]
+)
+def test_unknown_joints_rejected(kwargs):
+    primitive = _primitive(**kwargs)
+    with pytest.raises(ValueError):
+        primitive.compile(_joints[3:], 5, 1e-4, _Steps())
+
+
+def test_compiled_actions_are_views():
+    compiled = _primitive().compile(_joints, 4, 1e-3, _Steps())
+    assert len(compiled) == 4
+    assert compiled.duration == pytest.approx(4e-3)
+    assert not compiled.joints.flags.writeable
+    action = compiled.action(1)
+    assert np.shares_memory(action["joints"], compiled.joints)
+    # the last pose is held past the end of the movement
+    np.testing.assert_array_equal(compiled.action(10)["joints"], compiled.joints[-1])
+    assert len(list(compiled.actions())) == 4
+
+
+def test_library_memoizes_and_persists(tmp_path):
+    from motor_primitives import MotorPrimitiveLibrary
+
+    steps = _Steps()
+    library = MotorPrimitiveLibrary([_primitive()], cache_dir=tmp_path, preprogrammed_steps=steps)
+    compiled = library.get("test", _joints, 0.01, 1e-4)
+    assert len(compiled) == 100
+    n_calls = steps.n_calls
+    assert library.get("test", _joints, 0.01, 1e-4) is compiled
+    assert library.get("test", _joints, 0.02, 1e-4) is not compiled
+    assert len(list(tmp_path.glob("test_*.npz"))) == 2
+
+    # a new library loads the compiled primitive from disk
+    steps = _Steps()
+    library = MotorPrimitiveLibrary([_primitive()], cache_dir=tmp_path, preprogrammed_steps=steps)
+    loaded = library.get("test", _joints, 0.01, 1e-4)
+    assert steps.n_calls == 0
+    np.testing.assert_array_equal(loaded.joints, compiled.joints)
+    np.testing.assert_array_equal(loaded.adhesion, compiled.adhesion)
+
+    # a changed definition is compiled again
+    library = MotorPrimitiveLibrary(
+        [_primitive(adhesion_off=("LF",))], cache_dir=tmp_path, preprogrammed_steps=steps
+    )
+    library.get("test", _joints, 0.01, 1e-4)
+    assert steps.n_calls == n_calls
@@ -0,0 +1,162 @@
+import numpy as np
+import pytest
+
+from conftest import requires_fly_controllers
+
+
+def _sensors(center):
+    """Four sensor positions around ``center``."""
+    offsets = np.array([[0.3, 0.2, 0], [0.3, -0.2, 0], [0.2, 0.1, 0], [0.2, -0.1, 0]])
+    return np.asarray(center, dtype=float) + offsets
+
+
+def test_tile_origins():
+    from movodor_arena import tile_origins
+
+    origins = tile_origins((2, 3), (50, 40))
+    assert origins.shape == (6, 3)
+    np.testing.assert_allclose(origins[:3, 0], [-50, 0, 50])
+    np.testing.assert_allclose(origins[::3, 1], [-20, 20])
+    np.testing.assert_allclose(origins.mean(axis=0), 0)
+
+
+def test_many_sources_get_default_colors():
+    from movodor_arena import MovOdorArena
+
+    # more sources than colors in the flygym color cycle
+    odor_source = np.zeros((14, 3))
+    odor_source[:, 0] = np.arange(14) * 5
+    arena = MovOdorArena(odor_source=odor_source, peak_intensity=np.ones((14, 1)))
+    assert len(arena.marker_bodies) == 14
+
+
+def test_olfaction_scoped_to_tile():
+    from movodor_arena import MovOdorArena, tile_origins
+
+    # 6 pairs, i.e. 12 sources: a male and a female source per tile
+    grid, spacing = (2, 3), (50, 50)
+    origins = tile_origins(grid, spacing)
+    offset = np.array([10.0, 0, 0])
+    odor_source = np.concatenate([[origin, origin + offset] for origin in origins])
+    peak = np.tile([[1, 0], [1, 0.5]], (6, 1))
+    arena = MovOdorArena(
+        odor_source=odor_source,
+        peak_intensity=peak,
+        move_speed=0,
+        tile_grid=grid,
+        tile_spacing=spacing,
+    )
+    np.testing.assert_array_equal(arena.tile_index(odor_source), np.repeat(np.arange(6), 2))
+
+    for tile, origin in enumerate(origins):
+        sensors = _sensors(origin + [3, 1, 0])
+        expected = MovOdorArena(
+            odor_source=odor_source[2 * tile : 2 * tile + 2],
+            peak_intensity=peak[2 * tile : 2 * tile + 2],
+            move_speed=0,
+        ).get_olfaction(sensors)
+        np.testing.assert_allclose(arena.get_olfaction(sensors), expected)
+
+
+@requires_fly_controllers
+def test_tiled_courtship_pairs_smell_their_tile():
+    from courtship_env import make_tiled_courtship
+
+    sim, arena, pairs = make_tiled_courtship(n_pairs=6)
+    assert arena.num_odor_sources == 12
+    obs, _ = sim.reset(seed=0)
+    for tile, (male, female) in enumerate(pairs):
+        for fly in (male, female):
+            assert arena.tile_index(obs[fly.name]["fly"][0]) == tile
+        # the male smells his own source and the female of his tile
+        pos = obs[male.name]["fly"][0]
+        own_tile = arena.odor_source[2 * tile : 2 * tile + 2]
+        assert np.linalg.norm(own_tile[:, :2] - pos[:2], axis=1).min() < 1
+        assert obs[male.name]["odor_intensity"].shape == (2, 4)
+
+
+def _marker_pos(sim):
+    return np.array([sim.physics.bind(body).mocap_pos for body in sim.arena.marker_bodies])
+
+
+def test_markers_back_at_initial_pose_after_reset():
+    from conftest import make_flies, make_sim, zero_action
+    from courtship_env import reset_arena
+    from viz_state import sync_visuals
+
+    sim = make_sim(make_flies(0, 10))
+    arena = sim.arena
+    initial = arena.odor_source.copy()
+    actions = {fly.name: zero_action(fly) for fly in sim.flies}
+    sim.reset()
+    np.testing.assert_allclose(_marker_pos(sim), initial)
+    marker_ids = [
+        sim.physics.model.name2id(body.full_identifier, "body") for body in arena.marker_bodies
+    ]
+    for _ in range(5):
+        sim.step(actions)
+    # the markers are only written when the visuals are synced for a frame
+    np.testing.assert_allclose(_marker_pos(sim), initial)
+    sync_visuals(sim)
+    # the markers are raised above the sources, and drawn there
+    np.testing.assert_allclose(_marker_pos(sim)[:, 2], 4)
+    np.testing.assert_allclose(sim.physics.data.xpos[marker_ids], _marker_pos(sim))
+    arena.odor_source[0, :2] = [3, 2]
+    sim.step(actions)
+    sync_visuals(sim)
+
+    # as CourtshipEnv and ScenarioDriver reset the simulation
+    reset_arena(sim)
+    sim.reset()
+    np.testing.assert_allclose(arena.odor_source, initial)
+    np.testing.assert_allclose(_marker_pos(sim), initial)
+    # the markers are rewritten, although the same poses were requested
+    # before the reset
+    sim.step(actions)
+    sync_visuals(sim)
+    expected = initial.copy()
+    expected[:, 2] = 4
+    np.testing.assert_allclose(_marker_pos(sim), expected)
+
+
+def test_visual_state_reset_restores_colors():
+    from conftest import make_flies, make_sim
+    from viz_state import VisualState
+
+    sim = make_sim(make_flies(0))
+    sim.reset()
+    rgba = sim.physics.named.model.geom_rgba
+    original = rgba["fly0/LFTibia"].copy()
+    state = VisualState()
+    state.set_geom_rgba("fly0/LFTibia", (1, 0, 0, 1))
+    assert state.flush(sim.physics) == 1
+    state.set_geom_rgba("fly0/LFTibia", (1, 0, 0, 1))
+    assert not state.dirty
+    # physics.reset does not restore the model colors
+    sim.reset()
+    np.testing.assert_array_equal(rgba["fly0/LFTibia"], (1, 0, 0, 1))
+    state.reset(sim.physics)
+    np.testing.assert_array_equal(rgba["fly0/LFTibia"], original)
+    state.set_geom_rgba("fly0/LFTibia", (1, 0, 0, 1))
+    assert state.flush(sim.physics) == 1
+
+
+@requires_fly_controllers
+def test_simulation_reset_restores_visuals():
+    from flygym import Simulation
+    from hybrid_turning_fly import HybridTurningFly
+    from movodor_arena import MovOdorArena
+    from viz_state import sync_visuals
+
+    arena = MovOdorArena(odor_source=np.array([[5, 0, 0.2]]), peak_intensity=np.ones((1, 2)))
+    fly = HybridTurningFly(name="fly", timestep=1e-4, spawn_pos=(0, 0, 0.2), draw_corrections=True)
+    sim = Simulation(flies=[fly], arena=arena, timestep=1e-4)
+    sim.reset()
+    rgba = sim.physics.model.geom_rgba.copy()
+    marker_pos = _marker_pos(sim)
+    for _ in range(100):
+        sim.step({"fly": np.ones(2)})
+    sync_visuals(sim)
+    sim.reset()
+    np.testing.assert_array_equal(sim.physics.model.geom_rgba, rgba)
+    np.testing.assert_allclose(_marker_pos(sim), marker_pos)
@@ -0,0 +1,152 @@
+import numpy as np
+import pytest
+from flygym import Fly
+
+from conftest import make_sim
+
+
+def _plume(**kwargs):
+    from odor_plume import OdorPlume
+
+    kwargs.setdefault("extent", ((-20, 20), (-20, 20)))
+    return OdorPlume(**kwargs)
+
+
+def _emit(plume, duration, odor_source=((0, 0, 0),), peak=((1, 0),)):
+    odor_source, peak = np.array(odor_source, dtype=float), np.array(peak, dtype=float)
+    for _ in range(int(round(duration / 1e-3))):
+        plume.advance(1e-3, odor_source, peak)
+
+
+@pytest.mark.parametrize("method", ["fft", "stencil"])
+def test_plume_peaks_at_source_and_drifts_downwind(method):
+    plume = _plume(method=method, wind=(20, 0), decay=0)
+    _emit(plume, 0.2)
+    assert plume.field[1].max() == 0
+    x = np.linspace(-10, 10, 41)
+    profile = plume.sample(np.column_stack([x, np.zeros_like(x), np.zeros_like(x)]))
+    assert profile.shape == (2, 41)
+    # more odor downwind than upwind
+    assert profile[0, x > 2].sum() > 2 * profile[0, x < -2].sum()
+    # without decay, all the emitted odor is in the field
+    total = plume.field[0].sum() * plume.resolution**2
+    assert total == pytest.approx(plume.emission_rate * 0.2, rel=0.05)
+
+
+def test_fft_and_stencil_agree():
+    fft, stencil = _plume(method="fft"), _plume(method="stencil")
+    _emit(fft, 0.1)
+    _emit(stencil, 0.1)
+    positions = np.array([[0.3, 0.1, 0], [2, 1, 0], [-3, 0, 0]])
+    expected = fft.sample(positions)
+    # the upwind scheme adds some numerical diffusion
+    np.testing.assert_allclose(
+        stencil.sample(positions), expected, atol=0.1 * expected.max()
+    )
+
+
+def test_field_only_updated_at_update_interval():
+    plume = _plume(update_interval=0.01)
+    _emit(plume, 0.009)
+    assert not plume.field.any()
+    _emit(plume, 0.001)
+    assert plume.field.any()
+    plume.reset()
+    assert not plume.field.any()
+
+
+def test_mapped_field_interpolates_in_time(tmp_path):
+    from odor_plume import MappedOdorField
+
+    frames = np.zeros((3, 5, 5, 2))
+    frames[1, ..., 0] = 1
+    frames[2, ..., 0] = 3
+    np.save(tmp_path / "frames.npy", frames)
+    field = MappedOdorField(
+        tmp_path / "frames.npy", ((0, 4), (0, 4)), frame_interval=0.1
+    )
+    assert field.odor_dimensions == 2
+    sensors = np.array([[1, 1, 0], [2.5, 3.5, 0]])
+    field.advance(0.15)
+    np.testing.assert_allclose(field.sample(sensors), [[2, 2], [0, 0]])
+    # the last frame is held
+    field.advance(1)
+    np.testing.assert_allclose(field.sample(sensors)[0], 3)
+    field.reset()
+    np.testing.assert_allclose(field.sample(sensors), 0)
+    field.close()
+
+
+def test_arena_checks_field_dimensions():
+    from movodor_arena import MovOdorArena
+    from odor_plume import MappedOdorField
+
+    source, peak = np.zeros((1, 3)), np.ones((1, 2))
+    assert _plume(odor_dimensions=2).odor_dimensions == 2
+    MovOdorArena(odor_source=source, peak_intensity=peak, odor_field=_plume())
+    for field in (
+        _plume(odor_dimensions=3),
+        MappedOdorField(np.zeros((2, 4, 4, 1)), ((0, 1), (0, 1)), 0.1, prefetch=0),
+    ):
+        with pytest.raises(ValueError):
+            MovOdorArena(odor_source=source, peak_intensity=peak, odor_field=field)
+
+
+def test_arena_reset_clears_plume_and_sources():
+    from movodor_arena import MovOdorArena
+
+    plume = _plume()
+    odor_source = np.array([[0, 0, 0], [10, 0, 0]], dtype=float)
+    arena = MovOdorArena(
+        odor_source=odor_source, peak_intensity=np.ones((2, 2)), odor_field=plume
+    )
+    _emit(plume, 0.05, arena.odor_source, arena.peak_odor_intensity)
+    arena.odor_source[0] = [5, 5, 0]
+    assert arena.get_olfaction(np.zeros((4, 3))).any()
+
+    arena.reset()
+    np.testing.assert_array_equal(arena.odor_source, odor_source)
+    assert not plume.field.any()
+    assert not arena.get_olfaction(np.zeros((4, 3))).any()
+
+
+class _StillFly(Fly):
+    """Fly holding its initial posture whatever the descending drive."""
+
+    def reset(self, sim, **kwargs):
+        obs, info = super().reset(sim, **kwargs)
+        self.rest_action = {"joints": obs["joints"][0].copy(), "adhesion": np.zeros(6)}
+        return obs, info
+
+    def pre_step(self, action, sim):
+        return super().pre_step(self.rest_action, sim)
+
+
+def test_driver_resets_plume_once_before_first_observation(monkeypatch):
+    from control_schedules import Constant
+    from scenario_driver import ScenarioDriver
+
+    plume = _plume()
+    flies = [
+        _StillFly(name=f"fly{i}", spawn_pos=(x, 0, 0.2), enable_olfaction=True)
+        for i, x in enumerate((0, 10))
+    ]
+    sim = make_sim(flies, odor_field=plume, peak_intensity=np.ones((2, 2)))
+    driver = ScenarioDriver(
+        sim,
+        {fly.name: Constant(0) for fly in flies},
+        decision_interval=0.01,
+        render=False,
+    )
+    driver.run(0.02)
+    assert plume.field.any()
+
+    n_resets = []
+    reset = plume.reset
+    monkeypatch.setattr(plume, "reset", lambda: (n_resets.append(1), reset()))
+    obs = driver.reset()
+    # once for both flies, before their first observations
+    assert len(n_resets) == 1
+    assert not plume.field.any()
+    for fly in flies:
+        assert not obs[fly.name]["odor_intensity"].any()
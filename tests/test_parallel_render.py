@@ -0,0 +1,124 @@
+import numpy as np
+import pytest
+
+from conftest import make_flies, make_sim, zero_action
+
+
+def _step(sim, n):
+    actions = {fly.name: zero_action(fly) for fly in sim.flies}
+    for _ in range(n):
+        sim.step(actions)
+
+
+def _tracking_camera(fly, **kwargs):
+    from flygym import Camera
+
+    return Camera(
+        fly,
+        camera_id=f"{fly.name}/camera_top",
+        window_size=(160, 120),
+        play_speed=0.01,
+        camera_follows_fly_orientation=True,
+        timestamp_text=True,
+        **kwargs,
+    )
+
+
+def test_snapshot_applies_tracking_camera_updates():
+    from parallel_render import ParallelCameraRenderer, _CameraWorker
+
+    flies = make_flies(0.0, 10.0)
+    camera = _tracking_camera(flies[0])
+    sim = make_sim(flies)
+    sim.reset()
+    _step(sim, 20)
+    physics = sim.physics
+    cam_id = physics.model.name2id(camera.camera_id, "camera")
+    with ParallelCameraRenderer(physics, [camera, "birdeye_cam"]) as renderer:
+        snapshot = renderer.snapshot(physics, sim.curr_time, sim._floor_height)
+        # the fixed height and the fly-following rotation of the camera
+        # are part of the snapshot
+        assert snapshot["cam_xpos"][cam_id, 2] == pytest.approx(
+            camera.cam_offset[2] + sim._floor_height
+        )
+        np.testing.assert_array_equal(snapshot["cam_xmat"], physics.data.cam_xmat)
+
+        worker = renderer._workers[camera.camera_id]
+        assert isinstance(worker, _CameraWorker)
+        worker._apply(snapshot)
+        for field in ("cam_xpos", "cam_xmat", "geom_xpos", "geom_xmat", "xpos"):
+            np.testing.assert_array_equal(getattr(worker._data, field), getattr(physics.data, field))
+
+
+def test_render_syncs_deferred_visuals():
+    from parallel_render import ParallelCameraRenderer
+
+    flies = make_flies(0.0, 10.0)
+    sim = make_sim(flies)
+    sim.reset()
+    _step(sim, 5)
+    marker_ids = [
+        sim.physics.model.name2id(body.full_identifier, "body") for body in sim.arena.marker_bodies
+    ]
+    renderer = ParallelCameraRenderer(sim.physics, ["birdeye_cam"])
+    snapshots = []
+    # capture the snapshots instead of rendering them
+    renderer.submit = lambda physics, *args: snapshots.append(renderer.snapshot(physics, *args))
+    renderer.render(sim)
+    assert len(snapshots) == 1
+    # the markers were written and moved before the snapshot was taken
+    np.testing.assert_allclose(snapshots[0]["xpos"][marker_ids, 2], 4)
+    np.testing.assert_allclose(sim.physics.data.mocap_pos[:, 2], 4)
+
+
+def test_overlay_text():
+    from parallel_render import _overlay_text
+
+    camera = _tracking_camera(make_flies(0.0)[0], play_speed_text=True)
+    assert _overlay_text(camera, 0.123) == "0.12s (0.01x)"
+    camera.timestamp_text = False
+    assert _overlay_text(camera, 0.123) == "0.01x"
+    camera.play_speed_text = False
+    assert _overlay_text(camera, 0.123) == ""
+
+
+def test_rejects_contact_arrows():
+    from parallel_render import ParallelCameraRenderer
+
+    flies = make_flies(0.0)
+    camera = _tracking_camera(flies[0], draw_contacts=True)
+    sim = make_sim(flies)
+    with pytest.raises(ValueError):
+        ParallelCameraRenderer(sim.physics, [camera])
+
+
+def test_frames_match_serial_rendering(offscreen_rendering):
+    from parallel_render import ParallelCameraRenderer
+
+    flies = make_flies(0.0, 10.0)
+    serial_camera = _tracking_camera(flies[0])
+    sim = make_sim(flies, cameras=[serial_camera])
+    sim.reset()
+    parallel_camera = _tracking_camera(flies[0])
+    renderer = ParallelCameraRenderer(
+        sim.physics,
+        [parallel_camera, "birdeye_cam"],
+        window_size=(160, 120),
+        fps=serial_camera.fps,
+        play_speed=serial_camera.play_speed,
+    )
+    serial_birdeye = []
+    actions = {fly.name: zero_action(fly) for fly in sim.flies}
+    with renderer:
+        for _ in range(30):
+            sim.step(actions)
+            if sim.render()[0] is not None:
+                serial_birdeye.append(
+                    sim.physics.render(width=160, height=120, camera_id="birdeye_cam").copy()
+                )
+            renderer.render(sim)
+    assert len(renderer.frames[serial_camera.camera_id]) == len(serial_camera._frames) > 1
+    for parallel, serial in zip(renderer.frames[serial_camera.camera_id], serial_camera._frames):
+        assert np.abs(parallel.astype(float) - serial).mean() < 1
+    for parallel, serial in zip(renderer.frames["birdeye_cam"], serial_birdeye):
+        assert np.abs(parallel.astype(float) - serial).mean() < 1
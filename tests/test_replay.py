@@ -0,0 +1,190 @@
+import numpy as np
+import pytest
+
+from conftest import make_flies, make_sim, zero_action
+
+
+def _tracking_camera(fly):
+    from flygym import Camera
+
+    return Camera(
+        fly,
+        camera_id=f"{fly.name}/camera_top",
+        window_size=(160, 120),
+        play_speed=0.01,
+        camera_follows_fly_orientation=True,
+    )
+
+
+def _run(sim, recorder, n_steps, render=False):
+    actions = {fly.name: zero_action(fly) for fly in sim.flies}
+    for _ in range(n_steps):
+        sim.step(actions)
+        if render:
+            sim.render()
+        recorder.record(sim)
+
+
+@pytest.fixture
+def recording(tmp_path):
+    from replay import StateRecorder, save_model
+
+    flies = make_flies(0.0, 10.0)
+    camera = _tracking_camera(flies[0])
+    sim = make_sim(flies)
+    sim.reset()
+    recorder = StateRecorder.for_camera(camera)
+    _run(sim, recorder, 40)
+    save_model(sim, tmp_path / "model.mjb")
+    recorder.save(tmp_path / "trajectory.npz")
+    return sim, camera, recorder, tmp_path
+
+
+def test_records_at_camera_rate(recording):
+    sim, camera, recorder, _ = recording
+    interval = camera.play_speed / camera.fps
+    # first step at or after each frame time, as for the camera
+    frame_times = np.arange(len(recorder)) * interval
+    times = np.array(recorder.times)
+    assert np.all(times >= frame_times - 1e-9)
+    assert np.all(times - sim.timestep < frame_times + 1e-9)
+    assert recorder.times[-1] + interval > sim.curr_time
+
+
+def test_records_tracking_camera_pose(recording):
+    sim, camera, recorder, _ = recording
+    # only the pose of the tracking camera is recorded
+    assert recorder.camera_names == [camera.camera_id]
+    # the height of the camera is fixed above the floor, as when rendered
+    np.testing.assert_allclose(
+        np.array(recorder.cam_xpos)[:, 0, 2], camera.cam_offset[2] + sim._floor_height
+    )
+
+
+def test_records_deferred_markers(recording):
+    sim, _, recorder, _ = recording
+    assert sim.arena.defer_marker_updates
+    # the markers are written for each recorded frame
+    np.testing.assert_allclose(np.array(recorder.mocap_pos)[:, :, 2], 4)
+
+
+def _forward(model, trajectory, frame):
+    import mujoco
+
+    data = mujoco.MjData(model)
+    data.qpos[:] = trajectory["qpos"][frame]
+    data.mocap_pos[:] = trajectory["mocap_pos"][frame]
+    data.mocap_quat[:] = trajectory["mocap_quat"][frame]
+    mujoco.mj_forward(model, data)
+    return data
+
+
+def _check_replayed_state(model, trajectory, camera_name):
+    import mujoco
+    from replay import _set_state, _tracking_camera_ids
+
+    data = mujoco.MjData(model)
+    camera_ids = _tracking_camera_ids(model, trajectory)
+    cam_id = model.camera(camera_name).id
+    np.testing.assert_array_equal(camera_ids, [cam_id])
+    others = np.arange(model.ncam) != cam_id
+    for frame in range(len(trajectory["times"])):
+        _set_state(model, data, trajectory, frame, camera_ids)
+        np.testing.assert_array_equal(data.cam_xpos[cam_id], trajectory["cam_xpos"][frame][0])
+        np.testing.assert_array_equal(data.cam_xmat[cam_id], trajectory["cam_xmat"][frame][0])
+        # bodies, subtree centers of mass and the other cameras as after a
+        # full forward pass
+        reference = _forward(model, trajectory, frame)
+        np.testing.assert_allclose(data.geom_xpos, reference.geom_xpos)
+        np.testing.assert_allclose(data.subtree_com, reference.subtree_com)
+        np.testing.assert_allclose(data.cam_xpos[others], reference.cam_xpos[others])
+        np.testing.assert_allclose(data.cam_xmat[others], reference.cam_xmat[others])
+
+
+def test_set_state_restores_recorded_frame(recording):
+    import mujoco
+    from replay import load_trajectory
+
+    _, camera, _, path = recording
+    model = mujoco.MjModel.from_binary_path(str(path / "model.mjb"))
+    _check_replayed_state(model, load_trajectory(path / "trajectory.npz"), camera.camera_id)
+
+
+def _save_model_with_added_camera(path):
+    """Saves the model of the recorded simulation with one more camera,
+    which comes before the cameras of the flies."""
+    import mujoco
+    from dm_control import mjcf
+
+    sim = make_sim(make_flies(0.0, 10.0))
+    sim.arena.root_element.worldbody.add(
+        "camera", name="added_cam", pos=(5, -30, 20), xyaxes=(1, 0, 0, 0, 0.6, 0.8)
+    )
+    physics = mjcf.Physics.from_mjcf_model(sim.arena.root_element)
+    mujoco.mj_saveModel(physics.model.ptr, str(path), None)
+    model = mujoco.MjModel.from_binary_path(str(path))
+    assert model.ncam == sim.physics.model.ncam + 1
+    return model
+
+
+def test_set_state_with_added_camera(recording):
+    from replay import load_trajectory
+
+    sim, camera, _, path = recording
+    model = _save_model_with_added_camera(path / "edited.mjb")
+    # the tracking camera has another id in the edited model
+    assert model.camera(camera.camera_id).id != sim.physics.model.name2id(
+        camera.camera_id, "camera"
+    )
+    _check_replayed_state(model, load_trajectory(path / "trajectory.npz"), camera.camera_id)
+
+
+def test_replay_renders_added_camera(offscreen_rendering, recording):
+    import mujoco
+    from replay import load_trajectory, render_replay
+
+    _, _, _, path = recording
+    model = _save_model_with_added_camera(path / "edited.mjb")
+    frames = render_replay(
+        path / "edited.mjb",
+        path / "trajectory.npz",
+        "added_cam",
+        window_size=(160, 120),
+        n_workers=0,
+    )
+    trajectory = load_trajectory(path / "trajectory.npz")
+    assert len(frames) == len(trajectory["times"])
+    renderer = mujoco.Renderer(model, height=120, width=160)
+    try:
+        for frame in (0, len(frames) - 1):
+            renderer.update_scene(_forward(model, trajectory, frame), camera="added_cam")
+            expected = renderer.render()
+            assert np.abs(frames[frame].astype(float) - expected).mean() < 1
+    finally:
+        renderer.close()
+
+
+def test_replay_matches_live_frames(offscreen_rendering, tmp_path):
+    from replay import StateRecorder, render_replay, save_model
+
+    flies = make_flies(0.0, 10.0)
+    camera = _tracking_camera(flies[0])
+    sim = make_sim(flies, cameras=[camera])
+    sim.reset()
+    recorder = StateRecorder.for_camera(camera)
+    _run(sim, recorder, 40, render=True)
+    save_model(sim, tmp_path / "model.mjb")
+    recorder.save(tmp_path / "trajectory.npz")
+
+    frames = render_replay(
+        tmp_path / "model.mjb",
+        tmp_path / "trajectory.npz",
+        camera.camera_id,
+        window_size=camera.window_size,
+        n_workers=0,
+    )
+    assert len(frames) == len(camera._frames) > 1
+    for replayed, live in zip(frames, camera._frames):
+        # the live frames carry the play speed text, the replayed ones not
+        replayed, live = replayed[40:].astype(float), live[40:].astype(float)
+        assert np.abs(replayed - live).mean() < 1
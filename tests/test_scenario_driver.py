@@ -0,0 +1,146 @@
+import numpy as np
+import pytest
+from flygym import Fly
+
+from conftest import make_sim
+
+
+class _PhaseFly(Fly):
+    """Fly driven like the CPG flies: the joints oscillate around their
+    initial angles with a phase that keeps advancing and a magnitude that
+    ramps to the descending drive, and the adhesion follows the phase
+    while walking. Stopped, it stands still with all legs adhering."""
+
+    def reset(self, sim, **kwargs):
+        self.n_pre_steps = 0
+        self.n_observations = 0
+        obs, info = super().reset(sim, **kwargs)
+        self.rest_angles = obs["joints"][0].copy()
+        self.phase = 0.0
+        self.magnitude = 0.0
+        return obs, info
+
+    def pre_step(self, action, sim):
+        self.n_pre_steps += 1
+        self.phase += 2 * np.pi * 12 * sim.timestep
+        target = np.abs(action).max()
+        ramp = 200 * sim.timestep
+        self.magnitude += np.clip(target - self.magnitude, -ramp, ramp)
+        joints = self.rest_angles + 0.3 * self.magnitude * np.sin(self.phase)
+        if self.magnitude > 0:
+            adhesion = np.full(6, np.sin(self.phase) > 0, dtype=int)
+        else:
+            adhesion = np.ones(6, dtype=int)
+        return super().pre_step({"joints": joints, "adhesion": adhesion}, sim)
+
+    def get_observation(self, sim):
+        self.n_observations += 1
+        return super().get_observation(sim)
+
+
+def _drive(obs, t):
+    # walk, then stop for the rest of the run
+    return np.ones(1) if t < 0.0175 else np.zeros(1)
+
+
+@pytest.fixture(scope="module")
+def sim():
+    flies = [_PhaseFly(name=f"fly{i}", spawn_pos=(x, 0, 0.2)) for i, x in enumerate((0, 10))]
+    return make_sim(flies)
+
+
+def _run(sim, fast_forward, **kwargs):
+    from scenario_driver import ScenarioDriver
+
+    driver = ScenarioDriver(
+        sim,
+        {fly.name: _drive for fly in sim.flies},
+        decision_interval=0.005,
+        fast_forward=fast_forward,
+        **kwargs,
+    )
+    result = driver.run(0.06)
+    return driver, result, sim.physics.data.qpos.copy()
+
+
+def test_fast_forward_matches_full_run(sim):
+    full_driver, full, full_qpos = _run(sim, fast_forward=False, render=False)
+    full_work = [(fly.n_pre_steps, fly.n_observations) for fly in sim.flies]
+    ff_driver, ff, ff_qpos = _run(sim, fast_forward=True, render=False)
+
+    assert full_driver.n_fast_forward_steps == 0
+    # 8 idle decisions of 50 steps, the first 2 run normally
+    assert ff_driver.n_fast_forward_steps == 6 * 49
+    assert ff["time"] == pytest.approx(full["time"])
+    # neither the controllers nor the sensing ran during the bare steps
+    n_steps = round(0.06 / sim.timestep)
+    for fly, (pre_steps, observations) in zip(sim.flies, full_work):
+        assert pre_steps == n_steps
+        assert fly.n_pre_steps == n_steps - 6 * 49
+        assert fly.n_observations == observations - 6 * 49
+    # the held commands are those of the settled controllers. Full steps
+    # also run ``mj_forward`` when reading the observations after the
+    # control writes, so the runs only agree up to round-off errors,
+    # amplified by the contacts.
+    np.testing.assert_allclose(ff_qpos, full_qpos, atol=1e-4)
+    for fly in sim.flies:
+        np.testing.assert_allclose(
+            ff["obs"][fly.name]["fly"][0], full["obs"][fly.name]["fly"][0], atol=1e-4
+        )
+
+
+def test_fast_forward_decimates_frames(offscreen_rendering):
+    from flygym import Camera
+
+    flies = [_PhaseFly(name=f"fly{i}", spawn_pos=(x, 0, 0.2)) for i, x in enumerate((0, 10))]
+    camera = Camera(flies[0], camera_id="fly0/camera_top", window_size=(64, 48), fps=1000)
+    sim = make_sim(flies, cameras=[camera])
+    rendered = []
+    original_render = camera.render
+
+    def counting_render(*args, **kwargs):
+        img = original_render(*args, **kwargs)
+        if img is not None:
+            rendered.append(img)
+        return img
+
+    camera.render = counting_render
+    _run(sim, fast_forward=False)
+    n_frames = len(camera._frames)
+    assert len(rendered) == n_frames
+    rendered.clear()
+    camera.reset()
+    driver, _, _ = _run(sim, fast_forward=True, idle_frame_stride=5)
+
+    # the video keeps its length, but the frames due during the bare
+    # steps are mostly repeated
+    assert len(camera._frames) == n_frames
+    assert driver._n_idle_frames > 10
+    n_repeated = driver._n_idle_frames - -(-driver._n_idle_frames // 5)
+    assert len(rendered) == n_frames - n_repeated
+    assert sum(a is b for a, b in zip(camera._frames, camera._frames[1:])) == n_repeated
+
+
+def test_bare_steps_bind_odor_sources(sim):
+    from scenario_driver import ScenarioDriver
+
+    driver = ScenarioDriver(
+        sim, {fly.name: _drive for fly in sim.flies}, decision_interval=0.005, render=False
+    )
+    driver.run(0.001)
+    for _ in range(5):
+        driver._bare_step()
+    for j, fly in enumerate(sim.flies):
+        np.testing.assert_allclose(
+            sim.arena.odor_source[j], fly.get_observation(sim)["fly"][0], rtol=1e-6
+        )
+
+
+def test_incomplete_event_fails_when_instantiated():
+    from scenario_driver import TerminationEvent
+
+    class NoCheck(TerminationEvent):
+        pass
+
+    with pytest.raises(TypeError):
+        NoCheck()
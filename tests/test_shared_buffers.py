@@ -0,0 +1,145 @@
+import time
+
+import gymnasium as gym
+import numpy as np
+import pytest
+from gymnasium import spaces
+
+
+class _CounterEnv(gym.Env):
+    """Environment with nested observations, like a flygym ``Simulation``:
+    the position of each "fly" moves by its action and the reward is
+    given per fly."""
+
+    observation_space = spaces.Dict(
+        {
+            "a": spaces.Dict({"pos": spaces.Box(-np.inf, np.inf, (2, 3))}),
+            "b": spaces.Dict({"pos": spaces.Box(-np.inf, np.inf, (2, 3))}),
+        }
+    )
+    action_space = spaces.Dict({"a": spaces.Box(-1, 1, (3,)), "b": spaces.Box(-1, 1, (3,))})
+
+    def reset(self, seed=None, options=None):
+        super().reset(seed=seed)
+        self.pos = {fly: np.zeros((2, 3)) for fly in "ab"}
+        self.pos["a"][1] = self.np_random.random(3)
+        return self._obs(), {}
+
+    def _obs(self):
+        return {fly: {"pos": pos.astype(np.float32)} for fly, pos in self.pos.items()}
+
+    def step(self, action):
+        if np.isnan(action["a"]).any():
+            raise ValueError("invalid action")
+        for fly in "ab":
+            self.pos[fly][0] += action[fly]
+        reward = {fly: float(self.pos[fly][0, 0]) for fly in "ab"}
+        terminated = {fly: bool(self.pos[fly][0, 0] > 2) for fly in "ab"}
+        return self._obs(), reward, terminated, {"a": False, "b": False}, {}
+
+
+def test_layout_places_aligned_fields():
+    from shared_buffers import ArrayLayout
+
+    layout = ArrayLayout.from_space(_CounterEnv.observation_space, batch_size=3)
+    offsets = [offset for offset, _, _ in layout.fields.values()]
+    assert offsets == [0, 128]
+    assert layout.nbytes == 256
+    buffer = bytearray(layout.nbytes)
+    views = layout.views(buffer)
+    assert views["b"]["pos"].shape == (3, 2, 3)
+    views["b"]["pos"][2] = 1
+    assert not views["a"]["pos"].any()
+    # a single unnamed field gives the array itself
+    single = ArrayLayout.from_space(spaces.Box(0, 1, (4,)), batch_size=2)
+    assert single.views(bytearray(single.nbytes)).shape == (2, 4)
+
+
+@pytest.fixture(scope="module")
+def runner():
+    from shared_buffers import SharedMemoryVectorRunner
+
+    with SharedMemoryVectorRunner([_CounterEnv] * 2) as runner:
+        yield runner
+
+
+def test_runner_steps_environments(runner):
+    obs = runner.reset(seed=5)
+    expected = _CounterEnv()
+    for i in range(2):
+        expected_obs, _ = expected.reset(seed=5 + i)
+        np.testing.assert_array_equal(obs["a"]["pos"][i], expected_obs["a"]["pos"])
+
+    actions = {"a": np.array([[1, 0, 0], [0.5, 0, 0]]), "b": np.zeros((2, 3))}
+    for _ in range(3):
+        obs, rewards, terminated, truncated = runner.step(actions)
+    np.testing.assert_allclose(obs["a"]["pos"][:, 0, 0], [3, 1.5])
+    # summed over the flies, done if any fly is
+    np.testing.assert_allclose(rewards, [3, 1.5])
+    np.testing.assert_array_equal(terminated, [True, False])
+    assert not truncated.any()
+
+    # actions written in place
+    runner.actions["b"][:] = 1
+    obs, *_ = runner.step()
+    np.testing.assert_allclose(obs["b"]["pos"][:, 0], 1)
+
+
+def test_worker_errors_raised_in_parent(runner):
+    runner.reset(seed=0)
+    actions = {"a": np.full((2, 3), np.nan), "b": np.zeros((2, 3))}
+    with pytest.raises(RuntimeError, match="invalid action"):
+        runner.step(actions)
+    # the workers keep running
+    obs, *_ = runner.step({"a": np.ones((2, 3)), "b": np.zeros((2, 3))})
+    np.testing.assert_allclose(obs["a"]["pos"][:, 0], 1)
+
+
+class _SlowEnv(_CounterEnv):
+    def step(self, action):
+        if action["a"][0] > 0:
+            time.sleep(10)
+        return super().step(action)
+
+
+def _actions(value=0.0):
+    return {"a": np.full((2, 3), value), "b": np.zeros((2, 3))}
+
+
+def test_dead_worker_raises():
+    from shared_buffers import SharedMemoryVectorRunner
+
+    runner = SharedMemoryVectorRunner([_CounterEnv] * 2)
+    runner.reset(seed=0)
+    runner.step(_actions())
+    process = runner._processes[1]
+    process.kill()
+    process.join()
+    with pytest.raises(RuntimeError, match=r"Worker process 1 died with exit code -9"):
+        runner.step(_actions())
+    # the other workers are stopped and the runner is closed
+    assert not any(process.is_alive() for process in runner._processes)
+    with pytest.raises(RuntimeError, match="closed"):
+        runner.step(_actions())
+    runner.close()
+
+
+def test_unresponsive_worker_times_out():
+    from shared_buffers import SharedMemoryVectorRunner
+
+    with SharedMemoryVectorRunner([_SlowEnv] * 2, timeout=1.0) as runner:
+        runner.reset(seed=0)
+        with pytest.raises(RuntimeError, match="did not respond"):
+            runner.step(_actions(1.0))
+        assert not any(process.is_alive() for process in runner._processes)
+
+
+def _failing_env():
+    raise ValueError("cannot build")
+
+
+def test_worker_failing_to_build_raises():
+    from shared_buffers import SharedMemoryVectorRunner
+
+    with pytest.raises(RuntimeError, match="building its environment"):
+        SharedMemoryVectorRunner([_CounterEnv, _failing_env])
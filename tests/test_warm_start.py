@@ -0,0 +1,145 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+from flygym import Fly
+
+from conftest import make_sim, zero_action
+
+
+class _SeededFly(Fly):
+    """Fly with a seeded random generator drawing its initial phases at
+    reset, like the CPG network of the hybrid turning flies."""
+
+    def reset(self, sim, seed=None, **kwargs):
+        random_state = np.random.RandomState(seed)
+        self.cpg_network = SimpleNamespace(
+            random_state=random_state, curr_phases=random_state.random(6) * 2 * np.pi
+        )
+        return super().reset(sim, **kwargs)
+
+
+def _settle(sim):
+    actions = {fly.name: zero_action(fly) for fly in sim.flies}
+    for _ in range(50):
+        sim.step(actions)
+        for fly in sim.flies:
+            # a settle drawing random numbers
+            fly.cpg_network.random_state.random()
+
+
+@pytest.fixture(scope="module")
+def sim():
+    return make_sim([_SeededFly(name=f"fly{i}", spawn_pos=(x, 0, 0.2)) for i, x in enumerate((0, 10))])
+
+
+def test_hit_restores_settled_state(sim):
+    from warm_start import WarmStartCache
+
+    cache = WarmStartCache()
+    settled, _ = cache.reset(sim, _settle, "stand", seed=0)
+    assert (cache.n_misses, cache.n_hits) == (1, 0)
+    qpos = sim.physics.data.qpos.copy()
+    # the seed is not part of the key
+    restored, _ = cache.reset(sim, _settle, "stand", seed=1)
+    assert (cache.n_misses, cache.n_hits) == (1, 1)
+    np.testing.assert_array_equal(sim.physics.data.qpos, qpos)
+    assert sim.curr_time == pytest.approx(50 * sim.timestep)
+    assert sim.physics.data.time == sim.curr_time
+    for fly in sim.flies:
+        np.testing.assert_array_equal(restored[fly.name]["fly"], settled[fly.name]["fly"])
+
+    cache.reset(sim, _settle, "stand-longer", seed=0)
+    assert (cache.n_misses, cache.n_hits) == (2, 1)
+
+
+def test_random_generators_follow_the_seed(sim):
+    from warm_start import WarmStartCache
+
+    cache = WarmStartCache()
+    draws = {}
+    for run, seed in (("miss", 3), ("hit", 3), ("other seed", 4)):
+        cache.reset(sim, _settle, "stand", seed=seed)
+        draws[run] = [fly.cpg_network.random_state.random() for fly in sim.flies]
+    assert (cache.n_misses, cache.n_hits) == (1, 2)
+    # as seeded by the reset, whether the settle ran or not
+    assert draws["hit"] == draws["miss"]
+    assert draws["other seed"] != draws["miss"]
+    expected = np.random.RandomState(3)
+    expected.random(6)
+    assert draws["miss"][0] == expected.random()
+
+
+def test_model_hashed_once(sim, monkeypatch):
+    from warm_start import WarmStartCache
+
+    root = sim.arena.root_element
+    n_calls = []
+    to_xml_string = type(root).to_xml_string
+
+    def counting(self, *args, **kwargs):
+        n_calls.append(1)
+        return to_xml_string(self, *args, **kwargs)
+
+    monkeypatch.setattr(type(root), "to_xml_string", counting)
+    cache = WarmStartCache()
+    keys = {cache.key(sim, "stand") for _ in range(5)}
+    assert len(keys) == 1
+    assert cache.key(sim, "other") not in keys
+    assert len(n_calls) == 1
+
+
+def _odor_plume():
+    from odor_plume import OdorPlume
+
+    return OdorPlume(extent=((-20, 20), (-20, 20)), update_interval=2e-3)
+
+
+def _mapped_odor_field():
+    from odor_plume import MappedOdorField
+
+    frames = np.random.default_rng(0).random((10, 4, 4, 2))
+    return MappedOdorField(frames, ((-20, 20), (-20, 20)), frame_interval=1e-3, prefetch=0)
+
+
+def _flies():
+    return [
+        _SeededFly(name=f"fly{i}", spawn_pos=(x, 0, 0.2), enable_olfaction=True)
+        for i, x in enumerate((0, 10))
+    ]
+
+
+@pytest.mark.parametrize("make_field", [_odor_plume, _mapped_odor_field])
+def test_hit_restores_odor_field(make_field):
+    from courtship_env import reset_arena
+    from warm_start import WarmStartCache
+
+    odor_field = make_field()
+    sim = make_sim(_flies(), odor_field=odor_field)
+    cache = WarmStartCache()
+    # reset as by CourtshipEnv
+    reset_arena(sim)
+    settled_obs, _ = cache.reset(sim, _settle, "stand")
+    settled = odor_field.get_state()
+    reset_arena(sim)
+    reset = odor_field.get_state()
+    assert any(not np.array_equal(reset[name], value) for name, value in settled.items())
+
+    restored_obs, _ = cache.reset(sim, _settle, "stand")
+    assert cache.n_hits == 1
+    for name, value in odor_field.get_state().items():
+        np.testing.assert_array_equal(value, settled[name])
+    for fly in sim.flies:
+        np.testing.assert_array_equal(
+            restored_obs[fly.name]["odor_intensity"], settled_obs[fly.name]["odor_intensity"]
+        )
+
+
+def test_odor_field_must_match_cached_state():
+    from warm_start import WarmStartCache
+
+    cache = WarmStartCache()
+    cache.reset(make_sim(_flies(), odor_field=_odor_plume()), _settle, "stand")
+    # same model, but no odor field
+    with pytest.raises(ValueError, match="odor field"):
+        cache.reset(make_sim(_flies()), _settle, "stand")
@@ -0,0 +1,119 @@
+class VisualState:
+    """Dirty-tracked visual properties of a model (colors, marker poses).
+
+    Values are requested at any rate with the ``set_*`` methods but only
+    written to the physics by ``flush``, and only if they differ from the
+    value last written. Requests that do not change anything cost a tuple
+    comparison. The values found in the physics before the first write
+    are kept, so that ``reset`` can put them back.
+    """
+
+    def __init__(self):
+        self._applied = {}
+        self._pending = {}
+        self._original = {}
+
+    def _request(self, key, value):
+        value = tuple(float(v) for v in value)
+        if self._applied.get(key) == value:
+            self._pending.pop(key, None)
+        else:
+            self._pending[key] = value
+
+    def set_geom_rgba(self, geom_name: str, rgba):
+        """Requests a color for a geom, given by its full name (e.g.
+        ``"female/LFTibia"``)."""
+        self._request(("geom_rgba", geom_name), rgba)
+
+    def set_mocap_pos(self, body, pos):
+        """Requests a position for a mocap body (an MJCF element)."""
+        self._request(("mocap_pos", body), pos)
+
+    @property
+    def dirty(self) -> bool:
+        return bool(self._pending)
+
+    @property
+    def moves_bodies(self) -> bool:
+        """True if pending requests move mocap bodies."""
+        return any(kind == "mocap_pos" for kind, _ in self._pending)
+
+    def flush(self, physics) -> int:
+        """Writes the pending changes to the physics.
+
+        Returns
+        -------
+        int
+            Number of values written.
+        """
+        for (kind, target), value in self._pending.items():
+            if (kind, target) not in self._original:
+                self._original[(kind, target)] = self._read(physics, kind, target)
+            self._write(physics, kind, target, value)
+            self._applied[(kind, target)] = value
+        n_written = len(self._pending)
+        self._pending.clear()
+        return n_written
+
+    @staticmethod
+    def _read(physics, kind, target):
+        if kind == "geom_rgba":
+            return tuple(physics.named.model.geom_rgba[target])
+        return tuple(physics.bind(target).mocap_pos)
+
+    @staticmethod
+    def _write(physics, kind, target, value):
+        if kind == "geom_rgba":
+            physics.named.model.geom_rgba[target] = value
+        else:
+            physics.bind(target).mocap_pos = value
+
+    def reset(self, physics):
+        """Puts back the values found before the first write and forgets
+        the pending requests, e.g. when the simulation is reset. The model
+        colors are not restored by ``physics.reset``, and the mocap poses
+        it restores would otherwise not be rewritten."""
+        for (kind, target), value in self._original.items():
+            self._write(physics, kind, target, value)
+        self.clear()
+
+    def clear(self):
+        """Forgets the applied values, e.g. after the physics is rebuilt."""
+        self._applied.clear()
+        self._pending.clear()
+        self._original.clear()
+
+
+def render_due(sim) -> bool:
+    """Returns True if any camera of the simulation records a frame at
+    the current time."""
+    return any(
+        sim.curr_time >= len(camera._frames) * camera._eff_render_interval
+        for camera in sim.cameras
+    )
+
+
+def sync_visuals(sim) -> int:
+    """Flushes the visual state of the arena and of all flies. The
+    physics only places moved mocap bodies at the next step; they are
+    placed right away (``mj_kinematics``), so that the frame about to be
+    drawn shows them."""
+    import mujoco
+
+    n_written = 0
+    moved = False
+    for entity in (sim.arena, *sim.flies):
+        visual_state = getattr(entity, "visual_state", None)
+        if visual_state is not None:
+            moved = moved or visual_state.moves_bodies
+            n_written += visual_state.flush(sim.physics)
+    if moved:
+        mujoco.mj_kinematics(sim.physics.model.ptr, sim.physics.data.ptr)
+    return n_written
+
+
+def render(sim):
+    """Brings the visuals up to date if a frame is due, then renders."""
+    if render_due(sim):
+        sync_visuals(sim)
+    return sim.render()
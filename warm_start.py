@@ -0,0 +1,238 @@
+import hashlib
+import weakref
+from pathlib import Path
+from typing import Callable, Dict, Optional, Union
+
+import numpy as np
+
+
+# Controller attributes captured with the physics, as dotted paths from
+# the fly. Missing attributes are skipped.
+_controller_attributes = (
+    "cpg_network.curr_phases",
+    "cpg_network.curr_magnitudes",
+    "retraction_correction",
+    "stumbling_correction",
+)
+_physics_fields = ("ctrl", "act", "mocap_pos", "mocap_quat", "qacc_warmstart")
+# Random generators of the flies, seeded by their reset
+_rng_attributes = ("cpg_network.random_state",)
+
+
+def _get_path(obj, path: str):
+    for name in path.split("."):
+        obj = getattr(obj, name, None)
+        if obj is None:
+            return None
+    return obj
+
+
+def _set_path(obj, path: str, value):
+    *parents, name = path.split(".")
+    for parent in parents:
+        obj = getattr(obj, parent)
+    setattr(obj, name, np.array(value))
+
+
+def hold_action(actions: dict, duration: float) -> Callable:
+    """Returns a settle function stepping the simulation with fixed
+    actions for ``duration`` seconds, e.g. the standing pose of
+    mounting.ipynb or zero descending drives."""
+
+    def settle(sim):
+        for _ in range(int(duration / sim.timestep)):
+            sim.step(actions)
+
+    return settle
+
+
+class WarmStartCache:
+    """Settled initial states of a simulation, computed once and reused.
+
+    The first reset with a given configuration runs the settle function
+    (e.g. letting the flies stand on the ground for 0.2 s) and captures
+    the physics state, the actuator and mocap data, the controller state
+    of each fly, the odor source positions and the state of the odor
+    field of the arena, if any (``get_state``/``set_state``). Later
+    resets with the same configuration restore that state directly.
+
+    The configuration key hashes the MJCF of the whole scene (arena, fly
+    models and spawn poses), the timestep and the settle id, so changing
+    any of them settles again. The odor field is not part of the MJCF:
+    include its parameters in the settle id. The MJCF of a simulation is only
+    serialized and hashed the first time the simulation is reset.
+
+    The seed of the reset is not part of the key: all seeds share the
+    settled state, unless the settle id includes the seed. On a hit as on
+    a miss, the random generators of the flies are left as seeded by the
+    reset, so what follows the settle depends on the seed.
+
+    Parameters
+    ----------
+    cache_dir : str or Path, optional
+        Directory where the states are also stored as ``.npz`` files and
+        shared between processes and runs. By default they are only kept
+        in memory.
+    """
+
+    def __init__(self, cache_dir: Optional[Union[str, Path]] = None):
+        self.cache_dir = None if cache_dir is None else Path(cache_dir)
+        if self.cache_dir is not None:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self._states = {}
+        self._model_digests = weakref.WeakKeyDictionary()
+        self.n_hits = 0
+        self.n_misses = 0
+
+    def key(self, sim, settle_id: str) -> str:
+        """Returns the cache key of the simulation and settle procedure.
+
+        ``settle_id`` must identify everything that changes the outcome of
+        settling but is not part of the model: the settle function and
+        its duration, controller parameters and the seed if it matters.
+        """
+        model_digest = self._model_digests.get(sim)
+        if model_digest is None:
+            xml = sim.arena.root_element.to_xml_string()
+            model_digest = hashlib.sha1(xml.encode()).hexdigest()
+            self._model_digests[sim] = model_digest
+        digest = hashlib.sha1(model_digest.encode())
+        digest.update(repr((sim.timestep, settle_id)).encode())
+        return digest.hexdigest()
+
+    def capture(self, sim) -> Dict[str, np.ndarray]:
+        """Returns the current state of the simulation."""
+        physics = sim.physics
+        state = {
+            "physics/state": np.array(physics.get_state()),
+            "sim/curr_time": np.array(sim.curr_time),
+        }
+        for field in _physics_fields:
+            state[f"physics/{field}"] = np.array(getattr(physics.data, field))
+        odor_source = getattr(sim.arena, "odor_source", None)
+        if odor_source is not None:
+            state["arena/odor_source"] = np.array(odor_source)
+        odor_field = getattr(sim.arena, "odor_field", None)
+        if odor_field is not None:
+            for name, value in odor_field.get_state().items():
+                state[f"arena/odor_field/{name}"] = np.array(value)
+        for fly in sim.flies:
+            for path in _controller_attributes:
+                value = _get_path(fly, path)
+                if value is not None:
+                    state[f"fly/{fly.name}/{path}"] = np.array(value)
+        return state
+
+    def restore(self, sim, state: Dict[str, np.ndarray]) -> dict:
+        """Puts a freshly reset simulation in a captured state. The reset
+        lets the flies and the arena clear their own bookkeeping; the
+        state is then written over it.
+
+        Returns
+        -------
+        dict
+            Observations of the flies, keyed by fly name.
+        """
+        physics = sim.physics
+        with physics.reset_context():
+            physics.set_state(state["physics/state"])
+            for field in _physics_fields:
+                getattr(physics.data, field)[:] = state[f"physics/{field}"]
+        sim.curr_time = float(state["sim/curr_time"])
+        # not part of the physics state of dm_control
+        physics.data.time = sim.curr_time
+        if "arena/odor_source" in state:
+            sim.arena.odor_source[:] = state["arena/odor_source"]
+        prefix = "arena/odor_field/"
+        odor_field_state = {
+            key[len(prefix) :]: value for key, value in state.items() if key.startswith(prefix)
+        }
+        odor_field = getattr(sim.arena, "odor_field", None)
+        if (odor_field is None) != (not odor_field_state):
+            raise ValueError(
+                "The cached state and the arena disagree on the presence of an "
+                "odor field; include the odor field in the settle id."
+            )
+        if odor_field is not None:
+            odor_field.set_state(odor_field_state)
+        for key, value in state.items():
+            if key.startswith("fly/"):
+                _, name, path = key.split("/", 2)
+                fly = next(fly for fly in sim.flies if fly.name == name)
+                _set_path(fly, path, value)
+        return {fly.name: fly.get_observation(sim) for fly in sim.flies}
+
+    @staticmethod
+    def _rng_states(sim) -> dict:
+        states = {}
+        for fly in sim.flies:
+            for path in _rng_attributes:
+                rng = _get_path(fly, path)
+                if rng is not None:
+                    states[(fly.name, path)] = rng.get_state()
+        return states
+
+    @staticmethod
+    def _set_rng_states(sim, states: dict):
+        for fly in sim.flies:
+            for path in _rng_attributes:
+                if (fly.name, path) in states:
+                    _get_path(fly, path).set_state(states[(fly.name, path)])
+
+    def _load(self, key: str) -> Optional[Dict[str, np.ndarray]]:
+        if key in self._states:
+            return self._states[key]
+        if self.cache_dir is not None:
+            path = self.cache_dir / f"{key}.npz"
+            if path.exists():
+                with np.load(path) as data:
+                    self._states[key] = {name: data[name] for name in data.files}
+                return self._states[key]
+        return None
+
+    def _store(self, key: str, state: Dict[str, np.ndarray]):
+        self._states[key] = state
+        if self.cache_dir is not None:
+            np.savez(self.cache_dir / f"{key}.npz", **state)
+
+    def reset(
+        self,
+        sim,
+        settle: Callable,
+        settle_id: str,
+        seed: Optional[int] = None,
+    ):
+        """Resets the simulation into its settled state.
+
+        Parameters
+        ----------
+        sim : Simulation
+            The simulation.
+        settle : Callable
+            Function stepping ``sim`` from a fresh reset to the settled
+            state, e.g. ``hold_action(stand_action, 0.2)``. Only called on
+            a cache miss.
+        settle_id : str
+            Identifier of the settle procedure, see ``key``.
+        seed : int, optional
+            Passed to ``sim.reset``. It is not part of the cache key.
+
+        Returns
+        -------
+        obs, info
+            As returned by ``sim.reset``, but in the settled state.
+        """
+        obs, info = sim.reset(seed=seed)
+        rng_states = self._rng_states(sim)
+        key = self.key(sim, settle_id)
+        state = self._load(key)
+        if state is None:
+            self.n_misses += 1
+            settle(sim)
+            self._store(key, self.capture(sim))
+            obs = {fly.name: fly.get_observation(sim) for fly in sim.flies}
+        else:
+            self.n_hits += 1
+            obs = self.restore(sim, state)
+        self._set_rng_states(sim, rng_states)
+        return obs, info